@@ -4,6 +4,8 @@ from .fs import *
 from .proc import *
 from .comm import *
 from .tools import *
+from .vmstore import *
+from .vbo import *
 from .zrequests import *
 from .hex2bin import *
 try:
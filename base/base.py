@@ -70,12 +70,8 @@ def echo(*args,**kwargs):
     end = kwargs.get("end","\n")
     kwargs.pop("sep",None)
     kwargs.pop("end",None)
-    if args:
-        click.echo(str(args[0]),nl=False,**kwargs)
-        for i in range(1,len(args)):
-            click.echo(str(sep),nl=False,**kwargs)
-            click.echo(str(args[i]),nl=False,**kwargs)
-    click.echo(str(end),nl=False,**kwargs)
+    # a single write per line, so that lines from concurrent uplinks don't mix
+    click.echo(str(sep).join(str(arg) for arg in args)+str(end),nl=False,**kwargs)
 
 
 def critical(*args,**kwargs):
@@ -328,6 +328,12 @@ def init_cfg():
     env.load(env.cfg)
     env.load_dbs(env.cfg,"devices.db")
     env.load_versions(env.cfg)
+    # content addressed native object cache, shareable among projects and machines (disabled if empty)
+    env.native_cache = os.environ.get("ZERYNTH_NATIVE_CACHE",env.var.get("native_cache",""))
+    # max size of the native object cache in MB
+    env.native_cache_size = int(os.environ.get("ZERYNTH_NATIVE_CACHE_SIZE",env.var.get("native_cache_size",1024)))
+    # max size in MB of each of the build caches under env.tmp (modules, toolchain probes, relocations)
+    env.tmp_cache_size = int(os.environ.get("ZERYNTH_TMP_CACHE_SIZE",env.var.get("tmp_cache_size",256)))
     #env.load_zpack_db(env.zdb,"packages.db")
     #env.load_ipack_db(env.idb,"packages.db")
     version = env.var.version
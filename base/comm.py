@@ -1,9 +1,13 @@
 from .base import *
 import serial
 import threading
+import socket
 import sys
 import os
+import time
 import codecs
+import collections
+import selectors
 
 __all__ = ["ConnectionInfo","Channel"]
 
@@ -65,6 +69,211 @@ class ConnectionInfo():
         self.ip = ip
         self.port = port
 
+    def set_port(self,port,**kwargs):
+        # ports like tcp://host:port or socket://host:port are reached over TCP (e.g. serial to ethernet servers)
+        for scheme in ("tcp://","socket://"):
+            if isinstance(port,str) and port.startswith(scheme):
+                host,_,tcpport = port[len(scheme):].rpartition(":")
+                self.set_socket(host,int(tcpport))
+                return
+        self.set_serial(port,**kwargs)
+
+
+class SocketPort():
+    # the part of serial.Serial used by Channel, over a TCP connection.
+    # As in pyserial, timeout is for the whole read or readline: None blocks, 0 returns what is available
+    def __init__(self,ip,port,timeout=None):
+        self.timeout = timeout
+        self.buf = bytearray()
+        self.sock = socket.create_connection((ip,port),timeout=10)
+        self.sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+
+    def _deadline(self):
+        return None if self.timeout is None else time.perf_counter()+self.timeout
+
+    def _recv(self,deadline):
+        self.sock.settimeout(None if deadline is None else max(0,deadline-time.perf_counter()))
+        try:
+            data = self.sock.recv(65536)
+        except (socket.timeout,BlockingIOError):
+            return False
+        if not data:
+            raise serial.SerialException("Connection closed by peer")
+        self.buf+=data
+        return deadline is None or time.perf_counter()<deadline
+
+    def read(self,n=1):
+        deadline = self._deadline()
+        while len(self.buf)<n:
+            if not self._recv(deadline):
+                break
+        data = bytes(self.buf[:n])
+        del self.buf[:n]
+        return data
+
+    def readline(self):
+        deadline = self._deadline()
+        while True:
+            pos = self.buf.find(b"\n")
+            if pos>=0:
+                n = pos+1
+                break
+            if not self._recv(deadline):
+                n = len(self.buf)
+                break
+        data = bytes(self.buf[:n])
+        del self.buf[:n]
+        return data
+
+    def inWaiting(self):
+        if not self.buf:
+            self._recv(0)
+        return len(self.buf)
+
+    def write(self,data):
+        self.sock.settimeout(None)
+        self.sock.sendall(data)
+        return len(data)
+
+    def setDTR(self,val):
+        pass
+
+    def setRTS(self,val):
+        pass
+
+    def close(self):
+        self.sock.close()
+
+
+class Console():
+    # Device output is stored by a reader thread in a bounded buffer and printed in batches, so that
+    # a slow terminal doesn't stall the port. When the buffer is full the oldest bytes are dropped and counted.
+    def __init__(self,channel,logfile=None,stats=False,bufsize=1<<20,period=0.05):
+        self.channel = channel
+        self.logfile = logfile
+        self.stats = stats
+        self.bufsize = bufsize
+        self.period = period
+        self.buf = collections.deque()
+        self.buffered = 0
+        self.received = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.error = None
+        self.logf = None
+        self.line_start = True
+
+    def _reader(self):
+        ch = self.channel.ch
+        try:
+            while not self.stopped.is_set():
+                data = ch.read(ch.inWaiting() or 1)
+                if not data:
+                    continue
+                with self.lock:
+                    self.buf.append(data)
+                    self.buffered+=len(data)
+                    self.received+=len(data)
+                    while self.buffered>self.bufsize:
+                        old = self.buf.popleft()
+                        drop = min(len(old),self.buffered-self.bufsize)
+                        if drop<len(old):
+                            self.buf.appendleft(old[drop:])
+                        self.buffered-=drop
+                        self.dropped+=drop
+        except Exception as e:
+            self.error = e
+        finally:
+            self.stopped.set()
+
+    def _writer(self):
+        try:
+            if os.name!="nt" and sys.stdin.isatty():
+                # wait on stdin with a timeout, so that the thread can see the end of the console
+                sel = selectors.DefaultSelector()
+                sel.register(sys.stdin,selectors.EVENT_READ)
+                fd = sys.stdin.fileno()
+                while not self.stopped.is_set():
+                    if not sel.select(0.2):
+                        continue
+                    data = os.read(fd,1024)
+                    if not data:
+                        # end of input closes the console
+                        self.stopped.set()
+                        return
+                    self.channel.write(data)
+                    if self.channel.echoing: log(data.decode("utf-8","replace"),sep="",end="")
+            else:
+                while not self.stopped.is_set():
+                    data = sys.stdin.read(1)
+                    if not data:
+                        self.stopped.set()
+                        return
+                    self.channel.write(data)
+                    if self.channel.echoing: log(str(data))
+        except Exception as e:
+            # without stdin the console keeps printing
+            debug("Console input stopped:",e)
+
+    def flush(self):
+        with self.lock:
+            data = b"".join(self.buf)
+            self.buf.clear()
+            self.buffered = 0
+        if not data:
+            return
+        text = data.decode("ascii","custom_error")
+        log(text,sep="",end="")
+        if self.logf:
+            ts = time.strftime("%Y-%m-%d %H:%M:%S")+".%03d"%(int(time.time()*1000)%1000)
+            out = []
+            for line in text.splitlines(True):
+                if self.line_start:
+                    out.append("["+ts+"] ")
+                out.append(line)
+                self.line_start = line.endswith("\n")
+            self.logf.write("".join(out))
+            self.logf.flush()
+
+    def report(self,speed):
+        echo(Info("[stats]>"),"%i bytes/s, %i bytes received, %i bytes dropped"%(speed,self.received,self.dropped),err=True)
+
+    def run(self):
+        # short reads, so that the reader can stop
+        self.channel.set_timeout(0.1)
+        if self.logfile:
+            self.logf = open(self.logfile,"a",encoding="utf-8")
+        thr = threading.Thread(target=self._reader,daemon=True)
+        thw = threading.Thread(target=self._writer,daemon=True)
+        thr.start()
+        thw.start()
+        t0 = time.perf_counter()
+        tlast = t0
+        rlast = 0
+        try:
+            while not self.stopped.wait(self.period):
+                self.flush()
+                now = time.perf_counter()
+                if self.stats and now-tlast>=1:
+                    self.report((self.received-rlast)/(now-tlast))
+                    tlast = now
+                    rlast = self.received
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stopped.set()
+            thr.join(1)
+            self.flush()
+            if self.logf:
+                self.logf.close()
+            if self.stats:
+                elapsed = time.perf_counter()-t0
+                self.report(self.received/elapsed if elapsed>0 else 0)
+            self.channel.close()
+        if self.error is not None:
+            critical("Lost connection!")
+
 
 class ChannelException(Exception):
     def __init__(self,e):
@@ -88,41 +297,17 @@ class Channel():
                     rtscts=self.conn.rtscts,
                     timeout=self.timeout)
             else:
-                pass
-                #TODO: implement socket
+                self.ch = SocketPort(self.conn.ip,self.conn.port,timeout=self.timeout)
         except serial.SerialException as se:
             raise ChannelException(se)
         except ValueError as ve:
             raise ChannelException(ve)
+        except OSError as oe:
+            raise ChannelException(oe)
 
-    def _reader(self):
-        try:
-            while True:
-                toread = self.ch.inWaiting() or 1
-                data = self.ch.read(toread)
-                log(data.decode("ascii","custom_error"),sep="",end="")
-        except Exception as e:
-            # print(e)
-            critical("Lost connection!")
-
-    def _writer(self):
-        try:
-            while True:
-                data = sys.stdin.read(1) #TODO: do not block here, try select
-                if not data:
-                    self.close()
-                    return
-                self.write(data)
-                if self.echoing: log(str(data))
-        except Exception as e:
-            print(e)
-
-
-    def run(self):
-        self.thguard = threading.Event()
-        self.thw = threading.Thread(None,target=self._writer)
-        self.thw.start()
-        self._reader()
+    def run(self,logfile=None,stats=False):
+        # interactive console: device output to stdout, stdin to device
+        Console(self,logfile=logfile,stats=stats).run()
 
 
     def get_timeout(self):
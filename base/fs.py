@@ -7,6 +7,7 @@ import tarfile
 import hashlib
 import sys
 import time
+import threading
 from . import yaml
 from .cfg import *
 import glob
@@ -301,6 +302,56 @@ class zfs():
                 ff.write(data)
         
 
+    def atomic_write(self,data,dst):
+        # write through a temporary file renamed over dst: readers never see a partial file and
+        # concurrent writers (processes or threads) don't share the temporary file.
+        # data is str, bytes or a function writing to the binary file object it receives
+        self.check_path(dst)
+        self.makedirs(os.path.dirname(dst) or ".")
+        tmp = "%s.%i.%i.tmp"%(dst,os.getpid(),threading.get_ident())
+        try:
+            with open(tmp,"wb") as ff:
+                if callable(data):
+                    data(ff)
+                elif isinstance(data,str):
+                    ff.write(data.encode("utf8"))
+                else:
+                    ff.write(data)
+            os.replace(tmp,dst)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def trim_dir(self,path,maxsize):
+        # remove the least recently modified files under path until their total size fits in maxsize bytes.
+        # Returns the list of removed files
+        files = []
+        total = 0
+        for root,dirnames,filenames in os.walk(path):
+            for ff in filenames:
+                fp = os.path.join(root,ff)
+                try:
+                    st = os.stat(fp)
+                except:
+                    continue
+                files.append((st.st_mtime,st.st_size,fp))
+                total+=st.st_size
+        removed = []
+        if total<=maxsize:
+            return removed
+        files.sort()
+        for mtime,size,fp in files:
+            if total<=maxsize:
+                break
+            try:
+                os.remove(fp)
+                total-=size
+                removed.append(fp)
+            except:
+                pass
+        return removed
+
     def readfile(self,path,param=""):
         self.check_path(path)
         if param:
@@ -2,6 +2,7 @@ from .base import *
 from .fs import *
 from .cfg import *
 from .pygtrie import *
+from .vmstore import *
 
 __all__ = ["tools"]
 
@@ -122,70 +123,34 @@ class Tools():
         raise KeyError
 
     def get_vm(self,vmuid,version,chipid,target):
-        vmpath = fs.path(env.vms,target,chipid)
-        vmfs = fs.glob(vmpath,"*.vm")
-        vm = None
-        for vmf in vmfs:
-            vmm = fs.basename(vmf)
-            if vmm.startswith(vmuid+"_"+version+"_"):
-                vm=vmf
-        return vm
+        return vmstore.get_path_by_version(vmuid,version,chipid,target)
 
     def get_vminfo_by_uid(self,vmuid):
         pth = self.get_vm_by_uid(vmuid)
         if not pth:
             return None,None,None,None
         else:
-            vm = fs.get_json(pth)
+            vm = self.load_vm(pth)
             return vm["version"],vm["rtos"],vm["features"],vm["on_chip_id"]
 
     def get_vm_by_uid(self,vmuid):
-        #for root,dirnames,files in os.walk(fs.path(env.vms)):
-        for target in fs.dirs(env.vms):
-            for chid in fs.dirs(fs.path(env.vms,target)):
-                for ff in fs.files(fs.path(env.vms,target,chid)):
-                    path_splitted = ff.split('/')
-                    ff_ = fs.basename(ff)
-                    if ff_.startswith(vmuid+"_"):
-                        return fs.path(ff)
-        return None
+        return vmstore.get_path(vmuid)
 
     def get_vms(self,target,chipid=None,full_info=False):
         vms = {}
-        targetpath = fs.path(env.vms,target)
-        if not fs.exists(targetpath):
-            return vms
-        for chid in fs.dirs(targetpath):
-            chid=fs.basename(chid)
-            if chipid and chipid!=chid:
-                continue
-            vmfs = fs.glob(fs.path(targetpath,chid),"*.vm")
-            for vmf in vmfs:
-                vmbf = fs.basename(vmf)
-                rpos = vmbf.rfind("_") #rtos
-                hpos = vmbf.rfind("_",0,rpos-1) #hash
-                vpos = vmbf.rfind("_",0,hpos-1) #version
-                vmrtos = vmbf[rpos+1:-3]
-                vmhash = vmbf[hpos+1:rpos]
-                vmversion = vmbf[vpos+1:hpos]
-                vmuid = vmbf[0:vpos] #TODO: add check
-                if full_info:
-                    vms[vmuid]=(vmf,vmversion,vmrtos,vmhash)
-                else:
-                    vms[vmuid]=vmf
+        for vmuid,vmf,vmversion,vmrtos,vmhash in vmstore.get_vms(target,chipid):
+            if full_info:
+                vms[vmuid]=(vmf,vmversion,vmrtos,vmhash)
+            else:
+                vms[vmuid]=vmf
         return vms
 
     def get_vm_by_prefix(self,vmuid):
-        #for root,dirnames,files in os.walk(fs.path(env.vms)):
-        res = []
-        for target in fs.dirs(env.vms):
-            for chid in fs.dirs(fs.path(env.vms,target)):
-                for ff in fs.files(fs.path(env.vms,target,chid)):
-                    path_splitted = ff.split('/')
-                    ff_ = fs.basename(ff)
-                    if ff_.startswith(vmuid):
-                        res.append(fs.path(ff))
-        return res
+        return vmstore.get_paths_by_prefix(vmuid)
+
+    def load_vm(self,vmfile):
+        # vm content from the index, binaries are read when accessed
+        return vmstore.load(vmfile)
 
     def _parse_order(self,path):
         try:
@@ -0,0 +1,162 @@
+from .base import *
+from .fs import *
+from .vmstore import LazyDict
+import base64
+import json
+import lzma
+import struct
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+__all__ = ["load_vbo","save_vbo","is_binary_vbo","vbo_to_json","VboFile","VboError"]
+
+# Binary bytecode container.
+#
+# The file starts with a fixed header followed by the section table:
+#
+#   "ZVBO" | u16 version | u16 nsections
+#   nsections x (16s name | u8 encoding | u8 compression | u16 reserved | u64 offset | u64 size | u64 raw size)
+#
+# Section data is 16 bytes aligned. Bytecode sections (header, pyobjs, cobjs) are stored raw,
+# all the other fields of the json .vbo are stored as json sections. The repr section (debug info)
+# is compressed.
+#
+# Sections are read by copying: each access seeks to its section and reads just those bytes.
+# The file is not kept open or memory mapped, so it can be replaced while loaded (link writes
+# debug info back to the bytecode file it is relocating), also on Windows.
+
+VBO_MAGIC = b"ZVBO"
+VBO_VERSION = 1
+
+ENC_RAW = 0
+ENC_JSON = 1
+
+COMP_NONE = 0
+COMP_LZMA = 1
+COMP_ZSTD = 2
+
+_compressions = {"none":COMP_NONE,"lzma":COMP_LZMA,"zstd":COMP_ZSTD}
+
+# fields of the json .vbo stored as base64, kept as bytes in binary containers
+RAW_SECTIONS = ("header","pyobjs","cobjs")
+# fields compressed when saving
+COMPRESSED_SECTIONS = ("repr",)
+
+_header = struct.Struct("<4sHH")
+_entry = struct.Struct("<16sBBHQQQ")
+
+
+class VboError(Exception):
+    pass
+
+
+def _compress(data,comp):
+    if comp==COMP_LZMA:
+        return lzma.compress(data)
+    if comp==COMP_ZSTD:
+        if not zstandard:
+            raise VboError("zstd compression is not available, install zstandard")
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+def _decompress(data,comp):
+    if comp==COMP_LZMA:
+        return lzma.decompress(data)
+    if comp==COMP_ZSTD:
+        if not zstandard:
+            raise VboError("zstd compression is not available, install zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+class VboFile():
+    def __init__(self,path):
+        self.path = path
+        self.sections = {}
+        with open(path,"rb") as ff:
+            hdr = ff.read(_header.size)
+            if len(hdr)<_header.size:
+                raise VboError("truncated bytecode file")
+            magic,version,nsections = _header.unpack(hdr)
+            if magic!=VBO_MAGIC:
+                raise VboError("not a binary bytecode file")
+            if version>VBO_VERSION:
+                raise VboError("unsupported bytecode container version "+str(version))
+            table = ff.read(_entry.size*nsections)
+            if len(table)<_entry.size*nsections:
+                raise VboError("truncated section table")
+        for i in range(nsections):
+            name,enc,comp,_,offset,size,rawsize = _entry.unpack_from(table,i*_entry.size)
+            self.sections[name.rstrip(b"\0").decode("ascii")]=(enc,comp,offset,size,rawsize)
+
+    def read(self,name):
+        enc,comp,offset,size,rawsize = self.sections[name]
+        with open(self.path,"rb") as ff:
+            ff.seek(offset)
+            data = ff.read(size)
+        if len(data)<size:
+            raise VboError("truncated section "+name)
+        data = _decompress(data,comp)
+        if enc==ENC_JSON:
+            return json.loads(data.decode("utf-8"))
+        return data
+
+    def load(self):
+        # a dict with the fields of the bytecode, each section is read on first access
+        return LazyDict({},{name:(lambda name=name: self.read(name)) for name in self.sections})
+
+
+def is_binary_vbo(path):
+    with open(path,"rb") as ff:
+        return ff.read(len(VBO_MAGIC))==VBO_MAGIC
+
+
+def load_vbo(path):
+    # load a bytecode file, binary or json
+    if is_binary_vbo(path):
+        return VboFile(path).load()
+    return fs.get_json(path)
+
+
+def save_vbo(bf,path,compress="lzma"):
+    comp = _compressions.get(compress)
+    if comp is None:
+        raise VboError("unknown compression "+str(compress))
+    if isinstance(bf,LazyDict):
+        bf = bf.load()
+    sections = []
+    for name,value in bf.items():
+        if name in RAW_SECTIONS and value is not None:
+            if isinstance(value,str):
+                value = base64.standard_b64decode(value)
+            sections.append((name,ENC_RAW,COMP_NONE,bytes(value),len(value)))
+        else:
+            data = bytes(json.dumps(value,separators=(",",":")),"utf-8")
+            scomp = comp if name in COMPRESSED_SECTIONS else COMP_NONE
+            sections.append((name,ENC_JSON,scomp,_compress(data,scomp),len(data)))
+    buf = bytearray(_header.pack(VBO_MAGIC,VBO_VERSION,len(sections)))
+    offset = len(buf)+_entry.size*len(sections)
+    for name,enc,scomp,data,rawsize in sections:
+        offset = (offset+15)&~15
+        buf+=_entry.pack(bytes(name,"ascii"),enc,scomp,0,offset,len(data),rawsize)
+        offset+=len(data)
+    for name,enc,scomp,data,rawsize in sections:
+        buf+=bytes(((len(buf)+15)&~15)-len(buf))
+        buf+=data
+    fs.atomic_write(bytes(buf),path)
+    return len(buf)
+
+
+def vbo_to_json(bf):
+    # the json .vbo form of a loaded bytecode
+    if isinstance(bf,LazyDict):
+        bf = bf.load()
+    res = {}
+    for name,value in bf.items():
+        if isinstance(value,(bytes,bytearray)):
+            value = str(base64.standard_b64encode(value),"utf-8")
+        res[name]=value
+    return res
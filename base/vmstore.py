@@ -0,0 +1,305 @@
+from .base import *
+from .fs import *
+from .cfg import *
+import json
+import os
+import re
+import sqlite3
+import threading
+
+__all__ = ["vmstore","VmStore","LazyDict"]
+
+# Index of the local virtual machines.
+#
+# VMs are still downloaded as .vm json files in env.vms/<target>/<chipid>/, but every file
+# is parsed once and indexed in vms.db (next to devices.db) with the fields needed for lookups.
+# The metadata of the vm (everything but the binaries) is stored in the index, while for the binaries
+# (the "bin" field and the "dbg" field of the map) the index stores where their json text is in the .vm file:
+# they are read from there only when accessed.
+#
+# The index is updated by add and remove. Files added or removed by hand are picked up once per process,
+# when the index is opened: only the chipid directories whose mtime changed since the last scan are read again.
+
+# fields read lazily: (path in the vm dict, blob name)
+_BLOBS = [(("bin",),"bin"),(("map","dbg"),"dbg")]
+
+# bumped when the layout of the index changes, the index is then rebuilt
+_SCHEMA = 2
+
+_decoder = json.JSONDecoder()
+_ws = re.compile(r"[ \t\n\r]*")
+
+
+def _members(text,idx):
+    # the members of the json object starting at text[idx], as {key:(value,start,end)}
+    # where text[start:end] is the json text of the value
+    members = {}
+    idx = _ws.match(text,idx).end()
+    if text[idx:idx+1]!="{":
+        raise ValueError("not a json object")
+    idx = _ws.match(text,idx+1).end()
+    if text[idx:idx+1]=="}":
+        return members
+    while True:
+        key,idx = _decoder.raw_decode(text,idx)
+        idx = _ws.match(text,idx).end()
+        if text[idx:idx+1]!=":":
+            raise ValueError("bad json object at "+str(idx))
+        start = _ws.match(text,idx+1).end()
+        value,end = _decoder.raw_decode(text,start)
+        members[key]=(value,start,end)
+        idx = _ws.match(text,end).end()
+        if text[idx:idx+1]=="}":
+            return members
+        if text[idx:idx+1]!=",":
+            raise ValueError("bad json object at "+str(idx))
+        idx = _ws.match(text,idx+1).end()
+
+
+class LazyDict(dict):
+    # a dict whose missing keys can be loaded on first access
+    def __init__(self,data,lazy=None):
+        super().__init__(data)
+        self._lazy = dict(lazy or {})
+
+    def __missing__(self,key):
+        loader = self._lazy.get(key)
+        if loader is None:
+            raise KeyError(key)
+        value = loader()
+        self[key]=value
+        self._lazy.pop(key,None)
+        return value
+
+    def __contains__(self,key):
+        return dict.__contains__(self,key) or key in self._lazy
+
+    def get(self,key,default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def load(self):
+        # resolve every lazy field, returning a plain dict
+        res = {}
+        for k in list(dict.keys(self))+list(self._lazy):
+            v = self[k]
+            res[k] = v.load() if isinstance(v,LazyDict) else v
+        return res
+
+
+class VmStore():
+    def __init__(self,dbpath=None,vmspath=None):
+        self.dbpath = dbpath
+        self.vmspath = vmspath
+        self.db = None
+        self.lock = threading.RLock()
+
+    def open(self):
+        if self.db is not None:
+            return self.db
+        with self.lock:
+            if self.db is None:
+                if not self.dbpath:
+                    self.dbpath = fs.path(env.cfg,"vms.db")
+                if not self.vmspath:
+                    self.vmspath = env.vms
+                db = sqlite3.connect(self.dbpath,timeout=60,check_same_thread=False)
+                if db.execute("PRAGMA user_version").fetchone()[0]!=_SCHEMA:
+                    db.execute("DROP TABLE IF EXISTS vms")
+                    db.execute("DROP TABLE IF EXISTS dirs")
+                    db.execute("PRAGMA user_version=%i"%_SCHEMA)
+                # the same vm can be stored for more than one target (custom vms)
+                db.execute("CREATE TABLE IF NOT EXISTS vms (path TEXT PRIMARY KEY, uid TEXT, target TEXT, chipid TEXT, version TEXT, hash TEXT, rtos TEXT, mtime REAL, meta TEXT, blobs TEXT)")
+                db.execute("CREATE INDEX IF NOT EXISTS vms_u_idx ON vms(uid)")
+                db.execute("CREATE INDEX IF NOT EXISTS vms_t_idx ON vms(target,chipid)")
+                # chipid directories and their mtime at the last scan
+                db.execute("CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime REAL)")
+                db.commit()
+                self.db = db
+                self.refresh()
+        return self.db
+
+    def _split_name(self,vmf):
+        # uid_version_hash_rtos.vm
+        vmbf = fs.basename(vmf)
+        rpos = vmbf.rfind("_") #rtos
+        hpos = vmbf.rfind("_",0,rpos-1) #hash
+        vpos = vmbf.rfind("_",0,hpos-1) #version
+        return vmbf[0:vpos],vmbf[vpos+1:hpos],vmbf[hpos+1:rpos],vmbf[rpos+1:-3]
+
+    def _is_blob(self,value):
+        return isinstance(value,str) or (isinstance(value,list) and value and all(isinstance(x,str) for x in value))
+
+    def add(self,vmf):
+        # index the vm file vmf
+        db = self.open()
+        vmf = fs.apath(vmf)
+        try:
+            mtime = fs.stat(vmf).st_mtime
+            data = fs.readfile(vmf,"b")
+            text = data.decode("utf8")
+            members = _members(text,0)
+        except Exception as e:
+            warning("Can't index vm",vmf,e)
+            return None
+        uid,version,vmhash,rtos = self._split_name(vmf)
+        target = fs.basename(fs.dirname(fs.dirname(vmf)))
+        chipid = fs.basename(fs.dirname(vmf))
+        if len(text)==len(data):
+            offset = lambda pos: pos
+        else:
+            # non ascii content: byte offsets differ from text offsets
+            offset = lambda pos: len(text[:pos].encode("utf8"))
+        meta = {k:v[0] for k,v in members.items()}
+        blobs = {}
+        try:
+            for keys,name in _BLOBS:
+                parent = members
+                for k in keys[:-1]:
+                    value,start,end = parent.get(k,(None,0,0))
+                    parent = _members(text,start) if isinstance(value,dict) else {}
+                # anything but base64 strings (or lists of them) stays in the metadata
+                value,start,end = parent.get(keys[-1],(None,0,0))
+                if not self._is_blob(value):
+                    continue
+                blobs[name] = [offset(start),offset(end)]
+                container = meta
+                for k in keys[:-1]:
+                    container = container[k]
+                container.pop(keys[-1])
+        except Exception as e:
+            warning("Can't index vm",vmf,e)
+            return None
+        with self.lock:
+            db.execute("insert or replace into vms values(?,?,?,?,?,?,?,?,?,?)",(vmf,uid,target,chipid,version,vmhash,rtos,mtime,json.dumps(meta),json.dumps(blobs)))
+            db.commit()
+        return uid
+
+    def remove(self,vmf):
+        db = self.open()
+        with self.lock:
+            db.execute("delete from vms where path=?",(fs.apath(vmf),))
+            db.commit()
+
+    def _scan(self,chid):
+        # index the vm files of a chipid directory, dropping the missing ones
+        db = self.open()
+        with self.lock:
+            rows = db.execute("select path,mtime from vms where path>=? and path<?",(chid+os.sep,chid+os.sep+"\uffff")).fetchall()
+        known = {row[0]:row[1] for row in rows if fs.dirname(row[0])==chid}
+        found = set()
+        for vmf in fs.glob(chid,"*.vm"):
+            vmf = fs.apath(vmf)
+            found.add(vmf)
+            if vmf not in known or known[vmf]!=fs.stat(vmf).st_mtime:
+                self.add(vmf)
+        for vmf in known:
+            if vmf not in found:
+                self.remove(vmf)
+
+    def _chipid_dirs(self,target=None):
+        # {chipid directory: mtime}
+        dirs = {}
+        vmspath = fs.apath(self.vmspath)
+        targets = [fs.path(vmspath,target)] if target else (fs.dirs(vmspath) if fs.exists(vmspath) else [])
+        for tpath in targets:
+            if not fs.exists(tpath):
+                continue
+            for chid in fs.dirs(tpath):
+                try:
+                    dirs[fs.apath(chid)] = os.stat(chid).st_mtime
+                except OSError:
+                    pass
+        return dirs
+
+    def refresh(self):
+        # read again the chipid directories changed since the last scan: adding or removing
+        # a vm file changes the mtime of its directory
+        db = self.open()
+        with self.lock:
+            known = dict(db.execute("select path,mtime from dirs").fetchall())
+        current = self._chipid_dirs()
+        for chid,mtime in current.items():
+            if known.get(chid)!=mtime:
+                self._scan(chid)
+        with self.lock:
+            for chid in known:
+                if chid not in current:
+                    db.execute("delete from vms where path>=? and path<?",(chid+os.sep,chid+os.sep+"\uffff"))
+            db.execute("delete from dirs")
+            db.executemany("insert into dirs values(?,?)",current.items())
+            db.commit()
+
+    def sync(self,target=None):
+        # explicit full scan: add vm files not yet indexed (or modified) and drop the missing ones
+        db = self.open()
+        current = self._chipid_dirs(target)
+        for chid in current:
+            self._scan(chid)
+        with self.lock:
+            rows = db.execute("select path from vms where target=?",(target,)) if target else db.execute("select path from vms")
+            stale = [row[0] for row in rows if fs.dirname(row[0]) not in current]
+            for vmf in stale:
+                db.execute("delete from vms where path=?",(vmf,))
+            db.executemany("insert or replace into dirs values(?,?)",current.items())
+            db.commit()
+
+    def _rows(self,query,args):
+        db = self.open()
+        with self.lock:
+            return db.execute(query,args).fetchall()
+
+    def get_path(self,uid):
+        rows = self._rows("select path from vms where uid=?",(uid,))
+        return rows[0][0] if rows else None
+
+    def get_path_by_version(self,uid,version,chipid,target):
+        rows = self._rows("select path from vms where uid=? and version=? and chipid=? and target=?",(uid,version,chipid,target))
+        return rows[0][0] if rows else None
+
+    def get_paths_by_prefix(self,prefix):
+        # uid prefix match on the uid index
+        rows = self._rows("select path from vms where uid>=? and uid<?",(prefix,prefix+"\uffff"))
+        return [row[0] for row in rows]
+
+    def get_vms(self,target,chipid=None):
+        if chipid:
+            return self._rows("select uid,path,version,rtos,hash from vms where target=? and chipid=?",(target,chipid))
+        return self._rows("select uid,path,version,rtos,hash from vms where target=?",(target,))
+
+    def _blob_loader(self,vmf,mtime,keys,span):
+        def load():
+            if fs.stat(vmf).st_mtime!=mtime:
+                # the vm file changed after it was loaded: the span is no longer valid
+                value = fs.get_json(vmf)
+                for k in keys:
+                    value = value[k]
+                return value
+            with open(vmf,"rb") as ff:
+                ff.seek(span[0])
+                return json.loads(ff.read(span[1]-span[0]).decode("utf8"))
+        return load
+
+    def load(self,vmf):
+        # the content of vm file vmf with binaries loaded on first access
+        vmf = fs.apath(vmf)
+        db = self.open()
+        with self.lock:
+            row = db.execute("select uid,mtime,meta,blobs from vms where path=?",(vmf,)).fetchone()
+        if not row or row[1]!=fs.stat(vmf).st_mtime:
+            if not self.add(vmf):
+                return fs.get_json(vmf)
+            with self.lock:
+                row = db.execute("select uid,mtime,meta,blobs from vms where path=?",(vmf,)).fetchone()
+        meta = json.loads(row[2])
+        blobs = json.loads(row[3])
+        lazy = {name:self._blob_loader(vmf,row[1],keys,blobs[name]) for keys,name in _BLOBS if name in blobs}
+        vm = LazyDict(meta,{"bin":lazy["bin"]} if "bin" in lazy else None)
+        if isinstance(meta.get("map"),dict):
+            vm["map"] = LazyDict(meta["map"],{"dbg":lazy["dbg"]} if "dbg" in lazy else None)
+        return vm
+
+
+vmstore = VmStore()
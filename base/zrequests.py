@@ -7,6 +7,11 @@ from .fs import *
 from encodings import idna
 import time
 import os
+import threading
+import hashlib
+import urllib.parse
+import requests.adapters
+import urllib3.exceptions
 
 TimeoutException = requests.exceptions.Timeout
 if int(os.environ.get("ZERYNTH_TESTMODE",0))!=0:
@@ -18,6 +23,84 @@ else:
 
 _default_timeout=5
 _default_retries=3
+# seconds before the first retry, doubled at each attempt
+_default_backoff=0.5
+# methods that can be sent again after a response was lost or was a server error
+_idempotent_methods = ("GET","HEAD","OPTIONS","DELETE")
+# seconds without data before a download is resumed
+_download_timeout=30
+
+_session = None
+_session_lock = threading.Lock()
+_host_limits = {}
+
+
+def _setting(name,envvar,default):
+    # environment variable first, then configuration (if already loaded)
+    if envvar in os.environ:
+        return int(os.environ[envvar])
+    try:
+        return int(env.var.get(name,default))
+    except AttributeError:
+        return default
+
+def get_session():
+    # process wide session: connections are kept alive and reused by all requests
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                pool_size = _setting("http_pool_size","ZERYNTH_HTTP_POOL_SIZE",10)
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,pool_maxsize=pool_size)
+                session.mount("https://",adapter)
+                session.mount("http://",adapter)
+                _session = session
+    return _session
+
+def _host_limit(url):
+    # bounds the requests in flight towards the same host
+    host = urllib.parse.urlsplit(url).netloc
+    if host not in _host_limits:
+        with _session_lock:
+            if host not in _host_limits:
+                _host_limits[host] = threading.BoundedSemaphore(_setting("http_host_limit","ZERYNTH_HTTP_HOST_LIMIT",8))
+    return _host_limits[host]
+
+def _not_sent(exc):
+    # True if the request failed before reaching the server (connection refused, dns, connect timeout)
+    if isinstance(exc,requests.exceptions.ConnectTimeout):
+        return True
+    reason = exc.args[0] if exc.args else None
+    reason = getattr(reason,"reason",reason)
+    return isinstance(reason,urllib3.exceptions.NewConnectionError)
+
+def zrequest(method,url,timeout=_default_timeout,retries=_default_retries,backoff=_default_backoff,**kwargs):
+    # make at most retries attempts with exponential backoff. Timeouts, dropped connections and
+    # server errors are retried for idempotent methods only: a POST or PUT may have been executed,
+    # so it is sent again only if the connection could not be established.
+    session = get_session()
+    kwargs.setdefault("proxies",env.proxies)
+    idempotent = method.upper() in _idempotent_methods
+    for x in range(retries):
+        if x:
+            sleep(backoff*2**(x-1))
+        try:
+            with _host_limit(url):
+                res = session.request(method,url,timeout=timeout,**kwargs)
+        except (TimeoutException,requests.exceptions.ConnectionError) as e:
+            if x==retries-1 or not (idempotent or _not_sent(e)):
+                raise
+            if isinstance(e,TimeoutException):
+                warning("Timeout! Retrying...")
+                timeout=timeout*2
+            else:
+                warning("Connection error! Retrying...")
+            continue
+        if res.status_code<500 or not idempotent or x==retries-1:
+            return res
+        warning("Server error",res.status_code,"! Retrying...")
+        res.close()
 
 
 ################### json special type encoder
@@ -33,13 +116,7 @@ def zpost(url,data,headers={},auth=True,timeout=_default_timeout):
         token = get_token()
         hh.update({"Authorization": "Bearer "+token})
     hh.update(headers)
-    for x in range(_default_retries):
-        try:
-            return requests.post(url=url, headers=hh, data=json.dumps(data, cls=ZjsonEncoder),timeout=timeout,verify=_ssl_verify,proxies=env.proxies)
-        except TimeoutException:
-            warning("Timeout! Retrying...")
-            timeout=timeout*2
-    raise TimeoutException
+    return zrequest("POST",url, headers=hh, data=json.dumps(data, cls=ZjsonEncoder),timeout=timeout,verify=_ssl_verify)
 
 def zget(url,headers={},params={},auth=True,token=None,stream=False,timeout=_default_timeout):
     hh = {"Content-Type": "application/json","User-agent":env.user_agent}
@@ -51,13 +128,7 @@ def zget(url,headers={},params={},auth=True,token=None,stream=False,timeout=_def
                 token = get_token()
     if token: hh.update({"Authorization": "Bearer "+token})
     hh.update(headers)
-    for x in range(_default_retries):
-        try:
-            return requests.get(url=url, headers=hh,timeout=timeout,params=params,verify=_ssl_verify,stream=stream,proxies=env.proxies)
-        except TimeoutException:
-            warning("Timeout! Retrying...")
-            timeout=timeout*2
-    raise TimeoutException
+    return zrequest("GET",url, headers=hh,timeout=timeout,params=params,stream=stream,verify=_ssl_verify)
 
 def zdelete(url,headers={},auth=True,timeout=_default_timeout):
     hh = {"Content-Type": "application/json","User-agent":env.user_agent}
@@ -65,13 +136,7 @@ def zdelete(url,headers={},auth=True,timeout=_default_timeout):
         token = get_token()
         hh.update({"Authorization": "Bearer "+token})
     hh.update(headers)
-    for x in range(_default_retries):
-        try:
-            return requests.delete(url=url, headers=hh,timeout=timeout,verify=_ssl_verify,proxies=env.proxies)
-        except TimeoutException:
-            warning("Timeout! Retrying...")
-            timeout=timeout*2
-    raise TimeoutException
+    return zrequest("DELETE",url, headers=hh,timeout=timeout,verify=_ssl_verify)
 
 def zput(url, data,headers={},auth=True,timeout=_default_timeout):
     hh = {"Content-Type": "application/json","User-agent":env.user_agent}
@@ -79,16 +144,10 @@ def zput(url, data,headers={},auth=True,timeout=_default_timeout):
         token = get_token()
         hh.update({"Authorization": "Bearer "+token})
     hh.update(headers)
-    for x in range(_default_retries):
-        try:
-            return requests.put(url=url, headers=hh, data=json.dumps(data, cls=ZjsonEncoder),timeout=timeout,verify=_ssl_verify,proxies=env.proxies)
-        except TimeoutException:
-            warning("Timeout! Retrying...")
-            timeout=timeout*2
-    raise TimeoutException
+    return zrequest("PUT",url, headers=hh, data=json.dumps(data, cls=ZjsonEncoder),timeout=timeout,verify=_ssl_verify)
 
 def zgetraw(url):
-    r = requests.get(url,stream=True)
+    r = zrequest("GET",url,stream=True,timeout=None)
     return r.raw
 
 def get_token(continue_if_none=False):
@@ -138,8 +197,144 @@ def get_token_data():
     data = json.loads(data)
     return data
 
-def download_url(url,target_file):
-    r = requests.get(url, allow_redirects=True)
-    open(target_file, 'wb').write(r.content)
+class DownloadError(Exception):
+    def __init__(self,msg,status=None,message=None):
+        super().__init__(msg)
+        # http status and error message sent by the server, if any
+        self.status = status
+        self.message = message
+
+def download_progress(name,step=10):
+    # progress callback printing every step percent (or every MB if the size is unknown)
+    last = [-1]
+    def progress(done,total):
+        mark = done*100//(total*step) if total else done//(1024*1024)
+        if mark!=last[0]:
+            last[0]=mark
+            if total:
+                info(name,"%i%%"%(done*100//total),"(%i/%i bytes)"%(done,total))
+            else:
+                info(name,done,"bytes")
+    return progress
+
+def download_url(url,target_file,size=None,digest=None,algo="sha256",progress=None,auth=False,retries=_default_retries,chunk_size=64*1024,**kwargs):
+    # stream url to target_file through target_file.part, resuming with a range request
+    # if the transfer is interrupted. The file is verified against size and digest if given.
+    # A partial file is resumed only if the server sent a validator (ETag or Last-Modified) for it:
+    # the validator is kept in target_file.part.validator and sent back with If-Range, so that
+    # a changed resource is downloaded again from the start.
+    part = target_file+".part"
+    vfile = part+".validator"
+    headers = dict(kwargs.pop("headers",{}))
+    if auth:
+        headers.update(get_token_headers())
+        kwargs.setdefault("verify",_ssl_verify)
+    total = size
+    for x in range(retries):
+        done = os.path.getsize(part) if os.path.exists(part) else 0
+        validator = _read_validator(vfile,url) if done else None
+        if done and not validator:
+            # can't tell if the partial file belongs to the current resource
+            _discard_part(part,vfile)
+            done = 0
+        if done:
+            headers["Range"]="bytes=%i-"%done
+            headers["If-Range"]=validator
+        else:
+            headers.pop("Range",None)
+            headers.pop("If-Range",None)
+        res = zrequest("GET",url,headers=headers,allow_redirects=True,stream=True,timeout=_download_timeout,retries=retries,**kwargs)
+        try:
+            if res.status_code==416 and done:
+                # nothing left: the partial file is already complete
+                break
+            if res.status_code==206:
+                total = size or _content_range_total(res.headers.get("Content-Range"),done+int(res.headers.get("Content-Length",0)))
+                mode = "ab"
+            elif res.status_code==200:
+                # no resume support or resource changed: start again
+                done = 0
+                total = size or int(res.headers.get("Content-Length",0)) or None
+                mode = "wb"
+                _write_validator(vfile,url,res)
+            else:
+                message = _error_message(res)
+                raise DownloadError("Can't download "+url+": "+str(res.status_code)+(" "+message if message else ""),res.status_code,message)
+            with open(part,mode) as ff:
+                for chunk in res.iter_content(chunk_size):
+                    ff.write(chunk)
+                    done+=len(chunk)
+                    if progress:
+                        progress(done,total)
+            if total is None or done>=total:
+                break
+        except (requests.exceptions.ConnectionError,requests.exceptions.ChunkedEncodingError,TimeoutException) as e:
+            if x==retries-1:
+                raise
+            warning("Download interrupted at",done,"bytes, resuming...")
+        finally:
+            res.close()
+    else:
+        raise DownloadError("Can't complete download of "+url)
+    try:
+        _check_download(part,total,digest,algo)
+    except DownloadError:
+        # a corrupted partial file must not be resumed
+        _discard_part(part,vfile)
+        raise
+    os.replace(part,target_file)
+    if os.path.exists(vfile):
+        os.remove(vfile)
     return True
 
+def _read_validator(vfile,url):
+    try:
+        vd = fs.get_json(vfile)
+        return vd["validator"] if vd["url"]==url else None
+    except Exception:
+        return None
+
+def _write_validator(vfile,url,res):
+    # weak etags can't be used with If-Range
+    validator = res.headers.get("ETag")
+    if not validator or validator.startswith("W/"):
+        validator = res.headers.get("Last-Modified")
+    if validator:
+        fs.atomic_write(json.dumps({"url":url,"validator":validator}),vfile)
+    elif os.path.exists(vfile):
+        os.remove(vfile)
+
+def _discard_part(part,vfile):
+    for ff in (part,vfile):
+        if os.path.exists(ff):
+            os.remove(ff)
+
+def _error_message(res):
+    # the message of a json error response ({"status":"error","message":...}) or the start of the body
+    try:
+        return str(res.json()["message"])
+    except Exception:
+        pass
+    try:
+        return res.text[:200].strip()
+    except Exception:
+        return ""
+
+def _content_range_total(crange,default):
+    # Content-Range: bytes start-end/total
+    try:
+        return int(crange.rsplit("/",1)[1])
+    except (AttributeError,IndexError,ValueError):
+        return default
+
+def _check_download(path,size,digest,algo):
+    if size is not None and os.path.getsize(path)!=size:
+        raise DownloadError("Wrong size: expected "+str(size)+" bytes, got "+str(os.path.getsize(path)))
+    if digest:
+        hh = hashlib.new(algo)
+        with open(path,"rb") as ff:
+            for chunk in iter(lambda: ff.read(1024*1024),b""):
+                hh.update(chunk)
+        if hh.hexdigest()!=digest.lower():
+            raise DownloadError("Wrong "+algo+" digest: expected "+digest+", got "+hh.hexdigest())
+
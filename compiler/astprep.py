@@ -14,6 +14,24 @@ class AstPreprocessor(ast.NodeTransformer):
         self.curpath = ""
         self.modules = set()
         self.just_imports=just_imports
+        # incremented when a __define or __cdefine changes the preprocessor state
+        self.generation = 0
+        # generation of the last change of each name (CDEFS for __cdefine)
+        self.changed = {}
+        # names looked up while preprocessing the current tree, with the generation of the first lookup
+        self.lookups = {}
+
+    def change(self,name):
+        self.generation+=1
+        self.changed[name]=self.generation
+
+    def lookup(self,name):
+        if name not in self.lookups:
+            self.lookups[name]=self.generation
+
+    def is_stale(self,lookups):
+        # True if a name looked up by a tree changed after the tree was preprocessed
+        return any(self.changed.get(name,0)>gen for name,gen in lookups.items())
 
     def visit_Import(self,node):
         for alias in node.names:
@@ -49,6 +67,7 @@ class AstPreprocessor(ast.NodeTransformer):
     
     def visit_Name(self,node):
         name = node.id
+        self.lookup(name)
         # print("CHECKING NAME",name,"IN",self.allnames)
         if name in self.allnames:
             pos = self.allnames[name]
@@ -73,6 +92,8 @@ class AstPreprocessor(ast.NodeTransformer):
             else:
                 raise CWrongSyntax(node.lineno,node.col_offset,self.filename,"__define needs an integer as second argument")
             #print("===>>>> ADDING",node.args[0].id,"AS",node.args[1].n)
+            if self.allnames.get(node.args[0].id,None)!=val:
+                self.change(node.args[0].id)
             self.allnames[node.args[0].id]=val
             return None
         elif isinstance(node.func,ast.Name) and node.func.id=="__lookup":
@@ -109,10 +130,10 @@ class AstPreprocessor(ast.NodeTransformer):
                 #print("===>>>> ADDING",node.args[0].id,"AS",node.args[1].n)
             if "CDEFS" not in self.defines:
                 self.defines["CDEFS"]=[]
-            if val is None:
-                self.defines["CDEFS"].append(node.args[0].id)
-            else:
-                self.defines["CDEFS"].append(node.args[0].id+"="+str(val))
+            cdef = node.args[0].id if val is None else node.args[0].id+"="+str(val)
+            if cdef not in self.defines["CDEFS"]:
+                self.change("CDEFS")
+            self.defines["CDEFS"].append(cdef)
             return None
         elif isinstance(node.func,ast.Name) and node.func.id=="__cfile":
             if len(node.args)>1:
@@ -126,10 +147,14 @@ class AstPreprocessor(ast.NodeTransformer):
             return self.generic_visit(node)
 
     def visit_Attribute(self, node):
+        if isinstance(node.value,ast.Name):
+            self.lookup(node.value.id)
         if isinstance(node.value,ast.Name) and node.value.id in self.allnames:
             #print("ASTPREP",node.value.id,self.pinmap,self.allnames)
             #pin attribute, resolve
             if isinstance(node.ctx, ast.Load):
+                if node.value.id in self.pinmap and node.attr in self.pinmap[node.value.id]:
+                    self.lookup(self.pinmap[node.value.id][node.attr])
                 if node.value.id in self.pinmap and node.attr in self.pinmap[node.value.id] and self.pinmap[node.value.id][node.attr] in self.allnames:
                     return ast.Num(self.allnames[self.pinmap[node.value.id][node.attr]])
                 elif node.value.id in self.pinmap:
@@ -157,6 +182,7 @@ class AstPreprocessor(ast.NodeTransformer):
             if len(fun.args)==2 and isinstance(fun.args[0],ast.Name) and (isinstance(fun.args[1],ast.Str) or isinstance(fun.args[1],ast.Num)):
                 name = fun.args[0].id
                 val = fun.args[1].s if isinstance(fun.args[1],ast.Str) else fun.args[1].n
+                self.lookup(name)
                 if not name in self.defines:
                     raise CNameError(node.lineno,node.col_offset,"",str(name)+" is not defined!")
                 #print(name,"is in",self.defines)
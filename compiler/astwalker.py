@@ -13,7 +13,7 @@ from compiler.exceptions import *
 
 class AstWalker(ast.NodeVisitor):
 
-    def __init__(self, prg, hooks, filename, modulename="__main__",scopes=None):
+    def __init__(self, prg, hooks, filename, modulename="__main__"):
         self.codes = []
         self.codequeue = []
         self.code = None
@@ -24,7 +24,6 @@ class AstWalker(ast.NodeVisitor):
         self.env = hooks.getEnvHook()
         self.imports = set()
         self.atendmodule = False
-        self.scopes = scopes
         self.filename = filename
         self.builtins_module = "__builtins__"
         self.special_names = ["__builtins__","__module__"]
@@ -105,8 +104,7 @@ class AstWalker(ast.NodeVisitor):
         # print(self.env)
         self.atendmodule = True
         self.generateCodeObjs()
-        if self.scopes:
-            self.code.finalize(self.env)
+        self.code.finalize(self.env)
         self.popCodeObj()
         self.env.popScope()
 
@@ -804,19 +802,7 @@ class AstWalker(ast.NodeVisitor):
         self.codequeue.append((self.code, (node, args, vargs, kwargs), ftype))
         self.popCodeObj()
 
-        if self.scopes:
-            scope = self.scopes[Scope.getid(node.name,self.env.getScope().uid)]["scope"]
-            if scope.hasNonlocalNames():
-                code.addCode(OpCode.BUILD_TUPLE(len(cellvars)))
-                cellvars = scope.cellvars
-                for cell in cellvars:
-                    code.addCode(OpCode.MAKE_CELL(cell))
-                code.addCode(OpCode.BUILD_TUPLE(len(cellvars)|0x8000))
-                code.addCode(OpCode.MAKE_CLOSURE(nfunargs))
-            else:
-                code.addCode(OpCode.MAKE_FUNCTION(nfunargs))
-        else:
-            code.addCode(OpCode.MAKE_FUNCTION(nfunargs))
+        code.addCode(OpCode.MAKE_FUNCTION(nfunargs))
         code.addCode(OpCode.STORE(node.name, self.hooks.getBuiltinCoding))
         return code
 
@@ -857,8 +843,10 @@ class AstWalker(ast.NodeVisitor):
                 self.code.addCode(fcode)
                 self.code.addRet()
                 self.generateCodeObjs()
-                if self.scopes:
-                    self.code.finalize(self.env)
+                # the scope of the body is known only now, after MAKE_FUNCTION has been emitted
+                if self.env.getScope().hasNonlocalNames():
+                    raise CUnsupportedFeatureError(node.lineno,node.col_offset,self.filename,"closures")
+                self.code.finalize(self.env)
                 self.code.eblocks = self.getBlocks()
                 self.popCodeObj()
                 self.env.popScope()
@@ -883,8 +871,7 @@ class AstWalker(ast.NodeVisitor):
                 for nn in kwargs:
                     self.env.putArg(nn.arg)
                     self.code.addKwArgName(nn.arg)
-                if self.scopes:
-                    self.code.finalize(self.env)
+                self.code.finalize(self.env)
                 self.popCodeObj()
                 self.env.popScope()
             elif kind == "class":
@@ -903,8 +890,7 @@ class AstWalker(ast.NodeVisitor):
                 #print("SCOPE AT END GENERATE",self.env.getScope())
                 self.env.getScope().remember()
                 #print("SCOPE AT END GENERATE AFTER REMEMBER",self.env.getScope())
-                if self.scopes:
-                    self.code.finalize(self.env)
+                self.code.finalize(self.env)
                 self.popCodeObj()
                 self.env.popScope()
 
@@ -1,4 +1,7 @@
 from base import *
+from .elf import ElfFile, SHT_NOBITS, STT_FILE
+import hashlib
+import json
 import re
 
 
@@ -221,22 +224,8 @@ class gcc():
         self.ld = tools["ld"]
         self.readelf = tools["readelf"]
 
-        # find search path: https://stackoverflow.com/a/21610523
-        ret, output = self.run_command(self.gcc,self.archopts+["-print-search-dirs"])
-        if ret != 0:
-            error("Linking Error:",output);
-
-        lines = output.split('\n')
-        self.libpaths=[]
-        for line in lines:
-            if line.startswith("libraries: ="):
-                if env.platform.startswith("win"):  #how cool is that? -_-
-                    paths = line[12:].split(";")
-                else:
-                    paths = line[12:].split(":")
-                for path in paths:
-                    self.libpaths.append(fs.apath(path))
-                break
+        probe = self.probe_toolchain()
+        self.libpaths = probe["libpaths"]
         if not self.libpaths:
             warning("No library path found!")
         # else:
@@ -274,6 +263,57 @@ class gcc():
                 
 
 
+    # toolchain probes are memoized in memory and on disk, keyed on compiler path, mtime and arch options
+    _probes = {}
+
+    def probe_key(self):
+        try:
+            st = fs.stat(self.gcc)
+        except:
+            return None
+        hh = hashlib.sha256()
+        hh.update(bytes(fs.apath(self.gcc)+"::"+str(st.st_mtime)+"::"+str(st.st_size),"utf-8"))
+        for opt in self.archopts:
+            hh.update(b"\0"+bytes(str(opt),"utf-8"))
+        return hh.hexdigest()
+
+    def probe_toolchain(self):
+        key = self.probe_key()
+        if key in gcc._probes:
+            return gcc._probes[key]
+        cfile = fs.path(env.tmp,"toolchain_cache",key+".json") if key else None
+        if cfile and fs.exists(cfile):
+            try:
+                gcc._probes[key] = fs.get_json(cfile)
+                return gcc._probes[key]
+            except:
+                pass
+
+        probe = {"libpaths":[]}
+        # find search path: https://stackoverflow.com/a/21610523
+        ret, output = self.run_command(self.gcc,self.archopts+["-print-search-dirs"])
+        if ret != 0:
+            error("Linking Error:",output);
+            return probe
+        lines = output.split('\n')
+        for line in lines:
+            if line.startswith("libraries: ="):
+                if env.platform.startswith("win"):  #how cool is that? -_-
+                    paths = line[12:].split(";")
+                else:
+                    paths = line[12:].split(":")
+                for path in paths:
+                    probe["libpaths"].append(fs.apath(path))
+                break
+        if key:
+            gcc._probes[key] = probe
+            try:
+                fs.atomic_write(json.dumps(probe),cfile)
+                fs.trim_dir(fs.dirname(cfile),env.tmp_cache_size*1024*1024)
+            except Exception as e:
+                debug("Can't save toolchain probe",e)
+        return probe
+
     def run_command(self,cmd, args):
         ret = 0
         torun = [cmd]
@@ -303,7 +343,10 @@ class gcc():
                         res[fname].append(line)
             return res
 
-    def compile(self, fnames,o=None):
+    def compile(self, fnames,o=None,depfile=None):
+        # if depfile is given, the header dependencies are written there during compilation (-MD -MF)
+        # instead of requiring a separate get_headers (-M) pass. As with -M, system and toolchain
+        # headers are listed too
         wrn = {}
         err = {}
         ret = 1
@@ -322,7 +365,8 @@ class gcc():
                 else:
                     nm.append(fs.path(o,fs.basename(fname).replace(".c",".o")))
                     
-            ret, output = self.run_command(self.gcc,self.gccopts+inc+nm+self.defines+["-g"])
+            dep = ["-MD","-MF",depfile] if depfile else []
+            ret, output = self.run_command(self.gcc,self.gccopts+dep+inc+nm+self.defines+["-g"])
             #print(output)
             lines = output.split("\n")
             catcher = re.compile("(.+):([0-9]+):([0-9]+):[^:]*(warning|error)(.*)")
@@ -347,7 +391,39 @@ class gcc():
             if ret!=0:
                 break
         return (ret,wrn,err,output)
+    def read_elf(self,fname):
+        # parse the object in process; None means that objdump must be used instead
+        try:
+            return ElfFile.from_file(fname)
+        except Exception as e:
+            debug("Can't read",fname,"as ELF:",e)
+            return None
+
     def symbol_table(self,fname):
+        elf = self.read_elf(fname)
+        if elf is None:
+            return self.objdump_symbol_table(fname)
+        ret = symtable()
+        hexfmt = "%016x" if elf.is64 else "%08x"
+        for sym in elf.symbols():
+            if not sym.name:
+                continue
+            # same columns as objdump -t: common symbols have their alignment as size
+            size = sym.value if sym.section=="*COM*" else sym.size
+            ret.add(sym.name,hexfmt%size,hexfmt%sym.address,sym.section)
+        return ret
+
+    def get_undefined(self,fname):
+        elf = self.read_elf(fname)
+        if elf is None:
+            return self.objdump_get_undefined(fname)
+        ret = set()
+        for sym in elf.symbols():
+            if sym.name and sym.section in ["*ABS*","*UND*"] and sym.type!=STT_FILE:
+                ret.add(sym.name)
+        return ret
+
+    def objdump_symbol_table(self,fname):
         ret = symtable()
         res, output = self.run_command(self.objdump,["-t",fname])
         output = output.replace("\t"," ")
@@ -365,7 +441,7 @@ class gcc():
                     pass
                     #print("not matched\n")
         return ret
-    def get_undefined(self,fname):
+    def objdump_get_undefined(self,fname):
         res, output = self.run_command(self.objdump,["-t",fname])
         output = output.replace("\t"," ")
         ret = set()
@@ -430,6 +506,32 @@ class gcc():
         # print(output)
         return (ret,output)
     def retrieve_sections(self,fname):
+        elf = self.read_elf(fname)
+        if elf is None:
+            return self.objdump_retrieve_sections(fname)
+        sections = {}
+        for sect in elf.sections:
+            if sect.type==SHT_NOBITS or not sect.size or not sect.name.startswith("."):
+                continue
+            grp = "."+sect.name.split(".")[1]
+            if grp in [".text",".rodata",".data",".bss"]:
+                sections[grp] = sections.get(grp,0)+sect.size
+        return sections
+
+    def generate_zerynth_binary(self,table,fname,rodata_in_ram=False):
+        elf = self.read_elf(fname)
+        if elf is None:
+            return self.objdump_generate_zerynth_binary(table,fname,rodata_in_ram)
+        cobj = ZerynthCObj()
+        for name in [".text",".rodata",".data"]:
+            # section contents are slices of the file, no copy
+            data = elf.section_data(name)
+            if len(data):
+                cobj.sections[name]=data
+        cobj.finalize(table,rodata_in_ram)
+        return cobj
+
+    def objdump_retrieve_sections(self,fname):
         res,output = self.run_command(self.objdump,["-s",fname])
         lines = output.replace("\t"," ").split("\n")
         bcatcher = re.compile(" ([0-9a-fA-F]+) ([0-9a-fA-F]*) ([0-9a-fA-F]*) ([0-9a-fA-F]*) ([0-9a-fA-F]*)(.*)")
@@ -459,7 +561,7 @@ class gcc():
                         #cobj.add_data(cursect,int(byte,16))
         return sections
 
-    def generate_zerynth_binary(self,table,fname,rodata_in_ram=False):
+    def objdump_generate_zerynth_binary(self,table,fname,rodata_in_ram=False):
         res,output = self.run_command(self.objdump,["-s",fname])
         cobj = ZerynthCObj()
         if res==0:
@@ -486,7 +588,7 @@ class gcc():
                             cobj.add_data(cursect,int(byte,16))
         cobj.finalize(table,rodata_in_ram)
         #cobj.info()
-        return cobj                                                
+        return cobj
     def info(self):
         print("GCC")
         print(self.gcc)
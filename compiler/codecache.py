@@ -1,41 +1,80 @@
 from base import *
 import hashlib
 import base64
+import json
+import os
+import sqlite3
+import time
+import pickle
+import re
+import sys
 
 class CodeCache():
-    def __init__(self,tmpdir=None):
+    def __init__(self,tmpdir=None,shared=None,maxsize=None):
         tmp = env.tmp if not tmpdir else tmpdir
         self.basepath = fs.path(tmp,"native_cache")
         self.cache = {}
         self.target=""
+        # content addressed mode: objects are keyed on sources, headers, flags and toolchain
+        shared = env.native_cache if shared is None else shared
+        self.shared = fs.apath(shared) if shared else None
+        self.maxsize = (env.native_cache_size if maxsize is None else maxsize)*1024*1024
+        self.hhashes = {}
+        self.prefix = None
+        self.db = None
+        self.pending = {}
+        self.hits = set()
 
-    def set_target(self,prefix,target,defs=[]):
+    def set_target(self,prefix,target,defs=[],cc=None):
         sdf=""
         for x in sorted(defs):
             sdf=sdf+str(x)+"&&"
         self.target=target
         self.hash=target+"::"+sdf
+        if self.shared:
+            self.prefix = fs.wpath(fs.apath(prefix)) if prefix else None
+            self.set_shared_target(target,cc)
+            return
         self.path=fs.path(self.basepath,self.hashme(self.hash)+"_"+self.hashme(prefix+target)+"_"+fs.basename(prefix))
         fs.makedirs(self.path)
+        self.cache={}
+        self.pending={}
+        self.hits=set()
         try:
-            self.cache=fs.get_json(fs.path(self.path,".cache"))
-        except:
-            self.cache={}
+            self.db = sqlite3.connect(fs.path(self.path,"cache.db"),timeout=60,check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS objects (key TEXT PRIMARY KEY, mtime REAL, ofile TEXT, headers TEXT, hits INTEGER, last_used REAL)")
+            for row in self.db.execute("select key,mtime,ofile,headers from objects"):
+                self.cache[row[0]]={
+                    "mtime":row[1],
+                    "ofile":row[2],
+                    "headers":json.loads(row[3])
+                }
+        except Exception as e:
+            warning("Can't open native cache index",e)
+            self.db = None
 
-    def add_object(self,cfile,ofile,hfiles=[]):
+    def add_object(self,cfile,ofile,hfiles=[],depfile=None):
+        if depfile:
+            hfiles = self.read_depfile(cfile,depfile)
+        if self.shared:
+            return self.add_shared_object(cfile,ofile,hfiles)
         statinfo = fs.stat(cfile)
         ofilename = fs.basename(ofile)
         cfilename = fs.path(self.path,ofilename)
-        self.cache[self.hash+cfile]={
+        entry = {
             "mtime":statinfo.st_mtime,
             "ofile":cfilename,
             "headers": {k:fs.stat(k).st_mtime for k in hfiles}
         }
-        fs.copyfile(ofile,cfilename)
-        fs.set_json(self.cache,fs.path(self.path,".cache"))
+        fs.atomic_write(fs.readfile(ofile,"b"),cfilename)
+        # the index is written once per build in flush
+        self.cache[self.hash+cfile]=entry
+        self.pending[self.hash+cfile]=entry
         #print("CACHE added",cfile,"=>",self.cache[cfile])
 
     def has_object(self,cfile):
+        if self.shared:
+            return self.has_shared_object(cfile)
         hfile = self.hash+cfile
         if hfile in self.cache:
             file = self.cache[hfile]
@@ -48,10 +87,256 @@ class CodeCache():
                 for h,t in file["headers"].items():
                     if fs.stat(h).st_mtime!=t:
                         return False
+                self.hits.add(hfile)
                 return file["ofile"]
         return False
 
+    def flush(self):
+        # called once at the end of a build
+        if self.shared:
+            self.evict()
+            return
+        if self.db is None:
+            return
+        now = time.time()
+        try:
+            with self.db:
+                for key,entry in self.pending.items():
+                    self.db.execute("insert or replace into objects values(?,?,?,?,coalesce((select hits from objects where key=?),0),?)",
+                        (key,entry["mtime"],entry["ofile"],json.dumps(entry["headers"]),key,now))
+                for key in self.hits:
+                    self.db.execute("update objects set hits=hits+1, last_used=? where key=?",(now,key))
+            self.pending={}
+            self.hits=set()
+        except Exception as e:
+            warning("Can't update native cache index",e)
+
+    ##### Content addressed cache
+    #
+    # objects/<kk>/<key>.o       compiled objects, key is the hash of source+headers+flags+toolchain
+    # manifests/<kk>/<key>.json  for each source key, the list of known header sets and the resulting object
+    #
+    # Paths under env.home and under the project are stored relative to them, so that the cache
+    # can be shared among machines and checkouts of the same project.
+
+    def set_shared_target(self,target,cc):
+        fs.makedirs([fs.path(self.shared,"objects"),fs.path(self.shared,"manifests")])
+        hh = hashlib.sha256()
+        hh.update(bytes(target,"utf-8"))
+        if cc is not None:
+            # toolchain version: hash of the compiler driver
+            hh.update(bytes(self.file_hash(cc.gcc),"utf-8"))
+            home = fs.wpath(env.home)
+            for opt in list(cc.archopts)+list(cc.gccopts)+sorted(cc.defines)+sorted(cc.incpaths):
+                opt = fs.wpath(str(opt))
+                if self.prefix:
+                    opt = re.sub(re.escape(self.prefix)+"(?=/|$)","$PROJECT",opt)
+                opt = opt.replace(home,"$ZERYNTH_HOME")
+                hh.update(b"\0"+bytes(opt,"utf-8"))
+        self.hash = hh.hexdigest()
+
+    def normpath(self,path):
+        path = fs.wpath(path)
+        if self.prefix and path.startswith(self.prefix+"/"):
+            return "$PROJECT"+path[len(self.prefix):]
+        home = fs.wpath(env.home)
+        if path.startswith(home):
+            return "$ZERYNTH_HOME"+path[len(home):]
+        return path
+
+    def denormpath(self,path):
+        if path.startswith("$PROJECT") and self.prefix:
+            return fs.path(self.prefix+path[len("$PROJECT"):])
+        if path.startswith("$ZERYNTH_HOME"):
+            return fs.path(env.home+path[len("$ZERYNTH_HOME"):])
+        return path
+
+    def file_hash(self,path):
+        hh = hashlib.sha256()
+        with open(path,"rb") as ff:
+            for blk in iter(lambda: ff.read(1<<16),b""):
+                hh.update(blk)
+        return hh.hexdigest()
+
+    def header_hash(self,path):
+        # headers are shared by many sources, hash them once per build
+        if path not in self.hhashes:
+            try:
+                self.hhashes[path] = self.file_hash(path)
+            except:
+                self.hhashes[path] = None
+        return self.hhashes[path]
+
+    def source_key(self,cfile):
+        hh = hashlib.sha256()
+        hh.update(bytes(self.hash,"utf-8"))
+        hh.update(bytes(self.normpath(cfile),"utf-8"))
+        hh.update(bytes(self.file_hash(cfile),"utf-8"))
+        return hh.hexdigest()
+
+    def shared_file(self,kind,key,ext):
+        return fs.path(self.shared,kind,key[:2],key+ext)
+
+    def has_shared_object(self,cfile):
+        try:
+            skey = self.source_key(cfile)
+            manifest = fs.get_json(self.shared_file("manifests",skey,".json"))
+        except:
+            return False
+        for entry in manifest:
+            for h,hv in entry["headers"].items():
+                if self.header_hash(self.denormpath(h))!=hv:
+                    break
+            else:
+                ofile = self.shared_file("objects",entry["object"],".o")
+                if not fs.exists(ofile):
+                    continue
+                # touch for lru eviction
+                try:
+                    os.utime(ofile,None)
+                except:
+                    pass
+                return ofile
+        return False
+
+    def add_shared_object(self,cfile,ofile,hfiles):
+        skey = self.source_key(cfile)
+        headers = {}
+        for h in hfiles:
+            # the header may have changed during the build: hash it again
+            self.hhashes.pop(h,None)
+            headers[self.normpath(h)] = self.header_hash(h)
+        hh = hashlib.sha256()
+        hh.update(bytes(skey,"utf-8"))
+        for h in sorted(headers):
+            hh.update(bytes(h+"="+str(headers[h]),"utf-8"))
+        okey = hh.hexdigest()
+        fs.atomic_write(fs.readfile(ofile,"b"),self.shared_file("objects",okey,".o"))
+
+        mfile = self.shared_file("manifests",skey,".json")
+        try:
+            manifest = fs.get_json(mfile)
+        except:
+            manifest = []
+        manifest = [x for x in manifest if x["object"]!=okey]
+        # most recent first, keep a bounded number of header variants per source
+        manifest = [{"headers":headers,"object":okey}]+manifest[:15]
+        fs.atomic_write(json.dumps(manifest),mfile)
+
+    def evict(self):
+        # least recently used objects are removed until the cache fits in maxsize,
+        # then the manifests are purged of the removed objects
+        removed = fs.trim_dir(fs.path(self.shared,"objects"),self.maxsize)
+        if not removed:
+            return
+        gone = set(fs.basename(ofile)[:-2] for ofile in removed)
+        for root,dirnames,files in os.walk(fs.path(self.shared,"manifests")):
+            for ff in files:
+                mfile = os.path.join(root,ff)
+                try:
+                    manifest = fs.get_json(mfile)
+                    left = [x for x in manifest if x["object"] not in gone]
+                    if not left:
+                        os.remove(mfile)
+                    elif len(left)<len(manifest):
+                        fs.atomic_write(json.dumps(left),mfile)
+                except:
+                    pass
+        debug("Native cache trimmed:",len(removed),"objects removed")
+
+    def read_depfile(self,cfile,depfile):
+        # parse a make style dependency file as generated by gcc -MD -MF
+        try:
+            deps = fs.readfile(depfile)
+        except:
+            return []
+        deps = deps.replace("\\\r\n"," ").replace("\\\n"," ")
+        # skip the "target.o:" part; the separator is the first colon followed by a space
+        pos = deps.find(": ")
+        if pos>=0:
+            deps = deps[pos+2:]
+        res = []
+        cur = ""
+        for tok in deps.split(" "):
+            if tok.endswith("\\"):
+                # escaped space in file name
+                cur+=tok[:-1]+" "
+                continue
+            cur+=tok
+            cur = cur.strip()
+            if cur and cur!=cfile and fs.exists(cur) and cur not in res:
+                res.append(cur)
+            cur = ""
+        return res
+
     def hashme(self,msg):
         hasher = hashlib.md5()
         hasher.update(bytes(msg,"utf-8"))
         return base64.standard_b64encode(hasher.digest()).decode("utf-8").replace("=","").replace("/","_")
+
+
+class AstCache():
+    # Persistent cache of preprocessed and parsed Python modules.
+    # Entries are keyed on the module source and target; each entry also stores the values
+    # of the CFG macros tested by the #-if directives so that it can be validated against the current build.
+    def __init__(self,target,tmpdir=None,maxsize=None):
+        tmp = env.tmp if not tmpdir else tmpdir
+        self.basepath = fs.path(tmp,"module_cache")
+        self.target = target
+        self.maxsize = (env.tmp_cache_size if maxsize is None else maxsize)*1024*1024
+        # parsed trees are modified by the compiler, keep them pickled and unpickle on each use
+        self.mem = {}
+
+    def key(self,src,prefix):
+        hh = hashlib.sha256()
+        hh.update(bytes(sys.version+"::"+self.target+"::"+prefix,"utf-8"))
+        hh.update(bytes(src,"utf-8"))
+        return hh.hexdigest()
+
+    def entries(self,key):
+        if key not in self.mem:
+            try:
+                path = fs.path(self.basepath,key[:2],key)
+                with open(path,"rb") as ff:
+                    self.mem[key] = pickle.load(ff)
+                # touch for lru eviction
+                os.utime(path,None)
+            except:
+                self.mem[key] = []
+        return self.mem[key]
+
+    def same_value(self,v1,v2):
+        return json.dumps(v1,sort_keys=True)==json.dumps(v2,sort_keys=True)
+
+    def get(self,src,prefix,cfg):
+        for entry in self.entries(self.key(src,prefix)):
+            for macro,value in entry["tested"].items():
+                if not self.same_value(cfg.get(macro,None),value):
+                    break
+            else:
+                return entry["src"],pickle.loads(entry["tree"]),entry["warnings"]
+        return None
+
+    def put(self,src,prefix,tested,warnings,modprg,tree):
+        key = self.key(src,prefix)
+        try:
+            entries = self.entries(key)
+            entry = {
+                "tested":tested,
+                "warnings":warnings,
+                "src":modprg,
+                "tree":pickle.dumps(tree,pickle.HIGHEST_PROTOCOL)
+            }
+            # keep a bounded number of configurations per module, most recent first
+            self.mem[key] = [entry]+[x for x in entries if not self.same_value(x["tested"],tested)][:7]
+            fs.atomic_write(lambda ff: pickle.dump(self.mem[key],ff,pickle.HIGHEST_PROTOCOL),fs.path(self.basepath,key[:2],key))
+        except Exception as e:
+            debug("Can't save module cache",e)
+
+    def trim(self):
+        # called once per build: least recently used modules are removed until the cache fits in maxsize
+        try:
+            for path in fs.trim_dir(self.basepath,self.maxsize):
+                self.mem.pop(fs.basename(path),None)
+        except Exception as e:
+            debug("Can't trim module cache",e)
@@ -9,11 +9,13 @@ import base64
 import hashlib
 import os
 import os.path
+import concurrent.futures
+import time
 
 from compiler.env import Env
 from compiler.astprep import AstPreprocessor
 from compiler.astwalker import AstWalker
-from compiler.codecache import CodeCache
+from compiler.codecache import CodeCache, AstCache
 from compiler.opcode import genByteCodeMap
 from compiler.exceptions import *
 from compiler.code import CodeRepr
@@ -37,9 +39,13 @@ class Compiler():
     PREPROCESS = 0
     COMPILE = 1
 
-    def __init__(self, inputfile, target, syspath=[],cdefines=[],mode=COMPILE,localmods={},tempdir=None):
+    def __init__(self, inputfile, target, syspath=[],cdefines=[],mode=COMPILE,localmods={},tempdir=None,jobs=0,discover=None,astcache=None,reprs="full"):
         # build syspath
         self.tempdir=tempdir or env.tmp
+        # code representations for debuggers: "full" (list), "lazy" (generator) or "none"
+        self.reprs = reprs
+        # number of parallel C compilations (0 means one per cpu)
+        self.jobs = jobs if jobs and jobs>0 else (os.cpu_count() or 1)
         self.syspath = []
         # add current mainfile dir
         self.curpath = fs.apath(fs.dirname(inputfile))
@@ -67,13 +73,19 @@ class Compiler():
         self.localmods = localmods
         self.mainfile = inputfile
         self.phase = 0
+        # names and natives are class level: start from a clean state on each compilation
+        Env.reset()
         self.env = Env()
         self.vmsym = []
         self.target = target
         self.prepcfiles = set()
         self.prepdefines = {}
         self.has_options = False
-        discover = Discover()
+        # a long running process can pass the module cache and device classes of previous compilations
+        self.astcache = astcache or AstCache(target)
+        self.prepared = {}
+        self.timings = []
+        discover = discover or Discover()
         if self.target!="no_device": ## no_device is passed only when no code generation is needed!
             if self.target not in discover.get_targets():
                 fatal("Target",target,"does not exist")
@@ -98,7 +110,6 @@ class Compiler():
             self.allnames.update(self.board.allnames)
 
             self.astp = AstPreprocessor(self.allnames,self.board.pinmap,self.prepdefines,self.prepcfiles)
-            self.scopes = {}
             self.moduletable = {}
             self.maindir=None
             self.resources={}
@@ -335,6 +346,31 @@ class Compiler():
         return modpath
 
     def readfile(self,file,module=None):
+        self.readoptions(file,module)
+        modprog,tested,warnings = self.preprocess(file,fs.readfile(file))
+        return modprog
+
+    def parsefile(self,file,module=None,prefix=""):
+        # return the preprocessed source of file and its syntax tree, from the module cache if possible
+        self.readoptions(file,module)
+        src = fs.readfile(file)
+        cached = self.astcache.get(src,prefix,self.prepdefines["CFG"])
+        if cached:
+            debug("Module",file,"from cache")
+            modprg,tree,warnings = cached
+            for cval,nline in warnings:
+                warning("PREPROCESSOR WARNING:",cval,"@",nline)
+            return modprg,tree
+        modprg,tested,warnings = self.preprocess(file,src)
+        modprg = prefix+modprg
+        try:
+            tree = ast.parse(modprg)
+        except SyntaxError as e:
+            raise CSyntaxError(e.lineno,e.offset,file,str(e))
+        self.astcache.put(src,prefix,tested,warnings,modprg,tree)
+        return modprg,tree
+
+    def readoptions(self,file,module=None):
         # load file options if present
         if file==self.mainfile:
             optfile = fs.path(fs.dirname(file),"project.yml")
@@ -371,9 +407,13 @@ class Compiler():
             self.prepdefines["CFG"][opt]=1
         self.prepdefines["CFG"]["TARGET"]=self.prepdefines["BOARD"]
 
+    def preprocess(self,file,modprg):
+        # evaluate #-if/#-else/#-endif directives; returns the resulting source, the tested macros with their value
+        # and the emitted warnings (needed to validate and replay cached results)
+        tested = {}
+        warnings = []
         preg = re.compile("\s*(#+-)(if|else|endif|warning|error)\s*(!{0,1}[a-zA-Z0-9_]*)(?:\s+(>=|<=|==|!=|>|<)\s+([A-Za-z0-9_ ]+)){0,1}")
         stack = []
-        modprg = fs.readfile(file)
         lines = modprg.split("\n")
         result = []
         keepline = True
@@ -390,6 +430,8 @@ class Compiler():
                 cop = mth.group(4)
                 cval = mth.group(5)
                 vmacro = self.prepdefines.get("CFG",{}).get(cmacro,None)
+                if cmacro:
+                    tested[cmacro]=vmacro
                 #print("Matched:",lvl,op,cmacro,cset,stack,keepline)
                 #check lvl
                 if op=="if":
@@ -457,6 +499,7 @@ class Compiler():
                     # warning
                     if keepline:
                         warning("PREPROCESSOR WARNING:",cval,"@",nline+1)
+                        warnings.append((cval,nline+1))
                 else:
                     # error
                     if keepline:
@@ -472,7 +515,7 @@ class Compiler():
         # if "zerynth2" not in file:
         #     log(modprog)
         debug(modprog)
-        return modprog
+        return modprog,tested,warnings
 
 
 
@@ -481,8 +524,7 @@ class Compiler():
     def find_imports(self):
         ## Preload builtins to get all __defines
         astp = AstPreprocessor({},{},self.prepdefines,self.prepcfiles,just_imports=True)
-        modprg = self.readfile(self.mainfile)
-        tree = ast.parse(modprg)
+        modprg,tree = self.parsefile(self.mainfile)
         astp.visit(tree)
         res = {}
         ures = set()
@@ -504,40 +546,47 @@ class Compiler():
 
         if mfile!=None:
             info("Compiling module:",name,"@",mfile)
-            modprg = self.readfile(mfile,name)
-            if name!=self.builtins_module:
-                # add builtins to each module
-                modprg = "import "+self.builtins_module+"\n"+modprg
-
-            try:
-                tree = ast.parse(modprg)
-            except SyntaxError as e:
-                raise CSyntaxError(e.lineno,e.offset,mfile,str(e))
-
-            self.astp.curpath = fs.dirname(mfile)
-            self.astp.filename = mfile
-            tree = self.astp.visit(tree)
-            if self.phase==0 and name!="__builtins__":
-                #print("\n\n## Syntax Tree ##\n")
-                #print(astdump(tree))
-                #TODO: print syntax if requested
-                pass
-
-            self.astp.clean(tree)
-            mc = AstWalker(modprg,self,mfile,name,None if self.phase==0 else self.scopes)
+            modprg,tree = self.prepareModule(name,mfile)
+            mc = AstWalker(modprg,self,mfile,name)
             mc.visit(tree)
-            self.scopes.update(mc.env.get_scopedir())
             self.moduletable[mfile]=name
         else:
             raise CModuleNotFound(line,0,filename,name)
 
+    def prepareModule(self,name,mfile):
+        # the walker does not modify the tree: a tree already walked is reused, unless a
+        # __define or __cdefine met afterwards changed what the preprocessor would produce
+        if mfile in self.prepared:
+            modprg,tree,lookups = self.prepared[mfile]
+            if not self.astp.is_stale(lookups):
+                return modprg,tree
+        # add builtins to each module
+        prefix = "import "+self.builtins_module+"\n" if name!=self.builtins_module else ""
+        modprg,tree = self.parsefile(mfile,name,prefix)
+
+        self.astp.curpath = fs.dirname(mfile)
+        self.astp.filename = mfile
+        self.astp.lookups = {}
+        tree = self.astp.visit(tree)
+        if self.phase==0 and name!="__builtins__":
+            #print("\n\n## Syntax Tree ##\n")
+            #print(astdump(tree))
+            #TODO: print syntax if requested
+            pass
+
+        self.astp.clean(tree)
+        self.prepared[mfile]=(modprg,tree,self.astp.lookups)
+        return modprg,tree
+
+    def stalePrepared(self):
+        return [mfile for mfile,(modprg,tree,lookups) in self.prepared.items() if self.astp.is_stale(lookups)]
+
     def parse_config(self):
         ## Preload builtins to get all __defines
         mf = self.searchModule(self.builtins_module)
         if mf is None:
             fatal("Can't find builtins module")
-        modprg = self.readfile(mf,self.builtins_module)
-        tree = ast.parse(modprg)
+        modprg,tree = self.parsefile(mf,self.builtins_module)
         self.astp.visit(tree)
 
         self.newPhase()
@@ -546,33 +595,38 @@ class Compiler():
 
 
     def compile(self):
+        self.timings = []
+        t0 = time.perf_counter()
         ## Preload builtins to get all __defines
         mf = self.searchModule(self.builtins_module)
         if mf is None:
             fatal("Can't find builtins module")
-        modprg = self.readfile(mf,self.builtins_module)
-        tree = ast.parse(modprg)
+        modprg,tree = self.parsefile(mf,self.builtins_module)
         self.astp.visit(tree)
 
         if self.mode==Compiler.PREPROCESS:
             # preprocessing info
             return
+        t0 = self.timePhase("builtins preload",t0)
 
-        info("#"*10,"STEP",self.phase,"- first pass")
+        # generate code walking each module once: the names of a code object are resolved
+        # as soon as its scope is complete
+        info("#"*10,"STEP",self.phase,"- code generation")
         self.newPhase()
         self.compileModule(self.mainfile)
-        objs_at_0 = len(self.codeobjs)
-        mods_at_0 = len(self.modules)
-
+        t0 = self.timePhase("code generation",t0)
 
-
-        self.scratch()
-        info("#"*10,"STEP",self.phase,"- second pass")
-        self.phase = 1
-        self.newPhase()
-        self.compileModule(self.mainfile)
-        objs_at_0 = len(self.codeobjs)
-        mods_at_0 = len(self.modules)
+        # a __define or __cdefine met late can change how an already walked module is preprocessed:
+        # only then walk again, preprocessing just the changed modules
+        stale = self.stalePrepared()
+        if stale:
+            self.scratch()
+            self.phase = 1
+            info("#"*10,"STEP",self.phase,"- second pass for",len(stale),"changed modules")
+            self.newPhase()
+            self.compileModule(self.mainfile)
+            t0 = self.timePhase("second pass",t0)
+        self.astcache.trim()
 
 
         # map, attributes, modules, builtins, locals = self.optimizeNames()
@@ -647,9 +701,10 @@ class Compiler():
             gcc = cc.gcc(tools[self.board.cc],gccopts)
 
             ofilecnt = None
-            self.cncache.set_target(self.maindir,self.board.target,self.cdefines)
+            self.cncache.set_target(self.maindir,self.board.target,self.cdefines,gcc)
             tmpdir = self.tempdir
             ofiles = {}
+            tocompile = []
             for cfile in self.cfiles:
                 if not fs.exists(cfile):
                     warning(cfile,"does not exist")
@@ -669,22 +724,29 @@ class Compiler():
                     else:
                         #not in cache -_-
                         info("Compiling",cfile)
-                        cheaders = gcc.get_headers([cfile])
-                        #print("HEADERS",cheaders)
-                        ret,wrn,err,cout = gcc.compile([cfile],o=hfile)
-                        debug(cout)
-                        if ret==0:
-                            if wrn:
-                                for k,v in wrn.items():
-                                    for vv in v:
-                                        warning(k,"=> line",vv["line"],vv["msg"])
-                            self.cncache.add_object(cfile,hfile,cheaders[cfile])
-                        else:
-                            for k,v in err.items():
-                                for vv in v:
-                                    error(k,"=> line",vv["line"],vv["msg"])
-                            #TODO: fix exception
-                            raise CNativeError(0,0,cfile,"---")
+                        tocompile.append((cfile,hfile))
+
+            # compile all cache misses in parallel, then report in a fixed order
+            failed = None
+            for cfile,hfile,dfile,ret,wrn,err,cout in self.compileCFiles(gcc,tocompile):
+                debug(cout)
+                if ret==0:
+                    if wrn:
+                        for k,v in wrn.items():
+                            for vv in v:
+                                warning(k,"=> line",vv["line"],vv["msg"])
+                    self.cncache.add_object(cfile,hfile,depfile=dfile)
+                else:
+                    for k,v in err.items():
+                        for vv in v:
+                            error(k,"=> line",vv["line"],vv["msg"])
+                    if failed is None:
+                        failed = cfile
+            self.cncache.flush()
+            if failed is not None:
+                #TODO: fix exception
+                raise CNativeError(0,0,failed,"---")
+            t0 = self.timePhase("C compilation",t0)
             info("Linking...")
             obcfile = fs.path(tmpdir,"zerynth.vco")
             ofile = fs.path(tmpdir,"zerynth.rlo")
@@ -740,6 +802,7 @@ class Compiler():
                     error(ss)
                 raise CNativeError(0,0,"","some C natives are not defined!!")
             ofilecnt = fs.readfile(ofile,"b")
+            t0 = self.timePhase("linking",t0)
             # if len(undf)>0:
             #     error("The following symbols are undefined:")
             #     for ss in undf:
@@ -758,8 +821,33 @@ class Compiler():
         info("#"*10,"STEP",self.phase,"- generate binary")
 
         rt = self.generateBinary(ofilecnt,ofiles)
+        t0 = self.timePhase("binary generation",t0)
+        debug("Compilation times:")
+        for phase,secs in self.timings:
+            debug("   ",phase.ljust(20),"%.3f s"%secs)
+        debug("   ","total".ljust(20),"%.3f s"%sum(x[1] for x in self.timings))
         return rt
 
+    def timePhase(self,phase,t0):
+        now = time.perf_counter()
+        self.timings.append((phase,now-t0))
+        return now
+
+
+    def compileCFile(self,gcc,cfile,hfile):
+        # header dependencies are generated by the compilation itself
+        dfile = hfile[:-2]+".d"
+        ret,wrn,err,cout = gcc.compile([cfile],o=hfile,depfile=dfile)
+        return (cfile,hfile,dfile,ret,wrn,err,cout)
+
+    def compileCFiles(self,gcc,tocompile):
+        # results are returned in the same order as tocompile, regardless of completion order
+        if not tocompile:
+            return []
+        jobs = min(self.jobs,len(tocompile))
+        debug("Compiling",len(tocompile),"C files with",jobs,"jobs")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+            return list(pool.map(lambda x: self.compileCFile(gcc,*x),tocompile))
 
     def generateResourceTable(self):
         head = bytearray()
@@ -792,15 +880,25 @@ class Compiler():
                 res+=struct.pack("=B",0)
         return head+res
 
+    def makeRepr(self,co):
+        cr = CodeRepr()
+        cr.makeFromCode(co)
+        return cr
+
+    def makeReprs(self):
+        if self.reprs=="full":
+            return [self.makeRepr(co) for co in self.codeobjs]
+        if self.reprs=="lazy":
+            # built one at a time while the caller consumes them
+            return (self.makeRepr(co) for co in self.codeobjs)
+        return []
+
     def generateBinary(self,ofile=None,ofiles=None):
         bin = {}
         self.env.buildExceptionTable()
-        codereprs = []
         for co in self.codeobjs:
             co.resolveExceptions(self.env)
-            cr = CodeRepr()
-            cr.makeFromCode(co)
-            codereprs.append(cr)
+        codereprs = self.makeReprs()
 
         # Generate Code Image
         objbuf = []
@@ -27,13 +27,70 @@ The :command:`compile` command accepts additional options:
 * :option:`-I/--include path`, adds :samp:`path` to the list of directories scanned for Zerynth modules. This option can be repeated multiple times.
 * :option:`-D/--define def`, adds a C macro definition as a parameter for native C compiler. This option can be repeated multiple times.
 * :option:`-o/--output path`, specifies the path for the output file. If not specified it is :file:`main.vbo` in the project folder.
+* :option:`-j/--jobs n`, specifies the number of C source files compiled in parallel. If not specified it is the number of available CPUs.
+* :option:`-F/--format fmt`, specifies the format of the output file: :samp:`json` (default) or :samp:`bin`. See :ref:`binary bytecode <ztc-cmd-vbo-convert>`.
+* :option:`--repr mode`, specifies how the representation of the compiled code (used by debuggers and IDEs) is generated: :samp:`full` (default) embeds it in the output file, :samp:`lazy` writes it incrementally to a :file:`.repr.json` file next to the output file and :samp:`none` skips it.
+
+Compiled C objects are cached per project and reused if neither the source file nor its headers have been modified. If the :envvar:`ZERYNTH_NATIVE_CACHE` environment variable (or the :samp:`native_cache` configuration key) is set to a directory, a content addressed cache is used instead: objects are keyed on the contents of sources and headers, on compiler flags and definitions and on the compiler version, so that they can be shared among projects and machines. The cache size is limited by :envvar:`ZERYNTH_NATIVE_CACHE_SIZE` (in MB, default 1024) and least recently used objects are evicted first.
+
+Preprocessed Python modules, toolchain probes and relocated images are cached under the Zerynth temporary directory. Each of these caches is limited by :envvar:`ZERYNTH_TMP_CACHE_SIZE` (in MB, default 256), evicting least recently used entries first.
+
+
+.. _ztc-cmd-compile-server:
+
+Compile server
+--------------
+
+The command: ::
+
+        ztc compile-server
+
+starts a long running compiler that keeps device classes, opcode tables and parsed modules in memory between compilations. It is meant for tools that compile the same projects many times (IDEs, CI) and want to pay the startup time only once.
+
+Requests are JSON-RPC 2.0 objects, one per line, read from :samp:`stdin`; responses are written one per line to :samp:`stdout`. With the :option:`-p/--port port` option requests are accepted instead on a TCP socket bound to :samp:`127.0.0.1:port`.
+
+The following methods are available:
+
+* :samp:`compile`, takes the parameters :samp:`project` and :samp:`target` and the optional :samp:`output`, :samp:`include`, :samp:`define`, :samp:`proj`, :samp:`tmpdir`, :samp:`jobs`, :samp:`format` and :samp:`repr` with the same meaning as the :command:`compile` options. The result contains the path of the generated bytecode (:samp:`output`), the compilation log (:samp:`log`) and the compilation time in seconds (:samp:`time`). If the :samp:`inline` parameter is true, the bytecode is also returned in the :samp:`vbo` field. On failure an error is returned with the log in its :samp:`data` field.
+* :samp:`ping`, returns :samp:`pong`.
+* :samp:`shutdown`, stops the server.
+
+Example: ::
+
+        {"jsonrpc":"2.0","id":1,"method":"compile","params":{"project":"myproject","target":"esp32_devkitc"}}
+
+
+.. _ztc-cmd-vbo-convert:
+
+Binary bytecode
+---------------
+
+Bytecode files are JSON objects by default, with the compiled code encoded in base64. With :option:`--format bin` the compiler produces instead a binary container with the same content: code sections are stored raw and every other field is a separate section, read only when needed. The debug representation of the code is compressed. Binary and JSON bytecode files can be used interchangeably by :command:`uplink` and :command:`link`.
+
+The command: ::
+
+        ztc vbo-convert src dst
+
+converts the bytecode file :samp:`src` to :samp:`dst`. It accepts the following options:
+
+* :option:`-F/--format fmt`, the format of :samp:`dst`: :samp:`bin` (default) or :samp:`json`.
+* :option:`-c/--compress method`, the compression of the debug representation in binary files: :samp:`lzma` (default), :samp:`zstd` (needs the :samp:`zstandard` package) or :samp:`none`.
+* :option:`--bench`, prints the size of both files and the time needed to load them, both fully and only the sections needed for relocation.
 
 
 """
 from base import *
 from .compiler import Compiler
 from .exceptions import *
+from .codecache import AstCache
+from devices import Discover
 import click
+import contextlib
+import io
+import json
+import socketserver
+import sys
+import time
 
 @cli.command(help="Compile a project. \n\n Arguments: \n\n PROJECT: project path. \n\n TARGET: device target.")
 @click.argument("project",type=click.Path())
@@ -45,14 +102,28 @@ import click
 @click.option("--imports","-m",flag_value=True,default=False,help="only generate the list of imported modules")
 @click.option("--config","-cfg",flag_value=True,default=False,help="only generate the configuration table")
 @click.option("--tmpdir","-tmp",default="",help="set temp directory")
-def compile(project,target,output,include,define,imports,proj,config,tmpdir):
-    _zcompile(project,target,output,include,define,imports,proj,config,tmpdir)
+@click.option("--jobs","-j",default=0,type=int,help="number of parallel C compilations (default: number of cpus)")
+@click.option("--format","-F","fmt",default="json",type=click.Choice(["json","bin"]),help="output file format")
+@click.option("--repr","repr_mode",default="full",type=click.Choice(["none","lazy","full"]),help="code representation: embedded (full), in a separate file (lazy) or skipped (none)")
+def compile(project,target,output,include,define,imports,proj,config,tmpdir,jobs,fmt,repr_mode):
+    _zcompile(project,target,output,include,define,imports,proj,config,tmpdir,jobs,fmt=fmt,repr_mode=repr_mode)
+
 
+def do_compile(project,target,output,include,define,imports,proj,config,tmpdir,jobs=0,fmt="json",repr_mode="full"):
+    return _zcompile(project,target,output,include,define,imports,proj,config,tmpdir,jobs,fmt=fmt,repr_mode=repr_mode)
 
-def do_compile(project,target,output,include,define,imports,proj,config,tmpdir):
-    _zcompile(project,target,output,include,define,imports,proj,config,tmpdir)
+def _write_reprs(reprs,reprfile):
+    # stream the representations as a json list, one code object at a time
+    def write(ff):
+        ff.write(b"[")
+        for i,rep in enumerate(reprs):
+            if i:
+                ff.write(b",")
+            ff.write(bytes(json.dumps(rep.toDict()),"utf-8"))
+        ff.write(b"]")
+    fs.atomic_write(write,reprfile)
 
-def _zcompile(project,target,output,include,define,imports,proj,config,tmpdir):
+def _zcompile(project,target,output,include,define,imports,proj,config,tmpdir,jobs=0,discover=None,astcache=None,fmt="json",repr_mode="full"):
     if project.endswith(".py"):
         mainfile=project
         project=fs.dirname(project)
@@ -79,7 +150,7 @@ def _zcompile(project,target,output,include,define,imports,proj,config,tmpdir):
 
 
     #TODO: check target is valid
-    compiler = Compiler(mainfile,target,include,define,localmods=prjs,tempdir=tmpdir)
+    compiler = Compiler(mainfile,target,include,define,localmods=prjs,tempdir=tmpdir,jobs=jobs,discover=discover,astcache=astcache,reprs=repr_mode)
     try:
         if not imports and not config:
             binary, reprs = compiler.compile()
@@ -120,9 +191,19 @@ def _zcompile(project,target,output,include,define,imports,proj,config,tmpdir):
                 if not output.endswith(".vbo"):
                     output=output+".vbo"
         info("Saving to",output)
-        binary["repr"]=[rep.toDict() for rep in reprs]
+        if repr_mode=="full":
+            binary["repr"]=[rep.toDict() for rep in reprs]
+        else:
+            binary["repr"]=[]
+            if repr_mode=="lazy":
+                reprfile = output[:-4]+".repr.json"
+                _write_reprs(reprs,reprfile)
+                binary["repr_file"]=fs.basename(reprfile)
         binary["project"]=project
-        fs.set_json(binary,output)
+        if fmt=="bin":
+            save_vbo(binary,output)
+        else:
+            fs.set_json(binary,output)
         info("Compilation Ok")
         # write a report on available options
         if compiler.has_options:
@@ -136,6 +217,7 @@ def _zcompile(project,target,output,include,define,imports,proj,config,tmpdir):
                             warning(key,"enabled")
                         else:
                             warning(key,"disabled")
+        return output
     else:
         if imports:
             if env.human:
@@ -158,6 +240,135 @@ def _zcompile(project,target,output,include,define,imports,proj,config,tmpdir):
             log_json([conf,prep])
 
 
+class CompileServer():
+    # keeps the compilation environment warm between requests
+    def __init__(self):
+        self.discover = None
+        self.astcaches = {}
+        self.running = True
+
+    def handle(self,line):
+        try:
+            req = json.loads(line)
+        except Exception as e:
+            return {"jsonrpc":"2.0","id":None,"error":{"code":-32700,"message":"Parse error"}}
+        rid = req.get("id")
+        method = req.get("method")
+        params = req.get("params") or {}
+        try:
+            if method=="compile":
+                return self.compile(rid,params)
+            elif method=="ping":
+                res = "pong"
+            elif method=="shutdown":
+                self.running = False
+                res = None
+            else:
+                return {"jsonrpc":"2.0","id":rid,"error":{"code":-32601,"message":"Method not found"}}
+        except Exception as e:
+            return {"jsonrpc":"2.0","id":rid,"error":{"code":-32603,"message":str(e)}}
+        return {"jsonrpc":"2.0","id":rid,"result":res}
+
+    def compile(self,rid,params):
+        if "project" not in params or "target" not in params:
+            return {"jsonrpc":"2.0","id":rid,"error":{"code":-32602,"message":"project and target are required"}}
+        target = params["target"]
+        buf = io.StringIO()
+        ret = 0
+        output = None
+        t0 = time.perf_counter()
+        # the log of the compilation goes in the response, stdout is reserved to the protocol
+        with contextlib.redirect_stdout(buf), contextlib.redirect_stderr(buf):
+            try:
+                if self.discover is None:
+                    self.discover = Discover()
+                if target not in self.astcaches:
+                    self.astcaches[target] = AstCache(target)
+                output = _zcompile(params["project"],target,params.get("output",False),params.get("include",[]),params.get("define",[]),False,params.get("proj",[]),False,params.get("tmpdir",""),params.get("jobs",0),discover=self.discover,astcache=self.astcaches[target],fmt=params.get("format","json"),repr_mode=params.get("repr","full"))
+            except SystemExit as e:
+                ret = e.code
+        if ret:
+            return {"jsonrpc":"2.0","id":rid,"error":{"code":ret,"message":"Compilation failed","data":{"log":buf.getvalue()}}}
+        res = {
+            "output":output,
+            "log":buf.getvalue(),
+            "time":time.perf_counter()-t0
+        }
+        if params.get("inline"):
+            res["vbo"]=vbo_to_json(load_vbo(output))
+        return {"jsonrpc":"2.0","id":rid,"result":res}
 
 
+class CompileRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            line = line.decode("utf-8").strip()
+            if not line:
+                continue
+            res = self.server.compileserver.handle(line)
+            self.wfile.write(bytes(json.dumps(res)+"\n","utf-8"))
+            self.wfile.flush()
+            if not self.server.compileserver.running:
+                break
 
+
+@cli.command("compile-server",help="Start a long running compiler accepting JSON-RPC requests on stdin or on a local socket.")
+@click.option("--port","-p",default=0,type=int,help="listen on 127.0.0.1:port instead of stdin")
+def compile_server(port):
+    server = CompileServer()
+    if port:
+        srv = socketserver.TCPServer(("127.0.0.1",port),CompileRequestHandler)
+        srv.compileserver = server
+        info("Compile server listening on port",port)
+        # one request at a time: compilations share the process state
+        try:
+            while server.running:
+                srv.handle_request()
+        finally:
+            srv.server_close()
+    else:
+        out = sys.stdout
+        for line in sys.stdin:
+            line = line.strip()
+            if not line:
+                continue
+            res = server.handle(line)
+            out.write(json.dumps(res)+"\n")
+            out.flush()
+            if not server.running:
+                break
+
+
+def _vbo_load_times(path):
+    t0 = time.perf_counter()
+    bf = load_vbo(path)
+    for field in ("info","cnatives","header","pyobjs","cobjs"):
+        bf.get(field)
+    t1 = time.perf_counter()
+    vbo_to_json(load_vbo(path))
+    t2 = time.perf_counter()
+    return t1-t0,t2-t1
+
+
+@cli.command("vbo-convert",help="Convert a bytecode file between json and binary format. \n\n Arguments: \n\n SRC: bytecode file. \n\n DST: converted bytecode file.")
+@click.argument("src",type=click.Path(exists=True))
+@click.argument("dst",type=click.Path())
+@click.option("--format","-F","fmt",default="bin",type=click.Choice(["json","bin"]),help="format of the converted file")
+@click.option("--compress","-c",default="lzma",type=click.Choice(["lzma","zstd","none"]),help="compression of the debug sections in binary files")
+@click.option("--bench",flag_value=True,default=False,help="print size and load time of both files")
+def vbo_convert(src,dst,fmt,compress,bench):
+    try:
+        bf = load_vbo(src)
+        if fmt=="bin":
+            save_vbo(bf,dst,compress)
+        else:
+            fs.set_json(vbo_to_json(bf),dst)
+    except Exception as e:
+        fatal("Can't convert",src,"->",e)
+    info("Converted",src,"to",dst)
+    if bench:
+        table = []
+        for path in (src,dst):
+            reloc,full = _vbo_load_times(path)
+            table.append([path,"bin" if is_binary_vbo(path) else "json",fs.stat(path).st_size,"%.4f"%reloc,"%.4f"%full])
+        log_table(table,headers=["File","Format","Size","Relocation load (s)","Full load (s)"])
@@ -0,0 +1,156 @@
+import struct
+
+# Minimal ELF reader: section headers, section contents and symbol table.
+# Only what is needed to replace objdump -t/-s when relocating C objects.
+
+ET_REL = 1
+
+SHT_SYMTAB = 2
+SHT_NOBITS = 8
+
+SHF_ALLOC = 2
+
+SHN_UNDEF = 0
+SHN_LORESERVE = 0xff00
+SHN_ABS = 0xfff1
+SHN_COMMON = 0xfff2
+
+STT_SECTION = 3
+STT_FILE = 4
+
+
+class ElfError(Exception):
+    pass
+
+
+class ElfSection():
+    def __init__(self, name, type, flags, addr, offset, size, link, info, addralign, entsize):
+        self.name = name
+        self.type = type
+        self.flags = flags
+        self.addr = addr
+        self.offset = offset
+        self.size = size
+        self.link = link
+        self.info = info
+        self.addralign = addralign
+        self.entsize = entsize
+
+
+class ElfSymbol():
+    def __init__(self, name, value, size, bind, type, shndx, section, address):
+        self.name = name
+        self.value = value
+        self.size = size
+        self.bind = bind
+        self.type = type
+        self.shndx = shndx
+        # section name as printed by objdump (*UND*, *ABS*, *COM* for special indexes)
+        self.section = section
+        # address as printed by objdump: section relative values are moved to the section address
+        self.address = address
+
+
+class ElfFile():
+    def __init__(self, data):
+        self.data = memoryview(data)
+        if bytes(self.data[0:4])!=b"\x7fELF":
+            raise ElfError("not an ELF file")
+        eclass = self.data[4]
+        edata = self.data[5]
+        if eclass not in (1,2) or edata not in (1,2):
+            raise ElfError("unsupported ELF class or encoding")
+        self.is64 = eclass==2
+        self.endian = "<" if edata==1 else ">"
+        if self.is64:
+            hdr = struct.unpack_from(self.endian+"HHIQQQIHHHHHH",self.data,16)
+            self.shfmt = self.endian+"IIQQQQIIQQ"
+            self.symfmt = self.endian+"IBBHQQ"
+        else:
+            hdr = struct.unpack_from(self.endian+"HHIIIIIHHHHHH",self.data,16)
+            self.shfmt = self.endian+"IIIIIIIIII"
+            self.symfmt = self.endian+"IIIBBH"
+        self.type = hdr[0]
+        self.machine = hdr[1]
+        shoff = hdr[5]
+        shentsize = hdr[10]
+        shnum = hdr[11]
+        shstrndx = hdr[12]
+        try:
+            raw = [struct.unpack_from(self.shfmt,self.data,shoff+i*shentsize) for i in range(shnum)]
+        except struct.error:
+            raise ElfError("truncated section table")
+        if shnum and shstrndx<shnum:
+            shstr = raw[shstrndx]
+            strtab = bytes(self.data[shstr[4]:shstr[4]+shstr[5]])
+        else:
+            strtab = b""
+        self.sections = []
+        self.sectionmap = {}
+        for sh in raw:
+            sect = ElfSection(self._str(strtab,sh[0]),sh[1],sh[2],sh[3],sh[4],sh[5],sh[6],sh[7],sh[8],sh[9])
+            self.sections.append(sect)
+            if sect.name not in self.sectionmap:
+                self.sectionmap[sect.name]=sect
+        self._symbols = None
+
+    @staticmethod
+    def from_file(fname):
+        with open(fname,"rb") as ff:
+            return ElfFile(ff.read())
+
+    def _str(self, strtab, offset):
+        end = strtab.find(b"\0",offset)
+        if end<0:
+            end = len(strtab)
+        return strtab[offset:end].decode("utf-8","replace")
+
+    def section(self, name):
+        return self.sectionmap.get(name)
+
+    def section_data(self, name):
+        # contents of a section as a memoryview slice of the file, empty for sections without data
+        sect = self.sectionmap.get(name)
+        if not sect or sect.type==SHT_NOBITS:
+            return self.data[0:0]
+        return self.data[sect.offset:sect.offset+sect.size]
+
+    def symbols(self):
+        if self._symbols is not None:
+            return self._symbols
+        self._symbols = []
+        for sect in self.sections:
+            if sect.type!=SHT_SYMTAB:
+                continue
+            link = self.sections[sect.link]
+            strtab = bytes(self.data[link.offset:link.offset+link.size])
+            entsize = sect.entsize or struct.calcsize(self.symfmt)
+            # entry 0 is the null symbol
+            for pos in range(sect.offset+entsize,sect.offset+sect.size,entsize):
+                if self.is64:
+                    st_name,st_info,st_other,st_shndx,st_value,st_size = struct.unpack_from(self.symfmt,self.data,pos)
+                else:
+                    st_name,st_value,st_size,st_info,st_other,st_shndx = struct.unpack_from(self.symfmt,self.data,pos)
+                stype = st_info&0xf
+                address = st_value
+                if st_shndx==SHN_UNDEF:
+                    section = "*UND*"
+                elif st_shndx==SHN_ABS:
+                    section = "*ABS*"
+                elif st_shndx==SHN_COMMON:
+                    section = "*COM*"
+                    # the value of common symbols is their alignment, objdump prints their size as address
+                    address = st_size
+                elif st_shndx<SHN_LORESERVE and st_shndx<len(self.sections):
+                    section = self.sections[st_shndx].name
+                    if self.type==ET_REL:
+                        address += self.sections[st_shndx].addr
+                else:
+                    section = "*ABS*"
+                if stype==STT_SECTION and st_name==0:
+                    name = section
+                else:
+                    name = self._str(strtab,st_name)
+                self._symbols.append(ElfSymbol(name,st_value,st_size,st_info>>4,stype,st_shndx,section,address))
+            break
+        return self._symbols
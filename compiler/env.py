@@ -188,6 +188,15 @@ class Env():
     exc_strings = {}
     curnamecode = 256
 
+    @staticmethod
+    def reset():
+        Env.builtins = []
+        Env.natives = []
+        Env.namestore = {}
+        Env.exceptions = {}
+        Env.exc_strings = {}
+        Env.curnamecode = 256
+
     def __init__(self):
         self.scopes = []
         self.scopedir={}
@@ -95,6 +95,9 @@ bytecodemap = {}
 
 def genByteCodeMap():
     global bytecodemap
+    if bytecodemap:
+        # already loaded by a previous compilation in this process
+        return
     fname = os.path.join(env.stdlib,"__lang","opcodes.h")
     f = open(fname)
     lines = f.readlines()
@@ -216,7 +216,7 @@ def _target_exists(target):
 
 def _extract_chipid_from_serial(tgt):
     conn = ConnectionInfo()
-    conn.set_serial(tgt.port,**tgt.connection)
+    conn.set_port(tgt.port,**tgt.connection)
     ch = Channel(conn)
     try:
         ch.open(timeout=2)
@@ -385,11 +385,14 @@ where :samp:`chipid` is the microcontroller unique identifier  and :samp:`target
 Upon successful registration the device is assigned an UID by the backend.
 
     """
+    do_register_by_uid(chipid,target)
+
+def do_register_by_uid(chipid,target):
     dinfo = {
         "on_chip_id": chipid,
         "type": target
     }
-    _register_device(dinfo)
+    return _register_device(dinfo)
 
 @device.command("register_raw", help="Register a new device giving target details")
 @click.argument("target")
@@ -524,7 +527,7 @@ The virtualization process is automated, no user interaction is required.
             fatal("Ambiguous VM uid",vuids)
         else:
             fatal("VM",vmuid,"does not exist")
-    vm = fs.get_json(vms[vmuid])
+    vm = tools.load_vm(vms[vmuid])
     info("Starting Virtualization...")
     res,out = tgt.do_burn_vm(vm,{},info)
     # if isinstance(vm["bin"],str):
@@ -575,7 +578,7 @@ def _virtualize_raw(vmuid,__specs):
     if len(vms)>1:
         fatal("Ambiguous VM uid:",vms[:10])
     vmfile = vms[0]
-    vm = fs.get_json(vmfile)
+    vm = tools.load_vm(vmfile)
     # manage specs
     options = tools.get_specs(__specs)
     dev =  _dsc.get_target(vm["dev_type"],options)    
@@ -594,7 +597,9 @@ def _virtualize_raw(vmuid,__specs):
 @click.argument("alias")
 @click.option("--echo","__echo",flag_value=True, default=False,help="print typed characters to stdin")
 @click.option("--baud","__baud", default=0,type=int,help="open with a specific baudrate")
-def open(alias,__echo,__baud):
+@click.option("--log","__log", default=None,type=click.Path(),help="append the device output to a file, with timestamps")
+@click.option("--stats","__stats", default=False,flag_value=True,help="print received and dropped bytes per second")
+def open(alias,__echo,__baud,__log,__stats):
     """ 
 .. _ztc-cmd-device-open:
 
@@ -609,6 +614,8 @@ The command: ::
 
 tries to open the default serial port with the correct parameters for the device. Output from the device is printed to stdout while stdin is redirected to the serial port. Adding the option :option:`--echo` to the command echoes back the characters from stdin to stdout.
 
+Device output is buffered and printed in batches, so that fast devices are not slowed down by the terminal; if the terminal can't keep up, the oldest buffered output is dropped. The option :option:`--log file` appends the output to :samp:`file` with a timestamp for each line, and the option :option:`--stats` prints every second the number of bytes per second received and of bytes dropped.
+
     """
     tgt = _dsc.search_for_device(alias)
     if not tgt:
@@ -619,10 +626,10 @@ tries to open the default serial port with the correct parameters for the device
     conn = ConnectionInfo()
     if __baud:
         tgt.connection["baudrate"]=__baud
-    conn.set_serial(tgt.port,**tgt.connection)
+    conn.set_port(tgt.port,**tgt.connection)
     ch = Channel(conn,__echo)
     ch.open()
-    ch.run()
+    ch.run(logfile=__log,stats=__stats)
     # import serial
     # ser = serial.Serial(tgt.port,115200)
     # while True:
@@ -639,7 +646,9 @@ tries to open the default serial port with the correct parameters for the device
 @click.option("--stopbits","__stopbits", default=1,type=int,help="")
 @click.option("--dsrdtr","__dsrdtr", default=False,flag_value=True,help="")
 @click.option("--rtscts","__rtscts", default=False,flag_value=True,help="")
-def open_raw(port,__echo,__baud,__parity,__bits,__stopbits,__dsrdtr,__rtscts):
+@click.option("--log","__log", default=None,type=click.Path(),help="append the device output to a file, with timestamps")
+@click.option("--stats","__stats", default=False,flag_value=True,help="print received and dropped bytes per second")
+def open_raw(port,__echo,__baud,__parity,__bits,__stopbits,__dsrdtr,__rtscts,__log,__stats):
     """ 
 .. _ztc-cmd-device-open-raw:
 
@@ -656,14 +665,16 @@ The command: ::
 
 tries to open :samp:`port` with the correct parameters for the device. Output from the device is printed to stdout while stdin is redirected to the serial port. Adding the option :option:`--echo` to the command echoes back the characters from stdin to stdout.
 
+A device behind a serial to ethernet server can be reached with a :samp:`port` of the form :samp:`tcp://host:port`.
+
     """
-    _open_raw(port,__echo,__baud,__parity,__bits,__stopbits,__dsrdtr,__rtscts)
+    _open_raw(port,__echo,__baud,__parity,__bits,__stopbits,__dsrdtr,__rtscts,__log,__stats)
 
-def do_open_raw(port,__echo,__baud,__parity,__bits,__stopbits,__dsrdtr,__rtscts):
-    _open_raw(port,__echo,__baud,__parity,__bits,__stopbits,__dsrdtr,__rtscts)
+def do_open_raw(port,__echo,__baud,__parity,__bits,__stopbits,__dsrdtr,__rtscts,__log=None,__stats=False):
+    _open_raw(port,__echo,__baud,__parity,__bits,__stopbits,__dsrdtr,__rtscts,__log,__stats)
 
 
-def _open_raw(port,__echo,__baud,__parity,__bits,__stopbits,__dsrdtr,__rtscts):
+def _open_raw(port,__echo,__baud,__parity,__bits,__stopbits,__dsrdtr,__rtscts,__log=None,__stats=False):
     conn = ConnectionInfo()
     options={
         "baudrate":__baud,
@@ -673,10 +684,10 @@ def _open_raw(port,__echo,__baud,__parity,__bits,__stopbits,__dsrdtr,__rtscts):
         "dsrdtr":__dsrdtr,
         "rtscts":__rtscts
     }
-    conn.set_serial(port,**options)
+    conn.set_port(port,**options)
     ch = Channel(conn,__echo)
     ch.open()
-    ch.run()
+    ch.run(logfile=__log,stats=__stats)
 
 
 
@@ -50,45 +50,72 @@ class Device():
 
     def burn_with_probe(self,bin,offset=0,reset=True):
         #TODO: add support for multifile vms
-        offs = offset if isinstance(offset,str) else hex(offset)
         fname = fs.get_tempfile(bin)
         try:
             pb  = Probe()
             pb.connect()
-            jcmd ="program "+fs.wpath(fname)+" verify "
-            if reset:
-                jcmd+="reset "
-            jcmd+=offs
-            pb.send(jcmd,info)
-            now = time.time()
-            wait_verification = False
-            while time.time()-now<self.get("jtag_timeout",30):
-                lines = pb.read_lines()
-                for line in lines:
-                    if line.startswith("wrote 0 "):
-                        return False,"0 bytes written!"
-                    if line.startswith("** Programming Started **"):
-                        wait_verification=True
-                    if wait_verification and line.startswith("** Verified OK"):
-                        if self.get("jtag_burn_end"):
-                            pb.send(self.get("jtag_burn_end"))
-                        return True, ""
-                    if wait_verification and line.startswith("** Verified Failed"):
-                        return False, "Verification failed"
-                    if "** Programming Finished **" in line:
-                        # reset countdown
-                        now = time.time()
-                    if "** Programming Failed **" in line:
-                        return False, "Programming failed"
-                    if "** Programming Finished **" in line:
-                        # restart timeout counter
-                        now = time.time()
-            return False,"timeout"
+            res, out = self._program_with_probe(pb,fname,offset,reset)
+            if res and self.get("jtag_burn_end"):
+                pb.send(self.get("jtag_burn_end"))
+            return res, out
         except Exception as e:
             return False, str(e)
         finally:
             fs.del_tempfile(fname)
 
+    def burn_regions_with_probe(self,regions,reset=False):
+        # all regions are programmed in a single probe session
+        fnames = []
+        try:
+            pb  = Probe()
+            pb.connect()
+            for region in regions:
+                loc = region["loc"]
+                info("Burning region at",hex(loc) if not isinstance(loc,str) else loc,"size",len(region["bin"]),"bytes","("+str(region["dsc"])+")")
+                fname = fs.get_tempfile(region["bin"])
+                fnames.append(fname)
+                res, out = self._program_with_probe(pb,fname,loc,reset)
+                if not res:
+                    return False, "Burning failed for "+str(region["dsc"])+": "+out
+            if self.get("jtag_burn_end"):
+                pb.send(self.get("jtag_burn_end"))
+            return True, ""
+        except Exception as e:
+            return False, str(e)
+        finally:
+            for fname in fnames:
+                fs.del_tempfile(fname)
+
+    def _program_with_probe(self,pb,fname,offset,reset):
+        offs = offset if isinstance(offset,str) else hex(offset)
+        jcmd ="program "+fs.wpath(fname)+" verify "
+        if reset:
+            jcmd+="reset "
+        jcmd+=offs
+        pb.send(jcmd,info)
+        now = time.time()
+        wait_verification = False
+        while time.time()-now<self.get("jtag_timeout",30):
+            lines = pb.read_lines()
+            for line in lines:
+                if line.startswith("wrote 0 "):
+                    return False,"0 bytes written!"
+                if line.startswith("** Programming Started **"):
+                    wait_verification=True
+                if wait_verification and line.startswith("** Verified OK"):
+                    return True, ""
+                if wait_verification and line.startswith("** Verified Failed"):
+                    return False, "Verification failed"
+                if "** Programming Finished **" in line:
+                    # reset countdown
+                    now = time.time()
+                if "** Programming Failed **" in line:
+                    return False, "Programming failed"
+                if "** Programming Finished **" in line:
+                    # restart timeout counter
+                    now = time.time()
+        return False,"timeout"
+
     def get_chipid(self):
         try:
             pb = Probe()
@@ -208,14 +235,13 @@ class Device():
                     if self.preferred_burn_with_jtag:
                         options = self.preferred_burn_with_jtag
                     tp = start_temporary_probe(self.target,options.get("probe"))
-                    for chunk in layout.chunks():
-                        info("Burning chunk at",hex(chunk["loc"]) if not isinstance(chunk["loc"],str) else chunk["loc"],"size",len(chunk["bin"]),"bytes")
-                        res,out = self.burn_with_probe(chunk["bin"],chunk["loc"],reset=False)
-                        if not res:
-                            stop_temporary_probe(tp)
-                            return False,"Burning failed for "+str(chunk["dsc"])
-                    stop_temporary_probe(tp)
-                    return True,""
+                    # adjacent chunks are programmed together; layout_max_gap lets a device also merge
+                    # chunks separated by up to that many bytes, overwriting the gaps with 0xFF
+                    regions = list(layout.regions(self.get("layout_max_gap",0)))
+                    try:
+                        return self.burn_regions_with_probe(regions,reset=False)
+                    finally:
+                        stop_temporary_probe(tp)
                 else:
                     return False, "Layout burning not supported without a probe"
         except Exception as e:
@@ -3,6 +3,8 @@ import sys
 import importlib
 import json
 import hashlib
+import os
+import time
 
 
 
@@ -25,6 +27,8 @@ class Discover():
         self.devices = {}
         self.matched_devices = {}
         self.device_cls = {}
+        self.device_ids = {}
+        self.new_ids = False
         self.targets = {}
         self.load_devices()
 
@@ -35,21 +39,25 @@ class Discover():
         tgt = self.targets.get(target)
         if not tgt:
             return None
-        return tgt["cls"](tgt,options) 
+        cls = self.load_class(tgt)
+        self.save_new_ids()
+        if not cls:
+            return None
+        return cls(tgt,options)
 
     def load_devices(self):
-        bdirs = fs.dirs(env.devices)
-        for bj in tools.get_devices():
+        # device classes are imported on demand: until then "cls" holds the module.Class name.
+        # get_target imports only the class of its target, matching imports only the classes
+        # whose vid/pid (recorded in the index at their first import) may belong to the device
+        for bj in self.load_index():
             for cls in bj["classes"]:
                 try:
-                    sys.path.append(bj["path"])
                     module,bcls = cls.split(".")
-                    bc = importlib.import_module(module)
-                    dcls = getattr(bc,bcls)
                     bjc = dict(bj)
-                    bjc["cls"]=dcls
-                    sys.path.pop()
-                    self.device_cls[bj["path"]+"::"+bcls]=bjc
+                    bjc["cls"]=cls
+                    dkey = bj["path"]+"::"+bcls
+                    self.device_cls[dkey]=bjc
+                    self.device_ids[dkey]=self.known_ids(dkey)
                     if "target" in bj:
                         if "jtag_class" in bj:
                             if bj["jtag_class"]==bcls:
@@ -59,13 +67,131 @@ class Discover():
                 except Exception as e:
                     warning(e)
 
+    def load_class(self,dinfo):
+        cls = dinfo["cls"]
+        if isinstance(cls,str):
+            module,bcls = cls.split(".")
+            sys.path.append(dinfo["path"])
+            try:
+                bc = importlib.import_module(module)
+                dinfo["cls"] = getattr(bc,bcls)
+                self.save_ids(dinfo["path"]+"::"+bcls,bc,dinfo["cls"])
+            except Exception as e:
+                warning(e)
+                dinfo["cls"] = None
+            finally:
+                sys.path.remove(dinfo["path"])
+        return dinfo["cls"]
+
+    ##### Vid/pid index
+    #
+    # Device classes declare the usb ids they match in ids_vendor ({vid:set of pids}).
+    # They are recorded in the target index at the first import of the class, together with the mtime
+    # of its module; afterwards the class is imported only for devices with those ids.
+    # Classes without ids_vendor are always imported and asked with match().
+
+    def known_ids(self,dkey):
+        # set of "VID:PID", None if the class must be asked
+        entry = self.index["ids"].get(dkey)
+        if not entry or entry["ids"] is None:
+            return None
+        try:
+            if os.stat(entry["file"]).st_mtime!=entry["mtime"]:
+                return None
+        except:
+            return None
+        return set(entry["ids"])
+
+    def save_ids(self,dkey,module,cls):
+        ids = getattr(cls,"ids_vendor",None)
+        try:
+            if isinstance(ids,dict):
+                ids = sorted(set((str(vid)+":"+str(pid)).upper() for vid,pids in ids.items() for pid in pids))
+            else:
+                ids = None
+            mfile = module.__file__
+            self.index["ids"][dkey] = {"file":mfile,"mtime":os.stat(mfile).st_mtime,"ids":ids}
+            self.new_ids = True
+        except Exception as e:
+            debug("Can't record device ids",e)
+
+    def save_new_ids(self):
+        # the index is written once per match, not at each import
+        if self.new_ids:
+            self.new_ids = False
+            self.save_index()
+
+    def may_match(self,dkey,dev):
+        ids = self.device_ids.get(dkey)
+        if ids is None:
+            return True
+        return (str(dev.get("vid"))+":"+str(dev.get("pid"))).upper() in ids
+
+    ##### Target index
+    #
+    # The device.json of every installed and custom device, augmented with package info, is kept
+    # in env.tmp/devices_index.json and read again only if device directories or installed packages change.
+    # The vid/pid of device classes are kept in the same file and discarded with it.
+
+    def index_signature(self):
+        sig = []
+        for root in [env.devices,env.cvm]:
+            try:
+                bdirs = sorted(fs.dirs(root))
+            except:
+                bdirs = []
+            for bdir in bdirs:
+                entry = [bdir]
+                for ff in ["device.json","z.yml","package.json","active"]:
+                    try:
+                        entry.append(os.stat(fs.path(bdir,ff)).st_mtime)
+                    except:
+                        entry.append(None)
+                sig.append(entry)
+        try:
+            sig.append(os.stat(fs.path(env.dist,"installed.json")).st_mtime)
+        except:
+            sig.append(None)
+        return hashlib.sha256(bytes(json.dumps(sig),"utf-8")).hexdigest()
+
+    def load_index(self):
+        signature = self.index_signature()
+        try:
+            index = fs.get_json(fs.path(env.tmp,"devices_index.json"))
+            if index["signature"]==signature:
+                index.setdefault("ids",{})
+                self.index = index
+                return index["devices"]
+        except:
+            pass
+        self.index = {"signature":signature,"devices":list(tools.get_devices()),"ids":{}}
+        self.save_index()
+        return self.index["devices"]
+
+    def save_index(self):
+        try:
+            fs.atomic_write(json.dumps(self.index),fs.path(env.tmp,"devices_index.json"))
+        except Exception as e:
+            debug("Can't save device index",e)
+
+    def wait_for_event(self,timeout):
+        # returns True as soon as the device source reports a change, False after timeout seconds
+        if hasattr(self.devsrc,"wait_event"):
+            return self.devsrc.wait_event(timeout)
+        if timeout>0:
+            sleep(timeout)
+        return False
+
     def wait_for_uid(self,uid,loop=5,matchdb=True):
         for l in range(loop):
-            devs = self.run_one(matchdb)
-            uids = self.matching_uids(devs,uid)
-            if len(uids)>=1:
-                return uids,devs
-            sleep(1)
+            tick = time.perf_counter()+1
+            while True:
+                devs = self.run_one(matchdb)
+                uids = self.matching_uids(devs,uid)
+                if len(uids)>=1:
+                    return uids,devs
+                if not self.wait_for_event(tick-time.perf_counter()):
+                    break
             info("attempt",l+1)
         return [],{}
 
@@ -73,13 +199,16 @@ class Discover():
         devs = {}
         uids = []
         for l in range(loop):
-            devs = self.run_one(matchdb)
-            uids = [uid for uid,dev in devs.items() if dev.classname==classname]
-            if len(uids)>=1:
-                tgt = devs[uids[0]]
-                if tgt.port is not None:
-                    return uids,devs
-            sleep(1)
+            tick = time.perf_counter()+1
+            while True:
+                devs = self.run_one(matchdb)
+                uids = [uid for uid,dev in devs.items() if dev.classname==classname]
+                if len(uids)>=1:
+                    tgt = devs[uids[0]]
+                    if tgt.port is not None:
+                        return uids,devs
+                if not self.wait_for_event(tick-time.perf_counter()):
+                    break
             info("attempt",l+1)
         if len(uids)>=1:
             return uids,devs
@@ -173,16 +302,22 @@ class Discover():
         #print(tuid)
         # perform device - known device matching
         for dkey,dinfo in self.device_cls.items():
-            cls = dinfo["cls"]
+            clsname = dkey.split("::")[-1]
             for dev in pdevs:
                 #print("Checking",dev["uid"],dev["uid"] in tuid,dev)
                 if dev["uid"] in tuid:  # uid with alias and target
-                    if dinfo.get("target")==dev.get("target","-") and cls.__name__==dev.get("classname","-"): #same target can have different device classes
+                    if dinfo.get("target")==dev.get("target","-") and clsname==dev.get("classname","-"): #same target can have different device classes
+                        cls = self.load_class(dinfo)
+                        if cls:
+                            obj = cls(dinfo,dev)
+                            ndb[obj.hash()]=obj
+                elif self.may_match(dkey,dev):
+                    # the class is imported only if vid and pid may belong to it
+                    cls = self.load_class(dinfo)
+                    if cls and cls.match(dev):
                         obj = cls(dinfo,dev)
                         ndb[obj.hash()]=obj
-                elif cls.match(dev):
-                    obj = cls(dinfo,dev)
-                    ndb[obj.hash()]=obj
+        self.save_new_ids()
         # augment no_sid/linked devices -_-
         ddevs={}
         for h,obj in ndb.items():
@@ -289,7 +424,7 @@ class Discover():
                 self.output_devices()
 
             if loop: 
-                sleep(looptime/1000)
+                self.wait_for_event(looptime/1000)
             else:
                 break
         
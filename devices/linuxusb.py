@@ -1,5 +1,6 @@
 import pyudev
 import re
+import select
 from base import *
         
 class LinuxUsb():
@@ -16,6 +17,9 @@ class LinuxUsb():
         self.devstrings.update({"ID_SERIAL_SHORT":"sid"})
                 
         self.udev = pyudev.Context()
+        # sys_path => parsed device, kept up to date by the udev monitor
+        self.table = None
+        self.monitor = None
 
 
     def find_all_serial_ports(self):
@@ -51,49 +55,130 @@ class LinuxUsb():
 
         return list(mnt)
 
-    def find_mount_point(self,block):
+    def read_mounts(self):
+        # block device => mount point, from the kernel table (spaces and other chars are octal escaped)
+        mounts = {}
+        try:
+            with open("/proc/self/mounts") as ff:
+                for line in ff:
+                    flds = line.split(" ")
+                    if len(flds)>=2 and flds[0].startswith("/") and flds[0] not in mounts:
+                        mounts[flds[0]] = re.sub("\\\\([0-7]{3})",lambda m: chr(int(m.group(1),8)),flds[1])
+        except Exception as e:
+            warning("Can't read mount points:",str(e))
+        return mounts
+
+    def find_mount_point(self,block,mounts=None):
         if not block:
             return
-        e,out,err = proc.run("mount -v")
-        if not e:
-            lines = out.split("\n")
-            for line in lines:
-                if line.startswith(block):
-                    flds = line.split(" ")
-                    if len(flds)>=4 and flds[0]==block and flds[1]=="on" and flds[3]=="type":
-                        return flds[2]
+        if mounts is None:
+            mounts = self.read_mounts()
+        return mounts.get(block)
 
-    def parse(self):
-        devices = []
+    def start_monitor(self):
+        # events are received from the moment the monitor is started: start it before enumerating
+        try:
+            monitor = pyudev.Monitor.from_netlink(self.udev)
+            for subsystem in ("block","tty","usb","hid"):
+                monitor.filter_by(subsystem)
+            monitor.start()
+            self.monitor = monitor
+        except Exception as e:
+            debug("Can't monitor udev events:",str(e))
+            self.monitor = None
+
+    def wait_event(self,timeout):
+        # wait until a device event is pending or timeout seconds are elapsed
+        if timeout<=0:
+            return False
+        if self.monitor is None:
+            sleep(timeout)
+            return False
+        try:
+            rlist, _, _ = select.select([self.monitor],[],[],timeout)
+        except Exception as e:
+            return False
+        return bool(rlist)
+
+    def parse_device(self,device):
+        if "SUBSYSTEM" in device and device["SUBSYSTEM"] in ("block","tty","usb"):
+            if self.devkeys.issubset(device):
+                return {
+                    "vid":device["ID_VENDOR_ID"].upper(),
+                    "pid":device["ID_MODEL_ID"].upper(),
+                    "sid": device["ID_SERIAL_SHORT"].upper() if "ID_SERIAL_SHORT" in device else "no_sid",
+                    "port": device["DEVNAME"] if device["SUBSYSTEM"] == "tty" else None,
+                    "block": device["DEVNAME"] if device["SUBSYSTEM"] == "block" else None,
+                    "disk": None,
+                    "desc": device["ID_SERIAL"]
+                }
+        elif "SUBSYSTEM" in device and device["SUBSYSTEM"] in ("hid"):
+            return {
+                "vid":device["HID_ID"].split(":")[0][-4:],
+                "pid":device["HID_ID"].split(":")[1][-4:],
+                "sid":device["HID_ID"],
+                "port": None,
+                "block": None,
+                "disk": None,
+                "desc":device["HID_NAME"]
+            }
+        return None
+
+    def update_device(self,device):
+        try:
+            dev = self.parse_device(device)
+        except Exception as e:
+            warning("Exception in usb discover: ",str(e))
+            dev = None
+        if dev:
+            self.table[device.sys_path]=dev
+        else:
+            self.table.pop(device.sys_path,None)
+
+    def enumerate(self):
+        self.table = {}
         try:
             for device in self.udev.list_devices():
-                try:
-                    if "SUBSYSTEM" in device and device["SUBSYSTEM"] in ("block","tty","usb"):
-                        if self.devkeys.issubset(device):
-                            dev={
-                                "vid":device["ID_VENDOR_ID"].upper(),
-                                "pid":device["ID_MODEL_ID"].upper(),
-                                "sid": device["ID_SERIAL_SHORT"].upper() if "ID_SERIAL_SHORT" in device else "no_sid",
-                                "port": device["DEVNAME"] if device["SUBSYSTEM"] == "tty" else None,
-                                "block": device["DEVNAME"] if device["SUBSYSTEM"] == "block" else None,
-                                "disk": self.find_mount_point(device["DEVNAME"]) if device["SUBSYSTEM"] == "block" else None,
-                                "desc": device["ID_SERIAL"]
-                            }
-                            devices.append(dev)
-                    elif "SUBSYSTEM" in device and device["SUBSYSTEM"] in ("hid"):
-                        dev = {
-                            "vid":device["HID_ID"].split(":")[0][-4:],
-                            "pid":device["HID_ID"].split(":")[1][-4:],
-                            "sid":device["HID_ID"],
-                            "port": None,
-                            "block": None,
-                            "disk": None,
-                            "desc":device["HID_NAME"]
-                        }
-                        devices.append(dev)
-                except Exception as e:
-                    warning("Exception in usb discover: ",str(e))
+                self.update_device(device)
         except Exception as e:
             warning("Exception in usb discover: ",str(e))
+
+    def apply_events(self):
+        # consume the pending events without blocking
+        nevents = 0
+        try:
+            while True:
+                device = self.monitor.poll(0)
+                if device is None:
+                    break
+                nevents+=1
+                if device.action=="remove":
+                    self.table.pop(device.sys_path,None)
+                else:
+                    self.update_device(device)
+        except Exception as e:
+            # events may have been lost: enumerate again
+            warning("Exception in usb discover: ",str(e))
+            self.enumerate()
+        return nevents
+
+    def parse(self):
+        # The device table is built once and then updated with udev events.
+        # Without a monitor all devices are enumerated on each call
+        if self.table is None or self.monitor is None:
+            if self.table is None:
+                self.start_monitor()
+            self.enumerate()
+        else:
+            self.apply_events()
+        mounts = None
+        devices = []
+        for dev in self.table.values():
+            dev = dict(dev)
+            if dev["block"]:
+                if mounts is None:
+                    # once per batch, mount points change without udev events
+                    mounts = self.read_mounts()
+                dev["disk"] = self.find_mount_point(dev["block"],mounts)
+            devices.append(dev)
         return devices
-                
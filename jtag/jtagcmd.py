@@ -227,7 +227,7 @@ def start(target,probe,bytecode):
     info("Loading VM debug info...")
     # search and open VM for dbg info
     vmpath = tools.get_vm_by_uid(vmuid)
-    vm = fs.get_json(vmpath)
+    vm = tools.load_vm(vmpath)
     if not "dbg" in vm["map"]:
         fatal("VM",vmuid,"has no debug info!")
     dbgbin=bytearray(base64.standard_b64decode(vm["map"]["dbg"]))
@@ -241,7 +241,7 @@ def start(target,probe,bytecode):
     # if needed add command for dynamic uplinked code
     if bytecode:
         # read dyn debug info
-        bf = fs.get_json(bytecode)
+        bf = load_vbo(bytecode)
         if bf["info"].get("ofiles"):
             for ofile in bf["info"]["ofiles"]:
                 if not fs.exists(ofile):
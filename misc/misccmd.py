@@ -99,7 +99,7 @@ It takes the following options (one at a time):
                 # skip versions lower than min_dep
                 continue
             # load vm
-            vm = fs.get_json(vmf)
+            vm = tools.load_vm(vmf)
             target = vm["dev_type"]
             if target not in vmdb:
                 vmdb[target]={}
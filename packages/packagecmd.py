@@ -294,7 +294,7 @@ Community packages can be installed and updated with the following command: ::
 
     ztc package install fullname version
 
-The package archive will be downloaded and installed from the corresponding Github release tarball.
+The package archive will be downloaded and installed from the corresponding Github release tarball. If the download is interrupted, running the command again for the same version resumes it, unless the server reports that the archive has changed.
     
     """
     flds = fullname.split(".")
@@ -304,7 +304,8 @@ The package archive will be downloaded and installed from the corresponding Gith
         fatal("No such package",fullname)
     # github url
     tarball = "https://github.com/"+user+"/"+reponame+"/archive/"+version+".tar.gz"
-    outfile = fs.path(env.tmp,"community-"+user+"-"+reponame+".tar.gz")
+    # versioned: a partial download of another version must not be resumed
+    outfile = fs.path(env.tmp,"community-"+user+"-"+reponame+"-"+version+".tar.gz")
     #namespace
     destdir = fs.path(env.libs,"community",user.replace("-","_"))
     #temporary unpacked dir
@@ -315,7 +316,7 @@ The package archive will be downloaded and installed from the corresponding Gith
     zfile = fs.path(edir,".zerynth")
     try:
         info("Downloading",tarball) 
-        if download_url(tarball,outfile):
+        if download_url(tarball,outfile,progress=download_progress("Downloaded")):
             #untar
             fs.rmtree(tdir)
             fs.rmtree(edir)
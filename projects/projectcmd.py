@@ -63,7 +63,8 @@ def project():
 @click.option("--define","-D",default=[],multiple=True,help="additional C macro definition (multi-value option)")
 @click.option("--imports","-m",flag_value=True,default=False,help="only generate the list of imported modules")
 @click.option("--config","-cfg",flag_value=True,default=False,help="only generate the configuration table")
-def compile(project,output,include,define,imports,proj,config):
+@click.option("--jobs","-j",default=0,type=int,help="number of parallel C compilations (default: number of cpus)")
+def compile(project,output,include,define,imports,proj,config,jobs):
     project = "." if not project else project
     cfg = fs.get_project_config(project,fail=True)
     target = cfg.get("target")
@@ -74,7 +75,7 @@ def compile(project,output,include,define,imports,proj,config):
         output = fs.path(project,"build","zerynth.vbo")
     tmpdir = fs.path(project,"build")
     fs.makedirs(tmpdir)
-    do_compile(project,target,output,include,define,imports,proj,config,tmpdir)
+    do_compile(project,target,output,include,define,imports,proj,config,tmpdir,jobs)
 
 @project.command(help="Retrieve and store current available packages for this project")
 @click.argument("project",type=click.Path(),required=False,default="")
@@ -147,14 +148,16 @@ def targets(project):
 @click.option("--stopbits","__stopbits", default=1,type=int,help="")
 @click.option("--dsrdtr","__dsrdtr", default=False,flag_value=True,help="")
 @click.option("--rtscts","__rtscts", default=False,flag_value=True,help="")
-def console(project,__echo,__baud,__parity,__bits,__stopbits,__dsrdtr,__rtscts):
+@click.option("--log","__log", default=None,type=click.Path(),help="append the device output to a file, with timestamps")
+@click.option("--stats","__stats", default=False,flag_value=True,help="print received and dropped bytes per second")
+def console(project,__echo,__baud,__parity,__bits,__stopbits,__dsrdtr,__rtscts,__log,__stats):
     project = "." if not project else project
     cfg = fs.get_project_config(project,fail=True)
     target = cfg["target"]
     port  = cfg.get("specs",{}).get("port")
     if not port:
         fatal("Please specify a device port in project configuration")
-    do_open_raw(port,__echo,__baud,__parity,__bits,__stopbits,__dsrdtr,__rtscts)
+    do_open_raw(port,__echo,__baud,__parity,__bits,__stopbits,__dsrdtr,__rtscts,__log,__stats)
 
 
 
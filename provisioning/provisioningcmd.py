@@ -159,7 +159,7 @@ def _serial_channel(alias):
     if not dev.port:
         fatal("Device has no serial port! Check that drivers are installed correctly...")
     conn = ConnectionInfo()
-    conn.set_serial(dev.port,**dev.connection)
+    conn.set_port(dev.port,**dev.connection)
     ch = Channel(conn)
     try:
         ch.open(timeout=2)
@@ -0,0 +1,59 @@
+# Size and load time of json and binary bytecode files.
+#
+# usage: python tests/bench_base_vbo.py [file.vbo] [rounds]
+#
+# without a file, a synthetic bytecode with 256Kb of code and a large repr is used
+#
+import sys
+import os
+import base64
+import tempfile
+import time
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from base import *
+
+def synthetic(path):
+    bf = {
+        "info":{"version":"r2.6.0"},
+        "header":str(base64.standard_b64encode(os.urandom(1024)),"utf-8"),
+        "pyobjs":str(base64.standard_b64encode(os.urandom(128*1024)),"utf-8"),
+        "cobjs":str(base64.standard_b64encode(os.urandom(128*1024)),"utf-8"),
+        "cnatives":["_native_%i"%i for i in range(100)],
+        "repr":[{"name":"code%i"%i,"items":[{"bpos":j,"opcode":"LOAD_FAST","val":j} for j in range(200)]} for i in range(500)]
+    }
+    fs.set_json(bf,path)
+
+def bench(path,rounds):
+    t0 = time.perf_counter()
+    for i in range(rounds):
+        bf = load_vbo(path)
+        for field in ("info","cnatives","header","pyobjs","cobjs"):
+            bf.get(field)
+    t1 = time.perf_counter()
+    for i in range(rounds):
+        vbo_to_json(load_vbo(path))
+    t2 = time.perf_counter()
+    return (t1-t0)/rounds,(t2-t1)/rounds
+
+def main():
+    rounds = int(sys.argv[2]) if len(sys.argv)>2 else 5
+    tmp = tempfile.TemporaryDirectory()
+    if len(sys.argv)>1:
+        src = sys.argv[1]
+    else:
+        src = os.path.join(tmp.name,"synthetic.vbo")
+        synthetic(src)
+    dst = os.path.join(tmp.name,"converted.vbo")
+    for compress in ["none","lzma","zstd"]:
+        try:
+            save_vbo(load_vbo(src),dst,compress)
+        except VboError as e:
+            print("%-5s  skipped: %s"%(compress,e))
+            continue
+        for name,path in [("json",src),("bin "+compress,dst)]:
+            reloc,full = bench(path,rounds)
+            print("%-10s  size: %9i   relocation load: %8.2f ms   full load: %8.2f ms"%(name,os.path.getsize(path),reloc*1000,full*1000))
+    tmp.cleanup()
+
+if __name__=="__main__":
+    main()
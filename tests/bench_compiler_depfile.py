@@ -0,0 +1,100 @@
+# Build of C natives: separate -M pass plus compilation against a compilation writing a depfile.
+#
+# usage: python tests/bench_compiler_depfile.py [gcc] [files] [rounds]
+#
+# a synthetic project of C files including local and system headers is generated;
+# any gcc works (the host one or a cross compiler). For each mode the full build
+# and the no-change rebuild (every object found in the native cache) are timed
+#
+import sys
+import os
+import tempfile
+import time
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from base import *
+from compiler.cc import gcc
+from compiler.codecache import CodeCache
+
+def synthetic(path,nfiles):
+    incdir = os.path.join(path,"inc")
+    os.makedirs(incdir)
+    for i in range(10):
+        fs.write_file("#include <stdint.h>\n#include <string.h>\nint header%i(int x);\n"%i,os.path.join(incdir,"h%i.h"%i))
+    cfiles = []
+    for i in range(nfiles):
+        src = "".join("#include \"h%i.h\"\n"%j for j in range(10))
+        src+= "#include <stdio.h>\n"
+        src+= "".join("int f%i_%i(int x) { char buf[32]; memset(buf,x,32); return header%i(buf[%i]+x); }\n"%(i,j,j%10,j%32) for j in range(50))
+        cfile = os.path.join(path,"native%i.c"%i)
+        fs.write_file(src,cfile)
+        cfiles.append(cfile)
+    return cfiles,incdir
+
+def main():
+    compiler = sys.argv[1] if len(sys.argv)>1 else "gcc"
+    nfiles = int(sys.argv[2]) if len(sys.argv)>2 else 50
+    rounds = int(sys.argv[3]) if len(sys.argv)>3 else 3
+    set_output_filter(False)
+    tmp = tempfile.TemporaryDirectory()
+    cfiles,incdir = synthetic(tmp.name,nfiles)
+    cc = gcc.__new__(gcc)
+    cc.gcc = compiler
+    cc.gccopts = ["-c","-O2"]
+    cc.incpaths = ["-I"+incdir]
+    cc.defines = []
+    spawns = [0]
+    run_command = cc.run_command
+    def counted(*args,**kwargs):
+        spawns[0]+=1
+        return run_command(*args,**kwargs)
+    cc.run_command = counted
+
+    def open_cache(mode):
+        cache = CodeCache(tmp.name,shared="",maxsize=1024)
+        cache.set_target(tmp.name,mode)
+        return cache
+
+    def separate(cache,cfile,ofile):
+        headers = cc.get_headers([cfile])[cfile]
+        cc.compile([cfile],o=ofile)
+        cache.add_object(cfile,ofile,headers)
+
+    def depfile(cache,cfile,ofile):
+        cc.compile([cfile],o=ofile,depfile=ofile[:-2]+".d")
+        cache.add_object(cfile,ofile,depfile=ofile[:-2]+".d")
+
+    def build(mode,fn):
+        # returns the number of cache misses
+        cache = open_cache(mode)
+        misses = 0
+        for cfile in cfiles:
+            if not cache.has_object(cfile):
+                misses+=1
+                fn(cache,cfile,cfile[:-2]+"."+mode+".o")
+        cache.flush()
+        return misses
+
+    print("compiler:",compiler,"  files:",nfiles,"  rounds:",rounds)
+    print("%-14s %12s %10s %10s %14s"%("","full build","ms/file","processes","no-change"))
+    for mode,fn in [("-M + compile",separate),("compile -MD",depfile)]:
+        full = 0
+        rebuild = 0
+        for i in range(rounds):
+            key = mode.replace(" ","")+str(i)
+            spawns[0] = 0
+            t0 = time.perf_counter()
+            build(key,fn)
+            full+=time.perf_counter()-t0
+            nproc = spawns[0]
+            t0 = time.perf_counter()
+            misses = build(key,fn)
+            rebuild+=time.perf_counter()-t0
+            if misses:
+                print("unexpected cache misses on rebuild:",misses)
+        full/=rounds
+        rebuild/=rounds
+        print("%-14s %9.1f ms %10.2f %10i %11.1f ms"%(mode,full*1000,full*1000/nfiles,nproc,rebuild*1000))
+    tmp.cleanup()
+
+if __name__=="__main__":
+    main()
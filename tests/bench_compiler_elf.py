@@ -0,0 +1,43 @@
+# Benchmark of the in process ELF reader against the objdump based parser.
+#
+# usage: python tests/bench_compiler_elf.py file.lo [objdump] [rounds]
+#
+import sys
+import os
+import time
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from base import *
+from compiler.cc import gcc
+
+def bench(fn,rounds):
+    t0 = time.perf_counter()
+    for i in range(rounds):
+        res = fn()
+    return (time.perf_counter()-t0)/rounds,res
+
+def main():
+    if len(sys.argv)<2:
+        print("usage:",sys.argv[0],"file.lo [objdump] [rounds]")
+        return
+    fname = sys.argv[1]
+    objdump = sys.argv[2] if len(sys.argv)>2 else "objdump"
+    rounds = int(sys.argv[3]) if len(sys.argv)>3 else 5
+    set_output_filter(False)
+    cc = gcc.__new__(gcc)
+    cc.objdump = objdump
+
+    print("file:",fname,"(",os.path.getsize(fname),"bytes )")
+    t1,st1 = bench(lambda: cc.symbol_table(fname),rounds)
+    t2,st2 = bench(lambda: cc.objdump_symbol_table(fname),rounds)
+    print("symbol table   elf: %8.2f ms   objdump: %8.2f ms   same: %s"%(t1*1000,t2*1000,st1.table==st2.table))
+    t1,s1 = bench(lambda: cc.retrieve_sections(fname),rounds)
+    t2,s2 = bench(lambda: cc.objdump_retrieve_sections(fname),rounds)
+    print("section sizes  elf: %8.2f ms   objdump: %8.2f ms   same: %s"%(t1*1000,t2*1000,s1==s2))
+    # an empty table skips the layout computation, only the section contents are extracted
+    t1,c1 = bench(lambda: cc.generate_zerynth_binary(st1.__class__(),fname),rounds)
+    t2,c2 = bench(lambda: cc.objdump_generate_zerynth_binary(st1.__class__(),fname),rounds)
+    same = all(bytes(c1.get_section(x))==bytes(c2.get_section(x)) for x in [".text",".rodata",".data"])
+    print("contents       elf: %8.2f ms   objdump: %8.2f ms   same: %s"%(t1*1000,t2*1000,same))
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,31 @@
+# Micro-benchmark of the uplink and DCZ checksums against the per byte implementations.
+#
+# usage: python tests/bench_uplinker_checksum.py [size_in_kb] [rounds]
+#
+import sys
+import os
+import time
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+sys.path.insert(0,os.path.dirname(os.path.realpath(__file__)))
+from base import *
+from uplinker.checksum import adler32, fletcher32
+from test_uplinker_checksum import adler32_ref, fletcher32_ref
+
+def bench(fn,buf,rounds):
+    t0 = time.perf_counter()
+    for i in range(rounds):
+        res = fn(buf)
+    return (time.perf_counter()-t0)/rounds,res
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv)>1 else 4096
+    rounds = int(sys.argv[2]) if len(sys.argv)>2 else 3
+    buf = os.urandom(size*1024)
+    print("buffer:",size,"Kb")
+    for name,fast,ref in [("adler32",adler32,adler32_ref),("fletcher32",fletcher32,fletcher32_ref)]:
+        t1,r1 = bench(fast,buf,rounds)
+        t2,r2 = bench(ref,buf,rounds)
+        print("%-10s  new: %9.2f ms   per byte: %9.2f ms   same: %s"%(name,t1*1000,t2*1000,r1==r2))
+
+if __name__=="__main__":
+    main()
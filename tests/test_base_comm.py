@@ -0,0 +1,135 @@
+import unittest
+from base import *
+from base.comm import ConnectionInfo, Channel, ChannelException, Console
+import io
+import os
+import socket
+import tempfile
+import threading
+import time
+
+
+class SocketTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.srv = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        self.srv.bind(("127.0.0.1",0))
+        self.srv.listen(1)
+        self.port = self.srv.getsockname()[1]
+        self.peer = None
+        self.accepted = threading.Event()
+
+        def accept():
+            self.peer,_ = self.srv.accept()
+            self.accepted.set()
+        threading.Thread(target=accept,daemon=True).start()
+
+    def tearDown(self):
+        if self.peer:
+            self.peer.close()
+        self.srv.close()
+
+    def open(self,timeout=0.5):
+        conn = ConnectionInfo()
+        conn.set_port("tcp://127.0.0.1:"+str(self.port),baudrate=115200)
+        self.assertTrue(conn.is_socket())
+        ch = Channel(conn)
+        ch.open(timeout=timeout)
+        self.accepted.wait(2)
+        return ch
+
+
+class TestSocketChannel(SocketTestCase):
+
+    def test_readline(self):
+        ch = self.open()
+        self.peer.sendall(b"r2.6.0 vmuid")
+        self.peer.sendall(b" target 0123 ZERYNTH\nOK\npartial")
+        self.assertEqual(ch.readline(),"r2.6.0 vmuid target 0123 ZERYNTH\n")
+        self.assertEqual(ch.readline(),"OK\n")
+        t0 = time.perf_counter()
+        # timeout: returns what has been received so far
+        self.assertEqual(ch.readline(),"partial")
+        self.assertGreaterEqual(time.perf_counter()-t0,0.4)
+        self.assertEqual(ch.readline(),"")
+        ch.close()
+
+    def test_read_write(self):
+        ch = self.open()
+        ch.write("U")
+        ch.write(b"\x01\x02")
+        self.assertEqual(self.peer.recv(3),b"U\x01\x02")
+        self.peer.sendall(b"\x00\x01\x02\x03")
+        self.assertEqual(ch.read(3),b"\x00\x01\x02")
+        self.assertEqual(ch.read(2),b"\x03")
+        ch.set_timeout(0)
+        self.assertEqual(ch.get_timeout(),0)
+        self.assertEqual(ch.read(1),b"")
+        ch.close()
+
+    def test_refused(self):
+        # a port nobody listens on
+        sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1",0))
+        port = sock.getsockname()[1]
+        sock.close()
+        conn = ConnectionInfo()
+        conn.set_port("socket://127.0.0.1:"+str(port))
+        with self.assertRaises(ChannelException):
+            Channel(conn).open(timeout=1)
+
+    def test_serial_port(self):
+        conn = ConnectionInfo()
+        conn.set_port("/dev/ttyUSB0",baudrate=9600)
+        self.assertTrue(conn.is_serial())
+        self.assertEqual(conn.baudrate,9600)
+
+
+class TestConsole(SocketTestCase):
+
+    def console(self,**kwargs):
+        ch = self.open()
+        console = Console(ch,**kwargs)
+        th = threading.Thread(target=console.run,daemon=True)
+        th.start()
+        return console,th
+
+    def test_output_and_log(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            logfile = os.path.join(tmp,"console.log")
+            set_output_filter(False)
+            try:
+                console,th = self.console(logfile=logfile)
+                self.peer.sendall(b"hello\nwor")
+                time.sleep(0.3)
+                self.peer.sendall(b"ld\n")
+                time.sleep(0.3)
+                console.stopped.set()
+                th.join(2)
+            finally:
+                set_output_filter(True)
+            self.assertEqual(console.received,12)
+            self.assertEqual(console.dropped,0)
+            with open(logfile) as ff:
+                lines = ff.read().split("\n")
+            self.assertRegex(lines[0],r"^\[[0-9: .-]+\] hello$")
+            self.assertRegex(lines[1],r"^\[[0-9: .-]+\] world$")
+
+    def test_dropped(self):
+        ch = self.open()
+        console = Console(ch,bufsize=100,period=10)
+        ch.set_timeout(0.1)
+        th = threading.Thread(target=console._reader,daemon=True)
+        th.start()
+        self.peer.sendall(b"x"*250+b"0123456789")
+        time.sleep(0.3)
+        console.stopped.set()
+        th.join(2)
+        self.assertEqual(console.received,260)
+        self.assertEqual(console.dropped,160)
+        self.assertEqual(b"".join(console.buf),b"x"*90+b"0123456789")
+        ch.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
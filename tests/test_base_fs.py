@@ -74,7 +74,30 @@ class TestBaseFs(unittest.TestCase):
         rdata = fs.readfile(self.dstfile,"b")
         self.assertEqual(wdata,rdata)
 
-
+    def test_fs_atomic_write(self):
+        dst = os.path.join(self.tmpdir,"sub","zatomic")
+        fs.atomic_write("teststring",dst)
+        self.assertEqual(fs.readfile(dst),"teststring")
+        fs.atomic_write(lambda ff: ff.write(b'\x00\x01'),dst)
+        self.assertEqual(fs.readfile(dst,"b"),b'\x00\x01')
+
+        # a failed write leaves the previous content and no temporary file
+        def fail(ff):
+            ff.write(b'partial')
+            raise ValueError()
+        with self.assertRaises(ValueError):
+            fs.atomic_write(fail,dst)
+        self.assertEqual(fs.readfile(dst,"b"),b'\x00\x01')
+        self.assertEqual(os.listdir(os.path.dirname(dst)),["zatomic"])
+
+    def test_fs_trim_dir(self):
+        for i in range(4):
+            fs.write_file(b'x'*100,os.path.join(self.tmpdir,str(i)))
+            os.utime(os.path.join(self.tmpdir,str(i)),(i,i))
+        removed = fs.trim_dir(self.tmpdir,250)
+        self.assertEqual([os.path.basename(x) for x in removed],["0","1"])
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),["2","3"])
+        self.assertEqual(fs.trim_dir(self.tmpdir,250),[])
 
     def tearDown(self):
         shutil.rmtree(self.tmpdir)
@@ -0,0 +1,69 @@
+import unittest
+from unittest import mock
+from base import *
+import base64
+import os
+import tempfile
+
+
+class TestVbo(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.bf = {
+            "info":{"version":"r2.6.0","npyobjs":2,"pyobjtable_end":8},
+            "header":str(base64.standard_b64encode(bytes(range(64))),"utf-8"),
+            "pyobjs":str(base64.standard_b64encode(b"pyobjs"*100),"utf-8"),
+            "cobjs":None,
+            "cnatives":["_native_a"],
+            "modules":{"main.py":0},
+            "stats":{},
+            "lmap":{},
+            "repr":[{"name":"main","code":[[1,2,3]]*200}],
+            "project":"myproject"
+        }
+        self.json = os.path.join(self.tmp.name,"main.vbo")
+        self.bin = os.path.join(self.tmp.name,"main.bin.vbo")
+        fs.set_json(self.bf,self.json)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_roundtrip(self):
+        save_vbo(load_vbo(self.json),self.bin)
+        self.assertTrue(is_binary_vbo(self.bin))
+        self.assertFalse(is_binary_vbo(self.json))
+        bf = load_vbo(self.bin)
+        self.assertEqual(bf["header"],bytes(range(64)))
+        self.assertIsNone(bf["cobjs"])
+        self.assertEqual(vbo_to_json(bf),self.bf)
+        self.assertLess(os.path.getsize(self.bin),os.path.getsize(self.json))
+
+    def test_lazy_sections(self):
+        save_vbo(self.bf,self.bin,"none")
+        bf = VboFile(self.bin)
+        with mock.patch.object(bf,"read",wraps=bf.read) as read:
+            loaded = bf.load()
+            self.assertEqual(loaded["info"]["npyobjs"],2)
+            self.assertEqual(loaded["pyobjs"],b"pyobjs"*100)
+            self.assertIn("repr",loaded)
+            self.assertEqual(sorted(c[0][0] for c in read.call_args_list),["info","pyobjs"])
+
+    def test_truncated_section(self):
+        save_vbo(self.bf,self.bin,"none")
+        bf = VboFile(self.bin)
+        with open(self.bin,"r+b") as ff:
+            ff.truncate(bf.sections["repr"][2]+10)
+        self.assertEqual(bf.read("header"),bytes(range(64)))
+        with self.assertRaises(VboError):
+            bf.read("repr")
+
+    def test_bad_file(self):
+        with open(self.bin,"wb") as ff:
+            ff.write(b"ZVBO\x01\x00\x05\x00")
+        with self.assertRaises(VboError):
+            load_vbo(self.bin)
+
+
+if __name__ == '__main__':
+    unittest.main()
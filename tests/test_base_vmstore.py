@@ -0,0 +1,135 @@
+import unittest
+from unittest import mock
+from base import *
+import json
+import os
+import tempfile
+
+
+class TestVmStore(unittest.TestCase):
+
+    def setUp(self):
+        set_output_filter(False)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.vms = fs.path(self.tmp.name,"vms")
+        self.store = VmStore(fs.path(self.tmp.name,"vms.db"),self.vms)
+
+    def tearDown(self):
+        set_output_filter(True)
+        self.store.db.close()
+        self.tmp.cleanup()
+
+    def add_vm(self,uid,target,chipid,version="r2.6.0",bin="AAEC",dbg=None):
+        vmpath = fs.path(self.vms,target,chipid)
+        fs.makedirs(vmpath)
+        vm = {"uid":uid,"version":version,"rtos":"rtos","dev_type":target,"on_chip_id":chipid,"bin":bin,"map":{"bc":["0x100"]}}
+        if dbg:
+            vm["map"]["dbg"]=dbg
+        vmf = fs.path(vmpath,uid+"_"+version+"_hash_rtos.vm")
+        fs.set_json(vm,vmf)
+        return fs.apath(vmf)
+
+    def reopen(self):
+        # a new process: the index is checked against the vm directories once, when opened
+        self.store.db.close()
+        self.store = VmStore(fs.path(self.tmp.name,"vms.db"),self.vms)
+
+    def test_lookup(self):
+        f1 = self.add_vm("abc1","board","chip1")
+        f2 = self.add_vm("abc2","board","chip2",version="r2.7.0")
+        f3 = self.add_vm("xyz","other","chip3")
+        self.assertEqual(self.store.get_path("abc1"),f1)
+        self.assertEqual(sorted(self.store.get_paths_by_prefix("abc")),sorted([f1,f2]))
+        self.assertEqual(self.store.get_path_by_version("abc2","r2.7.0","chip2","board"),f2)
+        self.assertIsNone(self.store.get_path_by_version("abc2","r2.6.0","chip2","board"))
+        self.assertEqual(sorted(row[0] for row in self.store.get_vms("board")),["abc1","abc2"])
+        self.assertEqual([row[0] for row in self.store.get_vms("board","chip2")],["abc2"])
+        # files added or removed behind the index are seen by the next process
+        f4 = self.add_vm("new","other","chip4")
+        fs.rm_file(f3)
+        self.assertIsNone(self.store.get_path("new"))
+        self.reopen()
+        self.assertEqual(self.store.get_path("new"),f4)
+        self.assertIsNone(self.store.get_path("xyz"))
+        self.assertEqual([row[0] for row in self.store.get_vms("other")],["new"])
+        # or right away when added explicitly
+        f5 = self.add_vm("newer","other","chip4")
+        self.store.add(f5)
+        self.assertEqual(self.store.get_path("newer"),f5)
+
+    def test_lazy_binaries(self):
+        f1 = self.add_vm("abc1","board","chip1",bin=["AAEC","AwQF"],dbg="ZGJn")
+        self.store.add(f1)
+        with mock.patch.object(fs,"get_json",side_effect=AssertionError("vm file parsed")):
+            vm = self.store.load(f1)
+        self.assertEqual(vm["version"],"r2.6.0")
+        self.assertNotIn("bin",dict(vm))
+        self.assertIn("bin",vm)
+        self.assertIn("dbg",vm["map"])
+        self.assertEqual(vm["bin"],["AAEC","AwQF"])
+        self.assertEqual(vm["map"]["dbg"],"ZGJn")
+        self.assertEqual(vm.load(),fs.get_json(f1))
+        # binaries are read from the vm file, not copied
+        self.assertEqual(sorted(os.listdir(self.tmp.name)),["vms","vms.db"])
+
+    def test_non_ascii(self):
+        vmf = fs.path(self.vms,"board","chip1","abc1_r2.6.0_hash_rtos.vm")
+        fs.makedirs(fs.dirname(vmf))
+        vm = {"desc":"scheda città","bin":"AAEC","map":{"name":"ü","dbg":["ZGJn"]}}
+        fs.write_file(json.dumps(vm,ensure_ascii=False,indent=4),vmf)
+        vm2 = self.store.load(vmf)
+        self.assertEqual(vm2["bin"],"AAEC")
+        self.assertEqual(vm2["map"]["dbg"],["ZGJn"])
+        self.assertEqual(vm2["desc"],"scheda città")
+
+    def test_modified_file(self):
+        f1 = self.add_vm("abc1","board","chip1",bin="AAEC")
+        vm = self.store.load(f1)
+        self.add_vm("abc1","board","chip1",bin="AwQFBgcI")
+        os.utime(f1,(1,1))
+        self.assertEqual(vm["bin"],"AwQFBgcI")
+        self.assertEqual(self.store.load(f1)["bin"],"AwQFBgcI")
+
+    def test_same_uid(self):
+        f1 = self.add_vm("abc1","board","chip1",bin="AAEC")
+        f2 = self.add_vm("abc1","board","chip1",version="r2.7.0",bin="AwQF")
+        self.store.sync()
+        self.assertEqual(self.store.load(f1)["bin"],"AAEC")
+        self.assertEqual(self.store.load(f2)["bin"],"AwQF")
+        fs.rm_file(f1)
+        self.store.sync()
+        self.assertEqual(self.store.load(f2)["bin"],"AwQF")
+
+    def test_bad_vms(self):
+        f1 = self.add_vm("abc1","board","chip1",bin=None)
+        f2 = self.add_vm("abc2","board","chip1",bin=12)
+        f3 = fs.path(self.vms,"board","chip1","abc3_r2.6.0_hash_rtos.vm")
+        fs.write_file("{not json",f3)
+        f4 = self.add_vm("abc4","board","chip1")
+        # a bad file does not stop the others from being indexed
+        self.assertEqual(self.store.get_path("abc4"),f4)
+        self.assertEqual(sorted(row[0] for row in self.store.get_vms("board")),["abc1","abc2","abc4"])
+        self.assertIsNone(self.store.load(f1)["bin"])
+        self.assertEqual(self.store.load(f2)["bin"],12)
+
+    def test_no_walk(self):
+        for i in range(4):
+            self.add_vm("abc%i"%i,"board","chip%i"%i)
+        self.store.open()
+        # lookups use the index only
+        with mock.patch.object(fs,"glob",side_effect=AssertionError("walk")), \
+             mock.patch.object(fs,"dirs",side_effect=AssertionError("walk")), \
+             mock.patch.object(fs,"stat",side_effect=AssertionError("stat")):
+            self.assertEqual(len(self.store.get_vms("board")),4)
+            self.assertEqual(len(self.store.get_paths_by_prefix("abc")),4)
+            self.assertIsNone(self.store.get_path("missing"))
+        # when opened, only the changed directory is read again
+        self.add_vm("abc4","board","chip2")
+        self.reopen()
+        with mock.patch.object(fs,"glob",wraps=fs.glob) as glob:
+            self.assertEqual(len(self.store.get_vms("board")),5)
+        self.assertEqual([c[0][0] for c in glob.call_args_list],[fs.path(self.vms,"board","chip2")])
+
+
+if __name__ == '__main__':
+    unittest.main()
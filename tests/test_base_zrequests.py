@@ -0,0 +1,246 @@
+import unittest
+from unittest import mock
+from base import *
+import base.zrequests as zrequests
+import hashlib
+import http.server
+import json
+import os
+import socket
+import tempfile
+import threading
+
+
+class FlakyHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.hits.append(self.client_address[1])
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        if status=="drop":
+            # close the connection without answering
+            self.close_connection = True
+            return
+        body = b"ok" if status==200 else b"error"
+        self.send_response(status)
+        self.send_header("Content-Length",str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length",0)))
+        self.do_GET()
+
+    do_PUT = do_POST
+
+    def log_message(self,*args):
+        pass
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        data = self.server.payload
+        start = 0
+        rng = self.headers.get("Range")
+        self.server.ranges.append(rng)
+        if self.server.error:
+            body = json.dumps({"status":"error","message":self.server.error}).encode()
+            self.send_response(404)
+            self.send_header("Content-Length",str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if rng and self.server.ranges_ok and self.headers.get("If-Range")==self.server.etag:
+            start = int(rng[6:-1])
+            self.send_response(206)
+            self.send_header("Content-Range","bytes %i-%i/%i"%(start,len(data)-1,len(data)))
+        else:
+            self.send_response(200)
+        if self.server.etag:
+            self.send_header("ETag",self.server.etag)
+        self.send_header("Content-Length",str(len(data)-start))
+        self.end_headers()
+        if self.server.cut:
+            # drop the connection in the middle of the transfer
+            self.wfile.write(data[start:start+self.server.cut])
+            self.server.cut = 0
+            self.close_connection = True
+            return
+        self.wfile.write(data[start:])
+
+    def log_message(self,*args):
+        pass
+
+
+class TestZrequest(unittest.TestCase):
+
+    def setUp(self):
+        set_output_filter(False)
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1",0),FlakyHandler)
+        self.server.hits = []
+        self.server.statuses = []
+        self.th = threading.Thread(target=self.server.serve_forever,daemon=True)
+        self.th.start()
+        self.url = "http://127.0.0.1:%i/"%self.server.server_address[1]
+        mock.patch.object(env,"proxies",None,create=True).start()
+        mock.patch.object(zrequests,"sleep",lambda n: None).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+        set_output_filter(True)
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_keep_alive(self):
+        for i in range(3):
+            res = zrequest("GET",self.url)
+            self.assertEqual(res.text,"ok")
+        # all the requests on the same connection
+        self.assertEqual(len(set(self.server.hits)),1)
+
+    def test_retry_server_errors(self):
+        self.server.statuses = [503,502]
+        res = zrequest("GET",self.url)
+        self.assertEqual(res.status_code,200)
+        self.assertEqual(len(self.server.hits),3)
+        self.server.statuses = [500,500,500]
+        res = zrequest("GET",self.url)
+        self.assertEqual(res.status_code,500)
+
+    def test_retry_connection_errors(self):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1",0))
+        url = "http://127.0.0.1:%i/"%sock.getsockname()[1]
+        sock.close()
+        with mock.patch.object(zrequests,"sleep") as sleep:
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                zrequest("GET",url,retries=3,backoff=1)
+        self.assertEqual([c[0][0] for c in sleep.call_args_list],[1,2])
+        # never reached the server: safe to send again for any method
+        with mock.patch.object(zrequests,"sleep") as sleep:
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                zrequest("POST",url,data="{}",retries=3)
+        self.assertEqual(sleep.call_count,2)
+
+    def test_post_not_repeated(self):
+        # the server may have executed the request
+        self.server.statuses = [503]
+        res = zrequest("POST",self.url,data="{}")
+        self.assertEqual(res.status_code,503)
+        self.assertEqual(len(self.server.hits),1)
+        self.server.statuses = ["drop"]
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            zrequest("PUT",self.url,data="{}")
+        self.assertEqual(len(self.server.hits),2)
+        # the same failure is retried for GET
+        self.server.statuses = ["drop"]
+        self.assertEqual(zrequest("GET",self.url).status_code,200)
+        self.assertEqual(len(self.server.hits),4)
+
+
+class TestDownload(unittest.TestCase):
+
+    def setUp(self):
+        set_output_filter(False)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1",0),RangeHandler)
+        self.server.payload = os.urandom(300000)
+        self.server.ranges = []
+        self.server.ranges_ok = True
+        self.server.cut = 0
+        self.server.etag = '"v1"'
+        self.server.error = None
+        self.th = threading.Thread(target=self.server.serve_forever,daemon=True)
+        self.th.start()
+        self.url = "http://127.0.0.1:%i/file.tar.gz"%self.server.server_address[1]
+        self.dst = os.path.join(self.tmp.name,"file.tar.gz")
+        mock.patch.object(env,"proxies",None,create=True).start()
+        mock.patch.object(zrequests,"sleep",lambda n: None).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+        set_output_filter(True)
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def read(self):
+        with open(self.dst,"rb") as ff:
+            return ff.read()
+
+    def partial(self,size,validator):
+        # a partial file left by a previous run
+        with open(self.dst+".part","wb") as ff:
+            ff.write(self.server.payload[:size])
+        if validator:
+            fs.set_json({"url":self.url,"validator":validator},self.dst+".part.validator")
+
+    def test_download(self):
+        steps = []
+        digest = hashlib.sha256(self.server.payload).hexdigest()
+        download_url(self.url,self.dst,digest=digest,progress=lambda done,total: steps.append((done,total)))
+        self.assertEqual(self.read(),self.server.payload)
+        self.assertEqual(steps[-1],(300000,300000))
+        self.assertFalse(os.path.exists(self.dst+".part"))
+        self.assertFalse(os.path.exists(self.dst+".part.validator"))
+
+    def test_resume(self):
+        self.server.cut = 100000
+        download_url(self.url,self.dst,size=300000)
+        self.assertEqual(self.read(),self.server.payload)
+        # resumed from what was received before the connection dropped
+        self.assertEqual(len(self.server.ranges),2)
+        self.assertIsNone(self.server.ranges[0])
+        self.assertTrue(0<int(self.server.ranges[1][6:-1])<=100000)
+        self.partial(5000,'"v1"')
+        download_url(self.url,self.dst)
+        self.assertEqual(self.read(),self.server.payload)
+        self.assertEqual(self.server.ranges[-1],"bytes=5000-")
+
+    def test_changed_resource(self):
+        # the partial file belongs to a previous version: If-Range makes the server send it all
+        self.partial(5000,'"v0"')
+        self.server.payload = os.urandom(300000)
+        download_url(self.url,self.dst)
+        self.assertEqual(self.read(),self.server.payload)
+
+    def test_no_validator(self):
+        self.server.etag = None
+        self.partial(5000,None)
+        download_url(self.url,self.dst)
+        self.assertEqual(self.read(),self.server.payload)
+        # discarded without asking for a range
+        self.assertEqual(self.server.ranges,[None])
+        # nor resumed when interrupted
+        self.server.cut = 100000
+        download_url(self.url,self.dst)
+        self.assertEqual(self.read(),self.server.payload)
+        self.assertEqual(self.server.ranges[1:],[None,None])
+
+    def test_no_range_support(self):
+        self.server.ranges_ok = False
+        with open(self.dst+".part","wb") as ff:
+            ff.write(b"garbage")
+        download_url(self.url,self.dst)
+        self.assertEqual(self.read(),self.server.payload)
+
+    def test_error_message(self):
+        self.server.error = "No such vm"
+        with self.assertRaises(DownloadError) as ctx:
+            download_url(self.url,self.dst)
+        self.assertEqual(ctx.exception.status,404)
+        self.assertEqual(ctx.exception.message,"No such vm")
+
+    def test_integrity(self):
+        with self.assertRaises(DownloadError):
+            download_url(self.url,self.dst,digest="00"*32)
+        with self.assertRaises(DownloadError):
+            download_url(self.url,self.dst,size=1000)
+        self.assertFalse(os.path.exists(self.dst))
+        self.assertFalse(os.path.exists(self.dst+".part"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+from base import *
+from compiler.astprep import AstPreprocessor
+import ast
+
+
+class TestStaleTrees(unittest.TestCase):
+
+    def setUp(self):
+        set_output_filter(False)
+        self.defines = {"CDEFS":[],"BOARD":"test"}
+        self.astp = AstPreprocessor({"LED0":1,"PWM0":5},{"LED0":{"PWM":"PWM0"}},self.defines,set())
+
+    def tearDown(self):
+        set_output_filter(True)
+
+    def prepare(self,src):
+        self.astp.lookups = {}
+        tree = self.astp.visit(ast.parse(src))
+        return tree,self.astp.lookups
+
+    def test_unrelated_define(self):
+        tree,lookups = self.prepare("x = LED0\ny = x+1\n")
+        self.prepare("x = 0\n__define(OTHER,3)\n__define(LED0,1)\n")
+        self.assertFalse(self.astp.is_stale(lookups))
+
+    def test_late_define(self):
+        tree,lookups = self.prepare("def f():\n    return SPEED\n")
+        self.prepare("x = 0\n__define(SPEED,3)\n")
+        self.assertTrue(self.astp.is_stale(lookups))
+        tree,lookups = self.prepare("def f():\n    return SPEED\n")
+        self.assertIsInstance(tree.body[0].body[0].value,ast.Num)
+        self.assertFalse(self.astp.is_stale(lookups))
+
+    def test_own_define(self):
+        tree,lookups = self.prepare("x = 0\n__define(SPEED,3)\nx = SPEED\n")
+        self.assertFalse(self.astp.is_stale(lookups))
+        tree,lookups = self.prepare("x = SPEED\n__define(SPEED,4)\n")
+        self.assertTrue(self.astp.is_stale(lookups))
+
+    def test_pin_attribute(self):
+        tree,lookups = self.prepare("x = LED0.PWM\n")
+        self.prepare("x = 0\n__define(PWM0,7)\n")
+        self.assertTrue(self.astp.is_stale(lookups))
+
+    def test_late_cdefine(self):
+        src = "x = 0\nif __defined(CDEFS,\"FAST\"):\n    x = 1\n"
+        tree,lookups = self.prepare(src)
+        self.assertEqual(len(tree.body),1)
+        self.prepare("x = 0\n__cdefine(FAST)\n")
+        self.assertTrue(self.astp.is_stale(lookups))
+        tree,lookups = self.prepare(src)
+        self.assertEqual(len(tree.body),2)
+        # the same __cdefine again does not change anything
+        self.prepare("x = 0\n__cdefine(FAST)\n")
+        self.assertFalse(self.astp.is_stale(lookups))
+
+
+if __name__ == '__main__':
+    unittest.main()
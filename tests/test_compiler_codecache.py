@@ -0,0 +1,71 @@
+import unittest
+from unittest import mock
+from base import *
+from compiler.codecache import CodeCache
+import os
+import tempfile
+
+
+class FakeGcc():
+    def __init__(self,gcc,project):
+        self.gcc = gcc
+        self.archopts = ["-mthumb"]
+        self.gccopts = ["-O2"]
+        self.defines = ["ZERYNTH"]
+        self.incpaths = [project,os.path.join(project,"csrc")]
+
+
+class TestSharedCodeCache(unittest.TestCase):
+
+    def setUp(self):
+        set_output_filter(False)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.shared = os.path.join(self.tmp.name,"shared")
+        mock.patch.object(env,"home",os.path.join(self.tmp.name,"home"),create=True).start()
+        self.gcc = os.path.join(self.tmp.name,"gcc")
+        fs.write_file("gcc",self.gcc)
+
+    def tearDown(self):
+        mock.patch.stopall()
+        set_output_filter(True)
+        self.tmp.cleanup()
+
+    def checkout(self,name):
+        # a project with a C file including a project header
+        project = os.path.join(self.tmp.name,name)
+        fs.makedirs(os.path.join(project,"csrc"))
+        fs.write_file("int x = X;",os.path.join(project,"csrc","native.c"))
+        fs.write_file("#define X 1",os.path.join(project,"csrc","native.h"))
+        fs.write_file(b"object",os.path.join(project,"native.o"))
+        return self.cache(project),project
+
+    def cache(self,project):
+        cache = CodeCache(self.tmp.name,shared=self.shared,maxsize=1)
+        cache.set_target(project,"board",cc=FakeGcc(self.gcc,project))
+        return cache
+
+    def add(self,cache,project):
+        cache.add_object(os.path.join(project,"csrc","native.c"),os.path.join(project,"native.o"),[os.path.join(project,"csrc","native.h")])
+
+    def test_checkouts_share_objects(self):
+        c1,p1 = self.checkout("checkout1")
+        self.add(c1,p1)
+        c2,p2 = self.checkout("checkout2")
+        ofile = c2.has_object(os.path.join(p2,"csrc","native.c"))
+        self.assertTrue(ofile)
+        self.assertEqual(fs.readfile(ofile,"b"),b"object")
+        # a different header content is a miss
+        fs.write_file("#define X 2",os.path.join(p2,"csrc","native.h"))
+        self.assertFalse(self.cache(p2).has_object(os.path.join(p2,"csrc","native.c")))
+
+    def test_evict_manifests(self):
+        c1,p1 = self.checkout("checkout1")
+        self.add(c1,p1)
+        c1.maxsize = 0
+        c1.evict()
+        for kind in ["objects","manifests"]:
+            self.assertEqual([ff for root,dirs,files in os.walk(os.path.join(self.shared,kind)) for ff in files],[])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+import unittest
+from unittest import mock
+from base import *
+import json
+import os
+import tempfile
+import compiler.compilercmd as compilercmd
+from compiler.compiler import Compiler
+from compiler.env import Env
+
+
+class FakeRepr():
+    def __init__(self,name):
+        self.name = name
+
+    def toDict(self):
+        return {"name":self.name,"lines":[0,2]}
+
+
+class TestReprModes(unittest.TestCase):
+
+    def setUp(self):
+        set_output_filter(False)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.tmp.name,"main.vbo")
+        self.reprs = [FakeRepr("main"),FakeRepr("f")]
+        fake = mock.patch.object(compilercmd,"Compiler").start()
+        self.compiler = fake.return_value
+        self.compiler.compile.side_effect = lambda: ({"info":{"version":"r2.6.0"}},iter(self.reprs))
+        self.compiler.has_options = False
+
+    def tearDown(self):
+        mock.patch.stopall()
+        set_output_filter(True)
+        self.tmp.cleanup()
+
+    def compile(self,repr_mode,fmt="json"):
+        output = compilercmd.do_compile(self.tmp.name,"esp32_devkitc",self.output,[],[],False,[],False,"",fmt=fmt,repr_mode=repr_mode)
+        self.assertEqual(output,self.output)
+        return load_vbo(output)
+
+    def test_full(self):
+        bf = self.compile("full")
+        self.assertEqual(bf["repr"],[rep.toDict() for rep in self.reprs])
+        self.assertNotIn("repr_file",bf)
+        self.assertEqual(bf["project"],self.tmp.name)
+
+    def test_none(self):
+        bf = self.compile("none")
+        self.assertEqual(bf["repr"],[])
+        self.assertNotIn("repr_file",bf)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name,"main.repr.json")))
+
+    def test_lazy(self):
+        for fmt in ["json","bin"]:
+            bf = self.compile("lazy",fmt)
+            self.assertEqual(bf["repr"],[])
+            self.assertEqual(bf["repr_file"],"main.repr.json")
+            reprs = fs.get_json(os.path.join(self.tmp.name,bf["repr_file"]))
+            self.assertEqual(reprs,[rep.toDict() for rep in self.reprs])
+
+    def test_compiler_reprs(self):
+        comp = Compiler.__new__(Compiler)
+        comp.codeobjs = ["co1","co2"]
+        with mock.patch.object(comp,"makeRepr",side_effect=lambda co: "repr of "+co) as make:
+            comp.reprs = "none"
+            self.assertEqual(comp.makeReprs(),[])
+            comp.reprs = "lazy"
+            reprs = comp.makeReprs()
+            # nothing is built until consumed
+            self.assertEqual(make.call_count,0)
+            self.assertEqual(list(reprs),["repr of co1","repr of co2"])
+            comp.reprs = "full"
+            self.assertEqual(comp.makeReprs(),["repr of co1","repr of co2"])
+
+
+class TestCompileServer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.server = compilercmd.CompileServer()
+        self.server.discover = mock.Mock()
+        self.zcompile = mock.patch.object(compilercmd,"_zcompile").start()
+        for name in ["tmp","stdlib","libs","devices"]:
+            mock.patch.object(env,name,self.tmp.name,create=True).start()
+        mock.patch.object(env,"tmp_cache_size",1,create=True).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+        self.tmp.cleanup()
+
+    def call(self,method,params=None,rid=1):
+        return self.server.handle(json.dumps({"jsonrpc":"2.0","id":rid,"method":method,"params":params}))
+
+    def test_ping(self):
+        self.assertEqual(self.call("ping",rid=7),{"jsonrpc":"2.0","id":7,"result":"pong"})
+
+    def test_unknown_method(self):
+        res = self.call("link")
+        self.assertEqual(res["id"],1)
+        self.assertEqual(res["error"]["code"],-32601)
+
+    def test_malformed(self):
+        res = self.server.handle('{"jsonrpc":"2.0","id":1,"method":')
+        self.assertIsNone(res["id"])
+        self.assertEqual(res["error"]["code"],-32700)
+
+    def test_shutdown(self):
+        self.assertTrue(self.server.running)
+        res = self.call("shutdown")
+        self.assertIsNone(res["result"])
+        self.assertFalse(self.server.running)
+
+    def test_compile(self):
+        output = os.path.join(self.tmp.name,"main.vbo")
+        def zcompile(project,target,*args,**kwargs):
+            info("Compilation Ok")
+            fs.set_json({"info":{"version":"r2.6.0"},"repr":[]},output)
+            return output
+        self.zcompile.side_effect = zcompile
+        self.assertEqual(self.call("compile",{"project":"p"})["error"]["code"],-32602)
+        res = self.call("compile",{"project":"p","target":"esp32_devkitc","inline":True})["result"]
+        self.assertEqual(res["output"],output)
+        self.assertIn("Compilation Ok",res["log"])
+        self.assertEqual(res["vbo"]["info"]["version"],"r2.6.0")
+
+    def test_compile_error(self):
+        def zcompile(project,target,*args,**kwargs):
+            info("Compiling")
+            fatal("Syntax error","[invalid syntax]")
+        self.zcompile.side_effect = zcompile
+        res = self.call("compile",{"project":"p","target":"esp32_devkitc"})
+        self.assertEqual(res["error"]["code"],1)
+        # the log goes in the error data, not on the protocol stream
+        self.assertIn("Compiling",res["error"]["data"]["log"])
+        self.assertIn("invalid syntax",res["error"]["data"]["log"])
+        # the server keeps serving
+        self.assertEqual(self.call("ping")["result"],"pong")
+
+    def test_state_isolation(self):
+        states = []
+        def zcompile(project,target,*args,discover=None,astcache=None,**kwargs):
+            Compiler(fs.path(project,"main.py"),"no_device",discover=discover,astcache=astcache)
+            states.append((dict(Env.namestore),Env.curnamecode,discover,astcache))
+            # names allocated by this compilation
+            Env.namestore["foo"] = Env.curnamecode
+            Env.curnamecode+=1
+            return fs.path(project,"main.vbo")
+        self.zcompile.side_effect = zcompile
+        for i in range(2):
+            self.call("compile",{"project":self.tmp.name,"target":"esp32_devkitc"})
+        self.assertEqual(states[0][:2],({},256))
+        self.assertEqual(states[1][:2],({},256))
+        # device classes and module caches are kept warm
+        self.assertIs(states[0][2],states[1][2])
+        self.assertIs(states[0][3],states[1][3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+from base import *
+from compiler.cc import gcc, symtable
+import os
+import shutil
+import subprocess
+import tempfile
+
+CSRC = """
+int x=3;
+static int y[4]={1,2,3,4};
+static int w;
+int c;
+extern int ext(int);
+int f(int a){ w++; return ext(a)+x+y[a]+c+w; }
+"""
+
+@unittest.skipUnless(shutil.which("gcc") and shutil.which("objdump"),"gcc and objdump are needed")
+class TestCompilerElf(unittest.TestCase):
+
+    def setUp(self):
+        set_output_filter(False)
+        self.tmpdir = tempfile.mkdtemp()
+        self.cfile = os.path.join(self.tmpdir,"t.c")
+        self.ofile = os.path.join(self.tmpdir,"t.o")
+        with open(self.cfile,"w") as ff:
+            ff.write(CSRC)
+        subprocess.check_call(["gcc","-c","-fcommon",self.cfile,"-o",self.ofile])
+        # skip the constructor: it probes the toolchain search dirs
+        self.cc = gcc.__new__(gcc)
+        self.cc.objdump = "objdump"
+
+    def tearDown(self):
+        set_output_filter(True)
+        shutil.rmtree(self.tmpdir)
+
+    def test_symbol_table(self):
+        st1 = self.cc.symbol_table(self.ofile)
+        st2 = self.cc.objdump_symbol_table(self.ofile)
+        self.assertEqual(st1.table,st2.table)
+        self.assertEqual(st1.sections,st2.sections)
+        self.assertIn("ext",st1.getfrom(st1.undef))
+
+    def test_undefined(self):
+        self.assertEqual(self.cc.get_undefined(self.ofile),self.cc.objdump_get_undefined(self.ofile))
+
+    def test_sections(self):
+        self.assertEqual(self.cc.retrieve_sections(self.ofile),self.cc.objdump_retrieve_sections(self.ofile))
+        cobj1 = self.cc.generate_zerynth_binary(symtable(),self.ofile)
+        cobj2 = self.cc.objdump_generate_zerynth_binary(symtable(),self.ofile)
+        for sect in [".text",".rodata",".data"]:
+            self.assertEqual(bytes(cobj1.get_section(sect)),bytes(cobj2.get_section(sect)))
+
+    def test_not_elf(self):
+        self.assertIsNone(self.cc.read_elf(self.cfile))
+
+if __name__ == '__main__':
+    unittest.main()
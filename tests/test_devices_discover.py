@@ -0,0 +1,121 @@
+import unittest
+from unittest import mock
+from base import *
+import json
+import os
+import sys
+import tempfile
+from devices.discover import Discover
+
+BOARD = """
+from devices import Board
+class %s(Board):
+    %s
+    @staticmethod
+    def match(dev):
+        return dev["vid"]=="%s" and dev["pid"]=="%s"
+"""
+
+
+class TestDiscoverIndex(unittest.TestCase):
+
+    def setUp(self):
+        set_output_filter(False)
+        self.tmp = tempfile.TemporaryDirectory()
+        fs.makedirs(fs.path(self.tmp.name,"cvm"))
+        self.add_board("board_a","BoardA","1234","0001",ids=True)
+        self.add_board("board_b","BoardB","ABCD","0002",ids=True)
+        self.add_board("board_c","BoardC","5555","0003")
+        self.patches = [
+            mock.patch.object(env,"devices",fs.path(self.tmp.name,"devices"),create=True),
+            mock.patch.object(env,"cvm",fs.path(self.tmp.name,"cvm"),create=True),
+            mock.patch.object(env,"tmp",fs.path(self.tmp.name,"tmp"),create=True),
+            mock.patch.object(env,"dist",self.tmp.name,create=True),
+            mock.patch.object(tools,"get_package_deps",lambda fullname: [],create=True),
+            mock.patch.object(tools,"has_all_deps",lambda fullname: True,create=True),
+        ]
+        for p in self.patches:
+            p.start()
+        self.get_devices = mock.patch.object(tools,"get_devices",wraps=tools.get_devices).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+        set_output_filter(True)
+        self.unload()
+        self.tmp.cleanup()
+
+    def add_board(self,module,clsname,vid,pid,ids=False):
+        bdir = fs.path(self.tmp.name,"devices",module)
+        fs.makedirs(bdir)
+        dj = {"target":module,"classes":[module+"."+clsname],"type":"board","name":clsname}
+        fs.set_json(dj,fs.path(bdir,"device.json"))
+        fs.set_json({"fullname":"board.zerynth."+module},fs.path(bdir,"package.json"))
+        ids = 'ids_vendor = {"%s":frozenset(("%s",))}'%(vid,pid) if ids else ""
+        fs.write_file(BOARD%(clsname,ids,vid,pid),fs.path(bdir,module+".py"))
+
+    def unload(self):
+        for mod in ["board_a","board_b","board_c"]:
+            sys.modules.pop(mod,None)
+
+    def imported(self):
+        return [mod for mod in ["board_a","board_b","board_c"] if mod in sys.modules]
+
+    def discover(self):
+        dsc = Discover.__new__(Discover)
+        dsc.devices = {}
+        dsc.matched_devices = {}
+        dsc.device_cls = {}
+        dsc.device_ids = {}
+        dsc.new_ids = False
+        dsc.targets = {}
+        dsc.load_devices()
+        return dsc
+
+    def test_lazy_import(self):
+        dsc = self.discover()
+        self.assertEqual(sorted(dsc.get_targets()),["board_a","board_b","board_c"])
+        self.assertEqual(self.imported(),[])
+        tgt = dsc.get_target("board_b")
+        self.assertEqual(tgt.__class__.__name__,"BoardB")
+        self.assertEqual(self.imported(),["board_b"])
+        dsc.devices = {"u1":{"uid":"u1","vid":"1234","pid":"0001","sid":"x"}}
+        with mock.patch.object(env,"get_dev",lambda uid: None,create=True):
+            devs = dsc.match_devices()
+        self.assertEqual([d.__class__.__name__ for d in devs.values()],["BoardA"])
+        # the ids of board_a and board_c are not known yet: both are asked
+        self.assertEqual(self.imported(),["board_a","board_b","board_c"])
+
+    def match(self,dsc,vid,pid):
+        dsc.devices = {"u1":{"uid":"u1","vid":vid,"pid":pid,"sid":"x"}}
+        with mock.patch.object(env,"get_dev",lambda uid: None,create=True):
+            return [d.__class__.__name__ for d in dsc.match_devices().values()]
+
+    def test_id_index(self):
+        self.assertEqual(self.match(self.discover(),"9999","9999"),[])
+        self.assertEqual(self.imported(),["board_a","board_b","board_c"])
+        # the ids recorded at the first import skip the classes that can't match
+        self.unload()
+        self.assertEqual(self.match(self.discover(),"1234","0001"),["BoardA"])
+        self.assertEqual(self.imported(),["board_a","board_c"])
+        self.unload()
+        self.assertEqual(self.match(self.discover(),"9999","9999"),[])
+        self.assertEqual(self.imported(),["board_c"])
+        # a modified class is asked again
+        self.unload()
+        os.utime(fs.path(self.tmp.name,"devices","board_a","board_a.py"),(1,1))
+        self.assertEqual(self.match(self.discover(),"9999","9999"),[])
+        self.assertEqual(self.imported(),["board_a","board_c"])
+        self.assertEqual(self.get_devices.call_count,1)
+
+    def test_index_reused(self):
+        self.discover()
+        self.discover()
+        self.assertEqual(self.get_devices.call_count,1)
+        self.add_board("board_d","BoardD","7777","0004")
+        dsc = self.discover()
+        self.assertEqual(self.get_devices.call_count,2)
+        self.assertIn("board_d",dsc.get_targets())
+
+
+if __name__ == '__main__':
+    unittest.main()
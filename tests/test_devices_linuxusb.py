@@ -0,0 +1,82 @@
+import unittest
+from unittest import mock
+from base import *
+import devices.linuxusb as linuxusb
+
+
+class FakeDevice(dict):
+    def __init__(self,sys_path,action=None,**props):
+        super().__init__(props)
+        self.sys_path = sys_path
+        self.action = action
+
+
+def serial_device(sys_path,devname,sid,action=None,subsystem="tty"):
+    return FakeDevice(sys_path,action,SUBSYSTEM=subsystem,ID_SERIAL="Board_"+sid,ID_VENDOR_ID="0403",ID_MODEL_ID="6001",ID_SERIAL_SHORT=sid,DEVNAME=devname)
+
+
+class FakeUdev():
+    def __init__(self,devices):
+        self.devices = devices
+        self.enumerations = 0
+
+    def list_devices(self):
+        self.enumerations+=1
+        return list(self.devices)
+
+
+class FakeMonitor():
+    def __init__(self):
+        self.events = []
+
+    def poll(self,timeout=None):
+        return self.events.pop(0) if self.events else None
+
+
+class TestLinuxUsbEvents(unittest.TestCase):
+
+    def setUp(self):
+        set_output_filter(False)
+        self.usb = linuxusb.LinuxUsb.__new__(linuxusb.LinuxUsb)
+        self.usb.devstrings = {"ID_SERIAL":"serial","ID_VENDOR_ID":"vid","ID_MODEL_ID":"pid","SUBSYSTEM":"sys","DEVNAME":"dev"}
+        self.usb.devkeys = set(self.usb.devstrings.keys())
+        self.usb.udev = FakeUdev([serial_device("/sys/a","/dev/ttyUSB0","A1"),FakeDevice("/sys/other",SUBSYSTEM="pci")])
+        self.usb.table = None
+        self.monitor = FakeMonitor()
+        self.usb.monitor = None
+        self.usb.start_monitor = lambda: setattr(self.usb,"monitor",self.monitor)
+        self.mounts = []
+        self.usb.read_mounts = lambda: self.mounts.append(1) or {"/dev/sdb1":"/media/user/BOARD"}
+
+    def tearDown(self):
+        set_output_filter(True)
+
+    def test_incremental(self):
+        devs = self.usb.parse()
+        self.assertEqual([d["port"] for d in devs],["/dev/ttyUSB0"])
+        self.monitor.events = [
+            serial_device("/sys/b","/dev/ttyACM0","B2",action="add"),
+            serial_device("/sys/b1","/dev/sdb1","B2",action="add",subsystem="block"),
+            FakeDevice("/sys/a",action="remove")
+        ]
+        devs = self.usb.parse()
+        devs = {d["port"] or d["block"]:d for d in devs}
+        self.assertEqual(sorted(devs),["/dev/sdb1","/dev/ttyACM0"])
+        self.assertEqual(devs["/dev/sdb1"]["disk"],"/media/user/BOARD")
+        self.assertEqual(devs["/dev/ttyACM0"]["sid"],"B2")
+        # enumerated once, mount points read once per batch
+        self.assertEqual(self.usb.udev.enumerations,1)
+        self.assertEqual(len(self.mounts),1)
+        self.usb.parse()
+        self.assertEqual(self.usb.udev.enumerations,1)
+
+    def test_mount_escapes(self):
+        usb = linuxusb.LinuxUsb.__new__(linuxusb.LinuxUsb)
+        data = "/dev/sdb1 /media/user/MY\\040BOARD vfat rw 0 0\nproc /proc proc rw 0 0\n"
+        with mock.patch("builtins.open",mock.mock_open(read_data=data)):
+            mounts = usb.read_mounts()
+        self.assertEqual(mounts,{"/dev/sdb1":"/media/user/MY BOARD"})
+
+
+if __name__ == '__main__':
+    unittest.main()
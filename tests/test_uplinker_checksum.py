@@ -0,0 +1,51 @@
+import unittest
+from base import *
+from uplinker.checksum import adler32, fletcher32
+import random
+
+# reference implementations, per byte
+def adler32_ref(buf):
+    a = 1
+    b = 0
+    for x in buf:
+        a = (a+x)%65521
+        b = (b+a)%65521
+    return (b<<16)|a
+
+def fletcher32_ref(buf):
+    sum1 = 0
+    sum2 = 0
+    sz = len(buf)
+    if sz%2!=0:
+        sz=sz-1
+    for i in range(0,sz,2):
+        e = buf[i]|(buf[i+1]<<8)
+        sum1 = (sum1+e)%0xffff
+        sum2 = (sum1+sum2)%0xffff
+    if sz!=len(buf):
+        e = buf[-1]
+        sum1=(sum1+e)%0xffff
+        sum2=(sum1+sum2)%0xffff
+    return sum1|(sum2<<16)
+
+class TestUplinkerChecksum(unittest.TestCase):
+
+    def setUp(self):
+        rnd = random.Random(42)
+        self.buffers = [b"",b"\x01",b"\xff",b"\xff\xff",b"\xff"*131075,bytes(range(256))*3+b"\x7f"]
+        for sz in [1,2,3,4095,4096,65535,65536,131073,300001]:
+            self.buffers.append(bytes(rnd.getrandbits(8) for i in range(sz)))
+
+    def test_adler32(self):
+        for buf in self.buffers:
+            self.assertEqual(adler32(buf),adler32_ref(buf))
+            self.assertEqual(adler32(bytearray(buf)),adler32_ref(buf))
+
+    def test_fletcher32(self):
+        for buf in self.buffers:
+            self.assertEqual(fletcher32(buf),fletcher32_ref(buf))
+            self.assertEqual(fletcher32(bytearray(buf)),fletcher32_ref(buf))
+            self.assertEqual(fletcher32(memoryview(buf)),fletcher32_ref(buf))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+from base import *
+from uplinker.dcz import Layout
+
+
+class TestLayoutRegions(unittest.TestCase):
+
+    def setUp(self):
+        self.layout = Layout()
+        self.layout.add(b"\x01"*100,0x8010000,"Firmware")
+        self.layout.add(b"\x02"*16,0x8000000,"VM")
+        self.layout.add(b"\x03"*8,0x8000010+4000,"res1")
+        self.layout.add(b"\x04"*8,0x8100000,"res2")
+
+    def test_merge(self):
+        regions = list(self.layout.regions(max_gap=4096))
+        self.assertEqual([r["loc"] for r in regions],[0x8000000,0x8010000,0x8100000])
+        vm = regions[0]
+        self.assertEqual(vm["dsc"],"VM, res1")
+        self.assertEqual(bytes(vm["bin"]),b"\x02"*16+b"\xff"*4000+b"\x03"*8)
+        # chunks are left untouched
+        self.assertEqual([c["bin"] for c in self.layout.chunks()][1],b"\x02"*16)
+
+    def test_large_gap(self):
+        regions = list(self.layout.regions(max_gap=0x100000))
+        self.assertEqual(len(regions),1)
+        self.assertEqual(len(regions[0]["bin"]),0x100000+8)
+        self.assertEqual(regions[0]["bin"][0x10000:0x10000+100],b"\x01"*100)
+
+    def test_no_merge(self):
+        regions = list(self.layout.regions())
+        self.assertEqual(len(regions),4)
+        self.layout.add(b"\x05"*8,0x8000010,"res3")
+        regions = list(self.layout.regions())
+        self.assertEqual([r["dsc"] for r in regions],["VM, res3","res1","Firmware","res2"])
+
+    def test_symbolic_locations(self):
+        self.layout.add(b"\x06"*8,"otp","key")
+        regions = list(self.layout.regions(max_gap=4096))
+        # the pending numeric region is burned before symbolic locations
+        self.assertEqual([r["loc"] for r in regions],[0x8000000,0x8010000,0x8100000,"otp"])
+        self.assertEqual(bytes(regions[2]["bin"]),b"\x04"*8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+from unittest import mock
+from base import *
+import base64
+import os
+import tempfile
+import uplinker.uplinker as uplinker
+
+
+class TestLinkDebugBytecode(unittest.TestCase):
+
+    def setUp(self):
+        set_output_filter(False)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.bf = {
+            "info":{"version":"r2.6.0"},
+            "header":str(base64.standard_b64encode(bytes(range(64))),"utf-8"),
+            "pyobjs":str(base64.standard_b64encode(b"pyobjs"*100),"utf-8"),
+            "cobjs":None,
+            "cnatives":[],
+            "repr":[{"name":"main"}]
+        }
+        self.dbgfile = os.path.join(self.tmp.name,"dbg.elf")
+        fs.write_file(b"\x7fELF debug",self.dbgfile)
+        vm = {"map":{"bc":["0x8000"],"bcdelta":"0","table":{},"sym":{}},"relocator":"","cc":"","gccopts":{}}
+        mock.patch.object(uplinker.tools,"get_vm_by_uid",return_value="/vms/vm.vm").start()
+        mock.patch.object(uplinker.tools,"load_vm",return_value=vm).start()
+        mock.patch.object(uplinker.Relocator,"relocate",self.relocate).start()
+        mock.patch.object(env,"human",True,create=True).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+        set_output_filter(True)
+        self.tmp.cleanup()
+
+    def relocate(self,memstart,romstart,dbginfo=None,tempdir=None):
+        dbginfo.extend([self.dbgfile,0x8000])
+        return bytearray(b"thebin")
+
+    def link(self,bytecode):
+        out = os.path.join(self.tmp.name,"out.bin")
+        uplinker.do_link("vmuid",bytecode,debug_bytecode=True,file=out)
+        self.assertEqual(fs.readfile(out,"b"),b"thebin")
+
+    def test_binary_vbo(self):
+        bytecode = os.path.join(self.tmp.name,"main.vbo")
+        save_vbo(self.bf,bytecode)
+        self.link(bytecode)
+        self.assertTrue(is_binary_vbo(bytecode))
+        bf = load_vbo(bytecode)
+        self.assertEqual(bf["header"],bytes(range(64)))
+        self.assertEqual(bf["repr"],self.bf["repr"])
+        self.assertEqual(bf["dbg"]["address"],"0x8000")
+        self.assertEqual(base64.b64decode(bf["dbg"]["info"]),b"\x7fELF debug")
+
+    def test_json_vbo(self):
+        bytecode = os.path.join(self.tmp.name,"main.vbo")
+        fs.set_json(self.bf,bytecode)
+        self.link(bytecode)
+        self.assertFalse(is_binary_vbo(bytecode))
+        bf = fs.get_json(bytecode)
+        self.assertEqual(bf["pyobjs"],self.bf["pyobjs"])
+        self.assertEqual(bf["dbg"]["address"],"0x8000")
+
+
+if __name__ == '__main__':
+    unittest.main()
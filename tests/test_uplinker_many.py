@@ -0,0 +1,191 @@
+import unittest
+from unittest import mock
+from base import *
+import os
+import pty
+import struct
+import threading
+import tty
+import zlib
+import uplinker.uplinker as uplinker
+
+
+class FakeVM():
+    # speaks the vm side of probe, handshake and upload on the master end of a pty
+    def __init__(self,vmuid,target,chunk,window=0,bad_blocks={}):
+        self.master,slave = pty.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self.slave = slave
+        self.vmuid = vmuid
+        self.target = target
+        self.chunk = chunk
+        self.window = window
+        # number of RB answers for each block
+        self.bad_blocks = dict(bad_blocks)
+        self.received = None
+        self.th = threading.Thread(target=self.run,daemon=True)
+        self.th.start()
+
+    def read(self,n):
+        buf = b""
+        while len(buf)<n:
+            buf+=os.read(self.master,n-len(buf))
+        return buf
+
+    def write(self,line):
+        os.write(self.master,bytes(line,"ascii"))
+
+    def run(self):
+        try:
+            self.serve()
+        except OSError:
+            pass
+
+    def serve(self):
+        while self.read(1)!=b"V":
+            pass
+        self.write("r2.6.0 %s %s 0123 ZERYNTH\n"%(self.vmuid,self.target))
+        while self.read(1)!=b"U":
+            pass
+        if self.window:
+            self.write("W %x\n"%self.window)
+        self.write("OK\n20000000\n8000000\n100000\n")
+        size = struct.unpack("<I",self.read(4))[0]
+        windowed = size&uplinker.UPLINK_WINDOWED
+        size&=~uplinker.UPLINK_WINDOWED
+        self.write("OK\n")
+        blocks = {}
+        nblocks = (size+self.chunk-1)//self.chunk
+        while len(blocks)<nblocks:
+            if windowed:
+                hdr = self.read(4)
+                seq = struct.unpack("<I",hdr)[0]
+            else:
+                hdr = b""
+                seq = len(blocks)
+            data = self.read(min(self.chunk,size-seq*self.chunk))
+            crc = struct.unpack("<I",self.read(4))[0]
+            ans = " %x"%seq if windowed else ""
+            if self.bad_blocks.get(seq) or crc!=zlib.adler32(hdr+data):
+                self.bad_blocks[seq] = self.bad_blocks.get(seq,1)-1
+                self.write("RB"+ans+"\n")
+            else:
+                blocks[seq]=data
+                self.write(".debug line\nOK"+ans+"\n")
+        self.received = b"".join(blocks[i] for i in range(nblocks))
+
+    def close(self):
+        os.close(self.slave)
+        os.close(self.master)
+
+
+class FakeDevice():
+    def __init__(self,alias,target,port,chunk):
+        self.alias = alias
+        self.uid = "uid-"+alias
+        self.target = target
+        self.port = port
+        self.connection = {}
+        self.fixed_timeouts = True
+        self.uplink_reset = False
+        self.preferred_uplink_with_jtag = False
+        self.probing_pre_v_hook = None
+        self.opts = {"vm_chunk":chunk,"vm_mini_chunk":chunk}
+
+    def get(self,key,default=None):
+        return self.opts.get(key,default)
+
+
+class FakeRelocator():
+    calls = []
+
+    def __init__(self,bf,vm,dev):
+        self.vm = vm
+
+    def relocate(self,memstart,romstart,tempdir=None):
+        FakeRelocator.calls.append((self.vm["uid"],memstart,romstart))
+        return bytes(range(256))*41+self.vm["uid"].encode("ascii")
+
+
+class TestUplinkMany(unittest.TestCase):
+
+    def setUp(self):
+        set_output_filter(False)
+        FakeRelocator.calls = []
+        self.vms = []
+
+    def tearDown(self):
+        set_output_filter(True)
+        for vm in self.vms:
+            vm.close()
+
+    def uplink(self,specs):
+        devs = []
+        for alias,vmuid,window,bad in specs:
+            vm = FakeVM(vmuid,"fake_board",1024,window,bad)
+            self.vms.append(vm)
+            devs.append(FakeDevice(alias,"fake_board",vm.port,1024))
+        with mock.patch.object(uplinker.tools,"get_vm",lambda vmuid,*args: vmuid), \
+             mock.patch.object(uplinker.tools,"load_vm",lambda vmuid: {"uid":vmuid}), \
+             mock.patch.object(uplinker.env,"check_vm_compat",lambda *args: True,create=True), \
+             mock.patch.object(uplinker,"Relocator",FakeRelocator):
+            return uplinker._uplink_devices(devs,{},None)
+
+    def test_concurrent_uplink(self):
+        results = self.uplink([
+            ("dev1","vmA",0,{}),
+            ("dev2","vmA",4,{1:1,3:2}),
+            ("dev3","vmB",8,{0:1}),
+            ("dev4","vmA",0,{2:2})
+        ])
+        self.assertEqual([res["result"] for res in results],["ok"]*4)
+        # one relocation per vm and memory layout
+        self.assertEqual(sorted(FakeRelocator.calls),[("vmA",0x20000000,0x8000000),("vmB",0x20000000,0x8000000)])
+        for vm,res in zip(self.vms,results):
+            vm.th.join(5)
+            self.assertEqual(vm.received,bytes(range(256))*41+vm.vmuid.encode("ascii"))
+            self.assertEqual(res["size"],len(vm.received))
+            self.assertEqual(res["vm"],vm.vmuid)
+
+    def test_failed_device(self):
+        # three bad answers for the same block make the uplink fail
+        results = self.uplink([
+            ("dev1","vmA",4,{}),
+            ("dev2","vmA",0,{1:3}),
+            ("dev3","vmA",4,{5:3})
+        ])
+        self.assertEqual([res["result"] for res in results],["ok","failed","failed"])
+        self.vms[0].th.join(5)
+        self.assertEqual(len(self.vms[0].received),results[0]["size"])
+
+
+class FakeChannel():
+    def __init__(self,lines):
+        self.lines = list(lines)
+
+    def write(self,data):
+        pass
+
+    def readline(self):
+        return self.lines.pop(0) if self.lines else ""
+
+
+class TestHandshake(unittest.TestCase):
+
+    def setUp(self):
+        set_output_filter(False)
+
+    def tearDown(self):
+        set_output_filter(True)
+
+    def test_banner_and_window(self):
+        # a vm printing a banner before the window line still negotiates the window
+        banner = ["banner %i\n"%i for i in range(5)]
+        ch = FakeChannel(banner+["W 8\n","OK\n","20000000\n","8000000\n","100000\n"])
+        symbols,memstart,romstart,flashspace,window = uplinker.handshake(ch)
+        self.assertEqual((memstart,romstart,flashspace,window),(0x20000000,0x8000000,0x100000,8))
+
+
+if __name__ == '__main__':
+    unittest.main()
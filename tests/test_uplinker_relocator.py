@@ -0,0 +1,65 @@
+import unittest
+from unittest import mock
+from base import *
+import tempfile
+from uplinker.relocator import Relocator
+
+
+class FakeDevice():
+    cc = "gcc-arm"
+    gccopts = {"cflags":[]}
+    relocator = "cortex-m"
+
+    def get(self,key,default=None):
+        return default
+
+
+class TestRelocatorImageCache(unittest.TestCase):
+
+    def setUp(self):
+        set_output_filter(False)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.vm = {"uid":"vmuid","version":"r20.10.1","hexversion":"140a0100","map":{"table":{},"sym":{},"memend":"20010000"}}
+        self.zcode = {"header":"aGVhZGVy","pyobjs":"cHlvYmpz","cobjs":"","cnatives":[]}
+        Relocator._images = {}
+        self.calls = []
+
+    def tearDown(self):
+        set_output_filter(True)
+        self.tmp.cleanup()
+
+    def relocate_with_memend(self,_memend,_romstart,debug_info=None,tempdir=None):
+        self.calls.append((_memend,_romstart))
+        return bytearray(64)+bytearray([_romstart&0xff])
+
+    def relocate(self,memend,romstart,zcode=None,debug_info=None):
+        rel = Relocator(zcode or self.zcode,self.vm,FakeDevice())
+        with mock.patch.object(env,"tmp",self.tmp.name,create=True), \
+             mock.patch.object(Relocator,"relocate_with_memend",lambda rel,*args: self.relocate_with_memend(*args)):
+            return rel.relocate(memend,romstart,debug_info)
+
+    def test_cached_image(self):
+        bin1 = self.relocate(0x20010000,0x8000000)
+        bin2 = self.relocate(0x20010000,0x8000000)
+        self.assertEqual(len(self.calls),1)
+        # only timestamp differs
+        self.assertEqual(bin1[:44],bin2[:44])
+        self.assertEqual(bin1[48:],bin2[48:])
+        # reloaded from disk
+        Relocator._images = {}
+        self.relocate(-1,0x8000000)
+        self.assertEqual(len(self.calls),1)
+
+    def test_key_changes(self):
+        self.relocate(0x20010000,0x8000000)
+        self.relocate(0x20010000,0x8000100)
+        self.relocate(0x20008000,0x8000000)
+        self.relocate(0x20010000,0x8000000,zcode=dict(self.zcode,pyobjs="b3RoZXI="))
+        self.assertEqual(len(self.calls),4)
+        # the linker outputs are needed with debug info
+        self.relocate(0x20010000,0x8000000,debug_info=[])
+        self.assertEqual(len(self.calls),5)
+
+
+if __name__ == '__main__':
+    unittest.main()
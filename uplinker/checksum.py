@@ -0,0 +1,24 @@
+import zlib
+
+# Checksums of uplink blocks and DCZ resources, computed in C by zlib and by big integer arithmetic
+
+def adler32(buf):
+    return zlib.adler32(bytes(buf))&0xffffffff
+
+
+def fletcher32(buf):
+    # fletcher32 over little endian 16 bit words, an odd trailing byte is added as a word.
+    # With M=0xffff and n words w[i]: sum1 = S = sum(w[i]) and sum2 = sum((n-i)*w[i]) = n*S-W, W = sum(i*w[i]).
+    # The buffer read as an integer is X = sum(w[i]*2**(16*i)) and 2**16 = 1+M, so that
+    # X = sum(w[i]*(1+i*M)) = S+M*W (mod M*M)
+    buf = bytes(buf)
+    if len(buf)%2:
+        buf+=b"\x00"
+    n = len(buf)//2
+    M = 0xffff
+    X = int.from_bytes(buf,"little")
+    S = sum(buf[0::2])+(sum(buf[1::2])<<8)
+    W = ((X-S)%(M*M))//M
+    sum1 = S%M
+    sum2 = (n*S-W)%M
+    return sum1|(sum2<<16)
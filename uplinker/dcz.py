@@ -1,5 +1,6 @@
 from base import *
 from .provisioner import *
+from .checksum import fletcher32
 import struct
 
 class Resource():
@@ -97,6 +98,35 @@ class Layout():
                     "dsc": self.layout["dsc"][i]
                     }
 
+    def regions(self,max_gap=0):
+        # chunks sorted by address and merged in contiguous regions when the gap between them
+        # is at most max_gap bytes. Gaps are filled with 0xFF, erasing whatever the flash holds there:
+        # by default only adjacent chunks are merged
+        chunks = sorted(self.chunks(),key=lambda x: (isinstance(x["loc"],str),x["loc"]))
+        cur = None
+        for chunk in chunks:
+            if isinstance(chunk["loc"],str):
+                # symbolic locations are burned as they are, after the numeric ones
+                if cur is not None:
+                    yield cur
+                    cur = None
+                yield chunk
+                continue
+            if cur is not None:
+                gap = chunk["loc"]-(cur["loc"]+len(cur["bin"]))
+                if 0<=gap<=max_gap:
+                    cur["bin"]+=b"\xff"*gap+chunk["bin"]
+                    cur["dsc"]+=", "+str(chunk["dsc"])
+                    continue
+                yield cur
+            cur = {
+                "bin": bytearray(chunk["bin"]),
+                "loc": chunk["loc"],
+                "dsc": str(chunk["dsc"])
+            }
+        if cur is not None:
+            yield cur
+
     def __repr__(self):
         return self.layout
 
@@ -296,26 +326,6 @@ class DCZUnknownResource(Exception):
 class DCZOverlapping(Exception):
     pass
 
-def fletcher32(buf):
-    sum1 = 0
-    sum2 = 0
-    sz = len(buf)
-    if sz%2!=0:
-        sz=sz-1
-    for i in range(0,sz,2):
-        e = buf[i]|(buf[i+1]<<8)
-        sum1 = (sum1+e)%0xffff
-        sum2 = (sum1+sum2)%0xffff
-
-    if sz!=len(buf):
-        e = buf[-1]
-        sum1=(sum1+e)%0xffff
-        sum2=(sum1+sum2)%0xffff
-
-    result = sum1|(sum2<<16)
-    return result
-
-
 ENTRY_SIZE = 64
 HEADER_SIZE = 16
 
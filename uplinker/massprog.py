@@ -217,14 +217,32 @@ by the mass programming command documented below. A mass programming configurati
 
 
 from base import *
-from devices import get_device_by_target
+from devices import get_device_by_target, do_register_raw, do_register_by_uid
+from virtualmachines import do_create_by_uid
+from compiler import do_compile
+from .uplinker import do_link
 import click
 import base64
 import struct
+import time
 from jtag import *
 from .dcz import *
 
 
+def _mp_step(timings,stage,errmsg,fn,*args,**kwargs):
+    # run a toolchain step in process, failing with errmsg if it exits with an error
+    t0 = time.perf_counter()
+    try:
+        res = fn(*args,**kwargs)
+    except SystemExit as e:
+        if e.code:
+            fatal(errmsg)
+        res = None
+    finally:
+        timings.append([stage,time.perf_counter()-t0])
+    return res
+
+
 @cli.group(help="Manage mass programming.")
 def massprog():
     pass
@@ -248,6 +266,8 @@ If the project specified in :samp:`massprog.yml` contains a :samp:`dcz.yml` file
 
 The :command:`massprog` may take the additional :option:`--clean` option that forces a firmware compilation and link.
 
+Registration, VM creation, compilation and link run in the same process as the :command:`massprog` command. At the end, a table with the time spent in each stage is printed.
+
 
     """
     mapfile = fs.path(mppath,"massprog.yml")
@@ -267,9 +287,12 @@ The :command:`massprog` may take the additional :option:`--clean` option that fo
     dczmapfile = fs.path(project,"dcz.yml")
     dcz_map = map.get("dcz",{})
     resources = {}
+    timings = []
+    t0 = time.perf_counter()
 
 
     info("===== Registration")
+    tr = time.perf_counter()
     dev = get_device_by_target(target,dev_options,skip_reset=True)
     info("Target",target)
     if register=="target_custom":
@@ -290,51 +313,30 @@ The :command:`massprog` may take the additional :option:`--clean` option that fo
 
     if not chipid:
         fatal("Can't find chipid!")
+    timings.append(["chipid",time.perf_counter()-tr])
 
     if register == "standard":
-        res, out, _ = proc.run_ztc("device","register_raw",target,"--spec", "port:%s" % dev_options["port"], "--spec", "baud:%s" % dev_options["baud"], outfn=log)
-    else:
-        res, out, _ = proc.run_ztc("device","register_by_uid",chipid,target,outfn=log)
-    if res:
-        fatal("Can't register!")
-    lines = out.split("\n")
-    for line in lines:
-        if "registered with uid:" in line:
-            pos = line.rindex(":")
-            dev_uid = line[pos+1:].strip()
-            print("[",dev_uid,"]")
-            break
+        specs = ["port:%s" % dev_options["port"], "baud:%s" % dev_options["baud"]]
+        dev_uid = _mp_step(timings,"register","Can't register!",do_register_raw,target,False,specs,False)
     else:
+        dev_uid = _mp_step(timings,"register","Can't register!",do_register_by_uid,chipid,target)
+    if not dev_uid:
         fatal("Can't find device uid!")
+    print("[",dev_uid,"]")
 
     info("===== Licensing")
-    args = []
-    for feat in vm_feats:
-        args.append("--feat")
-        args.append(feat)
-    if shareable:
-        args.append("--reshare")
-        args.append("--share")
-    if locked:
-        args.append("--locked")
-    info("Getting vm for",dev_uid,vm_version,vm_rtos,vm_patch,*args)
-    res, out, _ = proc.run_ztc("vm","create_by_uid",dev_uid,vm_version,vm_rtos,vm_patch,*args,outfn=log)
-    if res:
-        fatal("Can't create vm!")
-    lines = out.split("\n")
-    for line in lines:
-        if "created with uid:" in line:
-            pos = line.rindex(":")
-            vm_uid = line[pos+1:].strip()
-            print("[",vm_uid,"]")
-            break
-    else:
+    feats = list(vm_feats)
+    info("Getting vm for",dev_uid,vm_version,vm_rtos,vm_patch,*feats)
+    vm_uid = _mp_step(timings,"vm","Can't create vm!",do_create_by_uid,dev_uid,vm_version,vm_rtos,feats,"",vm_patch,"",shareable,shareable,locked)
+    if not vm_uid:
         fatal("Can't find vm uid!")
+    print("[",vm_uid,"]")
 
     info("===== VM")
+    tv = time.perf_counter()
     # get vm bin
     vmfile = tools.get_vm_by_uid(vm_uid)
-    vm = fs.get_json(vmfile)
+    vm = tools.load_vm(vmfile)
     vmpath = fs.path(mppath,"vms",vm_uid)
     if not fs.exists(vmpath):
         fs.makedirs(vmpath)
@@ -353,6 +355,7 @@ The :command:`massprog` may take the additional :option:`--clean` option that fo
             resources["VM-Fragment-"+str(i)] = Resource({"type":"file","name":"VM-Fragment-"+str(i),"mapping":[vm["loc"][i]],"args":vmbinfile})
             resources["VM-Fragment-"+str(i)].load_from_file()
     info("     using",vmpath)
+    timings.append(["vm files",time.perf_counter()-tv])
 
 
     # check for binary fw
@@ -368,26 +371,28 @@ The :command:`massprog` may take the additional :option:`--clean` option that fo
         warning("No binary bytecode present, checking vbo for",project)
         if not fs.exists(bytecode):
             warning("No bytecode present either, compiling project at",project)
-            res, out, _ = proc.run_ztc("compile",project,target,"-o",fs.path(mppath,"fw.vbo"),outfn=log)
-            if res:
-                fatal("Can't compile project at",project)
-        res, out, _ = proc.run_ztc("link",vm_uid,bytecode,"--bin","--file",fs.path(mppath,"fw.bin"),outfn=log)
-        if res:
-            fatal("Can't link project at",project)
+            _mp_step(timings,"compile","Can't compile project at "+project,do_compile,project,target,bytecode,[],[],False,[],False,"",repr_mode="none")
+        _mp_step(timings,"link","Can't link project at "+project,do_link,vm_uid,bytecode,bin=True,file=fwbin)
     info("     using",fwbin)
     resources["Firmware"]=Resource({"type":"file","args":fwbin,"mapping":vm["bcloc"],"name":"Firmware"})
     resources["Firmware"].load_from_file()
 
     info("===== Provisioning Resources")
+    tl = time.perf_counter()
     layout = get_layout_at(project,fail=True)
     layout.add_resources(resources)
     layout.validate()
+    timings.append(["provisioning",time.perf_counter()-tl])
     log_table(layout.to_table(),headers=["Name","Address","Size","Checksum"])
 
 
     info("===== Burn Layout")
     # burn layout
-    dev.do_burn_layout(layout,dev_options,outfn=info)
+    _mp_step(timings,"burn","Can't burn layout!",dev.do_burn_layout,layout,dev_options,outfn=info)
+
+    info("===== Timings")
+    timings.append(["total",time.perf_counter()-t0])
+    log_table([[stage,"%.3f"%secs] for stage,secs in timings],headers=["Stage","Seconds"])
 
 
 
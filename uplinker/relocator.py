@@ -1,16 +1,30 @@
 from base import *
 from compiler import gcc
+from compiler.elf import SHF_ALLOC
 import re
 import base64
+import hashlib
+import json
+import os
 import struct
 import time
 
 class Relocator():
+    # intermediate results of the relocation of a C object for a vm, kept in memory and under env.tmp:
+    # undefined symbols of the object and size of the data in ram
+    _relinfo = {}
+    # relocated images, keyed on bytecode, vm and memory layout
+    _images = {}
+
     def __init__(self,zcode,vm,device):
         self.zcode = zcode
         #self.vmsym = []
         self.device = device
         self.thevm = vm
+        self.cc = None
+        self.relkey = None
+        self.relinfo = {}
+        self._sections = {}
         self.symtable = dict(vm["map"]["table"])
 
         for k in self.symtable:
@@ -29,10 +43,76 @@ class Relocator():
         #     if m and m.group(2):
         #         self.vmsym.append(m.group(2))
 
+    def get_cc(self):
+        if self.cc is None:
+            # print("GCCOPTS",self.device.gccopts)
+            self.cc = gcc(tools[self.device.cc],self.device.gccopts)
+        return self.cc
+
+    def load_relinfo(self,cobj):
+        hh = hashlib.sha256()
+        hh.update(cobj)
+        vmid = self.thevm.get("uid") or json.dumps(self.thevm["map"],sort_keys=True)
+        hh.update(bytes(vmid+"::"+str(self.device.cc)+"::"+json.dumps(self.device.gccopts,sort_keys=True,default=str)+"::"+str(self.device.get("rodata_in_ram",False)),"utf-8"))
+        self.relkey = hh.hexdigest()
+        if self.relkey not in Relocator._relinfo:
+            try:
+                Relocator._relinfo[self.relkey] = fs.get_json(fs.path(env.tmp,"reloc_cache",self.relkey+".json"))
+            except:
+                Relocator._relinfo[self.relkey] = {}
+        self.relinfo = Relocator._relinfo[self.relkey]
+
+    def save_relinfo(self):
+        if not self.relkey:
+            return
+        try:
+            fs.atomic_write(json.dumps(self.relinfo),fs.path(env.tmp,"reloc_cache",self.relkey+".json"))
+        except Exception as e:
+            debug("Can't save relocation cache",e)
+
+    def estimate_ram_size(self,ofile,rodata_in_ram):
+        # size in ram of data and bss (and rodata if moved to ram), computed from the sections of the relocatable object.
+        # It's a guess: the linker may add sections or padding, the final link checks it
+        elf = self.get_cc().read_elf(ofile)
+        if elf is None:
+            return 0
+        sizes = {".rodata":0,".data":0,".bss":0}
+        if not rodata_in_ram:
+            # data and bss are contiguous
+            sizes = {".data":0}
+        for sect in elf.sections:
+            if not (sect.flags&SHF_ALLOC) or not sect.name.startswith("."):
+                continue
+            grp = "."+sect.name.split(".")[1]
+            if not rodata_in_ram and grp==".bss":
+                grp = ".data"
+            if grp in sizes:
+                sizes[grp] = self.align_to(sizes[grp],max(sect.addralign,1))+sect.size
+        grp = ".bss" if rodata_in_ram else ".data"
+        for sym in elf.symbols():
+            if sym.section=="*COM*":
+                sizes[grp] = self.align_to(sizes[grp],max(sym.value,1))+sym.size
+        if not rodata_in_ram:
+            return self.align_to(sizes[".data"],4)
+        # rodata, data and bss are aligned to 16 in ram
+        acc = 0
+        for grp in [".rodata",".data",".bss"]:
+            if sizes[grp]:
+                acc = self.align_to(acc,16)+sizes[grp]
+        return acc
+
+    def memstart_below(self,_memend,hsize):
+        _memstart = _memend-hsize
+        if _memstart%16:
+            _memstart=_memstart&(~0xf)
+        return _memstart
+
     def get_relocated_code(self,symreloc,ofile,lfile,rodata_in_ram=False):
-        # print("GCCOPTS",self.device.gccopts)
-        cc = gcc(tools[self.device.cc],self.device.gccopts)
-        undf = cc.get_undefined(ofile)
+        cc = self.get_cc()
+        undf = self.relinfo.get("undefined")
+        if undf is None:
+            undf = cc.get_undefined(ofile)
+            self.relinfo["undefined"] = sorted(undf)
         fund = set()
         srel = dict(symreloc)
         debug(undf)
@@ -291,15 +371,21 @@ class Relocator():
         return thebin
 
 
-    def _get_objs_from_zcode(self,_romstart):
-        cobjs = self.zcode["cobjs"]
-        header = bytearray(base64.standard_b64decode(self.zcode["header"]))
-        pyobjs = bytearray(base64.standard_b64decode(self.zcode["pyobjs"]))
+    def _section(self,field):
+        # bytecode sections are base64 strings in json .vbo files and bytes in binary ones
+        if field not in self._sections:
+            value = self.zcode.get(field)
+            if not value:
+                value = bytes()
+            elif isinstance(value,str):
+                value = base64.standard_b64decode(value)
+            self._sections[field] = bytes(value)
+        return self._sections[field]
 
-        if cobjs:
-            cobj = base64.standard_b64decode(cobjs)
-        else:
-            cobj = bytes()
+    def _get_objs_from_zcode(self,_romstart):
+        header = bytearray(self._section("header"))
+        pyobjs = bytearray(self._section("pyobjs"))
+        cobj = self._section("cobjs")
 
         _textstart = _romstart+len(header)+len(pyobjs)
         debug("textstart",hex(_textstart))
@@ -323,9 +409,11 @@ class Relocator():
             ofile = fs.path(tmpdir,"zerynth.rlo")
             lfile = fs.path(tmpdir,"zerynth.lo")
             fs.write_file(cobj,ofile)
+            self.load_relinfo(cobj)
             symreloc = {}
             symreloc.update({"_start":0,".data":_memstart,".text":_textstart})
             vcobj = self.get_relocated_code(symreloc,ofile,lfile,rodata_in_ram)
+            self.save_relinfo()
             if rodata_in_ram:
                 debug("Relocation .rodata")
                 hsize, data_start,data_end,_memstart,cbin,vcobjl = self._relocate_romdata(_memstart,vcobj,symreloc,tmpdir,ofile,lfile,debug_info)
@@ -341,7 +429,7 @@ class Relocator():
         else:
             thebin = header+pyobjs
 
-        return self._fill_thebin(thebin)
+        return thebin
 
 
     def relocate_with_memend(self,_memend,_romstart,debug_info=None,tempdir=None):
@@ -357,37 +445,37 @@ class Relocator():
             ofile = fs.path(tmpdir,"zerynth.rlo")
             lfile = fs.path(tmpdir,"zerynth.lo")
             fs.write_file(cobj,ofile)
-            symreloc = {}
-            symreloc.update({"_start":0,".data":_memend,".text":_textstart})
-            vcobj = self.get_relocated_code(symreloc,ofile,lfile,rodata_in_ram)
-            # cbin = vcobj.binary
-            # data_start = vcobj.romdata_start()
-            # data_end = vcobj.romdata_end()
-            hsize = vcobj.data_bss_size()
-            #now calculate real memstart
-            _memstart = _memend-hsize;
-            if _memstart%16:
-                _memstart=_memstart&(~0xf)
-            symreloc.update({"_start":0,".data":_memstart,".text":_textstart})
-            vcobj = self.get_relocated_code(symreloc,ofile,lfile,rodata_in_ram)
-            debug("MEMSTART 1",hex(_memstart))
-            if rodata_in_ram:
-                # pass 1: calculate hsize
-                debug("RODATA IN RAM STEP 1",hex(_memstart))
-                hsize,_,_,_,_,_ = self._relocate_romdata(_memstart,vcobj,symreloc,tmpdir,ofile,lfile,debug_info)
-                # pass 2: relink with correct memstart
-                _memstart = _memend-hsize
-                if _memstart%16:
-                    _memstart=_memstart&(~0xf)
-                debug("MEMSTART 2",hex(_memstart))
+            self.load_relinfo(cobj)
+            # the size in ram is needed to place data below memend: use the one measured in a previous
+            # relocation of the same object for the same vm, or estimate it from the object sections.
+            # The object is linked again only if the linked size moves memstart.
+            hsize = self.relinfo.get("hsize")
+            if hsize is None:
+                hsize = self.estimate_ram_size(ofile,rodata_in_ram)
+            vcobj = None
+            for attempt in range(2):
+                _memstart = self.memstart_below(_memend,hsize)
+                debug("MEMSTART",attempt+1,hex(_memstart))
                 symreloc = {"_start":0,".data":_memstart,".text":_textstart}
-                debug("RODATA IN RAM STEP 2",hex(_memstart))
-                # vcobj = self.get_relocated_code(symreloc,ofile,lfile,rodata_in_ram)
-                hsize, data_start,data_end,_memstart,cbin,vcobjl = self._relocate_romdata(_memstart,vcobj,symreloc,tmpdir,ofile,lfile,debug_info)
-            else:
-                hsize, data_start,data_end,_memstart,cbin,vcobjl = self._relocate_noromdata(_memstart,vcobj,symreloc,tmpdir,ofile,lfile,debug_info)
+                dbg = []
+                if rodata_in_ram:
+                    # text and rodata don't depend on memstart, link them once
+                    if vcobj is None:
+                        vcobj = self.get_relocated_code(symreloc,ofile,lfile,rodata_in_ram)
+                    res = self._relocate_romdata(_memstart,vcobj,dict(symreloc),tmpdir,ofile,lfile,dbg)
+                else:
+                    vcobj = self.get_relocated_code(symreloc,ofile,lfile,rodata_in_ram)
+                    res = self._relocate_noromdata(_memstart,vcobj,symreloc,tmpdir,ofile,lfile,dbg)
+                if self.memstart_below(_memend,res[0])==_memstart:
+                    break
+                debug("Relinking with ram size",hex(res[0]),"instead of",hex(hsize))
+                hsize = res[0]
+            hsize, data_start,data_end,_memstart,cbin,vcobjl = res
+            self.relinfo["hsize"] = hsize
+            self.save_relinfo()
 
             if debug_info is not None:
+                debug_info.extend(dbg)
                 debug_info.append(_textstart)
 
             self._fill_bcode_header(header,_textstart,_romstart,_memstart,data_start,data_end,hsize,pyobjs,vcobjl)
@@ -396,7 +484,7 @@ class Relocator():
         else:
             thebin = header+pyobjs
 
-        return self._fill_thebin(thebin)
+        return thebin
 
 
     def relocate(self,_memstart_or_memend,_romstart,debug_info=None,tempdir=None):
@@ -410,8 +498,7 @@ class Relocator():
                 _memstart_or_memend = int(vm["map"]["memstart"],16)+vm["map"]["memdelta"]
             else:
                 debug("Relocating with dev.memstart strategy")
-
-            return self.relocate_with_memstart(_memstart_or_memend,_romstart,debug_info,tempdir)
+            relocate_with = self.relocate_with_memstart
         else:
             if _memstart_or_memend == -1:
                 # linking without knowning memdelta (called by ztc.link)
@@ -419,7 +506,56 @@ class Relocator():
                 _memstart_or_memend = int(vm["map"]["memend"],16)
             else:
                 debug("Relocating with dev.memend strategy")
-
             # new vm without memdelta
-            return self.relocate_with_memend(_memstart_or_memend,_romstart,debug_info,tempdir)
+            relocate_with = self.relocate_with_memend
+
+        # the image only depends on bytecode, vm and memory layout: reuse it unless the linker outputs are needed
+        key = None
+        if debug_info is None:
+            key = self.image_key(_memstart_or_memend,_romstart)
+            thebin = self.load_image(key)
+            if thebin is not None:
+                debug("Relocated image found in cache")
+                return self._fill_thebin(thebin)
+        thebin = relocate_with(_memstart_or_memend,_romstart,debug_info,tempdir)
+        if key:
+            self.save_image(key,thebin)
+        return self._fill_thebin(thebin)
 
+    def image_key(self,_memstart_or_memend,_romstart):
+        hh = hashlib.sha256()
+        for field in ("header","pyobjs","cobjs"):
+            hh.update(self._section(field)+b"\0")
+        hh.update(bytes(json.dumps(self.zcode["cnatives"],sort_keys=True),"utf-8"))
+        vmid = self.thevm.get("uid") or json.dumps(self.thevm["map"],sort_keys=True)
+        hh.update(bytes("::".join([
+            vmid,
+            self.thevm["version"],
+            str(self.device.cc),
+            json.dumps(self.device.gccopts,sort_keys=True,default=str),
+            str(self.device.get("rodata_in_ram",False)),
+            str(self.device.relocator),
+            hex(_memstart_or_memend),
+            hex(_romstart)
+        ]),"utf-8"))
+        return hh.hexdigest()
+
+    def load_image(self,key):
+        # relocated image before _fill_thebin, kept in memory and under env.tmp
+        if key not in Relocator._images:
+            try:
+                path = fs.path(env.tmp,"reloc_cache",key+".bin")
+                Relocator._images[key] = fs.readfile(path,"b")
+                # touch for lru eviction
+                os.utime(path,None)
+            except:
+                return None
+        return bytearray(Relocator._images[key])
+
+    def save_image(self,key,thebin):
+        Relocator._images[key] = bytes(thebin)
+        try:
+            fs.atomic_write(Relocator._images[key],fs.path(env.tmp,"reloc_cache",key+".bin"))
+            fs.trim_dir(fs.path(env.tmp,"reloc_cache"),env.tmp_cache_size*1024*1024)
+        except Exception as e:
+            debug("Can't save relocation cache",e)
@@ -2,6 +2,7 @@ from base import *
 from packages import *
 from .relocator import Relocator
 from .dcz import *
+from .checksum import adler32
 import click
 import time
 import re
@@ -9,9 +10,12 @@ import struct
 import base64
 from jtag import *
 import virtualmachines
-from devices import get_device, get_device_by_target,probing
+from devices import get_device, get_device_by_target,probing,Discover
 import struct
+import threading
 
+# set in the total size word to select windowed upload
+UPLINK_WINDOWED = 0x80000000
 
 
 def extract_bcode_version(bcode):
@@ -38,12 +42,21 @@ def handshake(ch):
     debug("=> U")
     info("Handshake")
     frlines = 0
+    window = 0
     while not line.endswith("OK\n"):
         line=ch.readline()
         debug("<=",line)
         if (not line) or frlines>5:
             #timeout without an answer
             fatal("Timeout without answer")
+        if line.startswith("W "):
+            # the vm supports windowed upload with at most this many blocks in flight;
+            # part of the answer, not counted as a garbage line
+            try:
+                window = int(line[2:].strip("\n"),16)
+            except:
+                window = 0
+            continue
         frlines+=1
     #line=ch.readline()
 
@@ -75,7 +88,10 @@ def handshake(ch):
     _flashspace = int(line.strip("\n"),16)
     info("    flash    @"+line.strip("\n"))
 
-    return symbols,_memstart,_romstart,_flashspace
+    if window:
+        info("    window   ",window)
+
+    return symbols,_memstart,_romstart,_flashspace,window
 
 @cli.command(help="Uplink bytecode to a device. \n\n Arguments: \n\n ALIAS: device alias. \n\n BYTECODE: path to a bytecode file.")
 @click.argument("alias")
@@ -115,6 +131,8 @@ Each of the previous phases may fail in different ways and the cause can be dete
 
 The :command:`uplink` may the additional :option:`--loop times` option that specifies the number of retries during the discovery phase (each retry lasts one second).
 
+During the flashing phase the bytecode is sent in blocks of :samp:`vm_chunk` bytes, each followed by its Adler-32 checksum. Virtual machines that support windowed upload advertise it in the handshake with a :samp:`W n` line, :samp:`n` (hex) being the number of blocks they can buffer. In this case the linker keeps up to :samp:`n` blocks in flight (or fewer if the device sets :samp:`vm_window`), each prefixed by its sequence number, and sends again only the blocks answered with :samp:`RB`. Other virtual machines are served one block at a time, waiting for :samp:`OK` before sending the next one. At the end of the transfer the throughput in bytes per second is reported.
+
 
 
     """
@@ -153,6 +171,8 @@ The command: ::
 
 performs an uplink on the device of type :samp:`target` using the bytecode file at :samp:`bytecode` using the serial port :samp:`port`.
 
+The port can also be given as :samp:`tcp://host:port` to uplink over a TCP connection, for example to a device behind a serial to ethernet server.
+
     """
     _uplink_raw(target,bytecode,loop,__specs,skip_layout,layout_root,tmpdir)
 
@@ -234,7 +254,7 @@ def _link_uplink_jtag(dev,bytecode,tmpdir=None):
     vmfile = tools.get_vm_by_uid(vm_uid)
     if not vmfile or not fs.exists(vmfile):
         fatal("Can't find vm",vm_uid)
-    vm = fs.get_json(vmfile)
+    vm = tools.load_vm(vmfile)
     if not env.check_vm_compat(dev.target,vm["version"]):
         fatal("Please switch to the correct version of Zerynth or virtualize the device with a compatible VM...")
 
@@ -263,7 +283,7 @@ def _uplink_layout(dev,bytecode,dczpath=None):
         ppath = dczpath
     else:
         try:
-            bf = fs.get_json(bytecode)
+            bf = load_vbo(bytecode)
         except:
             fatal("Can't open file",bytecode)
         if "project" not in bf["info"]:
@@ -290,7 +310,7 @@ def _uplink_layout(dev,bytecode,dczpath=None):
 
 def _uplink_dev(dev,bytecode,loop,tmpdir=None):
     try:
-        bf = fs.get_json(bytecode)
+        bf = load_vbo(bytecode)
     except:
         fatal("Can't open file",bytecode)
 
@@ -302,22 +322,10 @@ def _uplink_dev(dev,bytecode,loop,tmpdir=None):
     vm_chunk = dev.get("vm_chunk",4096)
     vm_mini_chunk = dev.get("vm_mini_chunk",4096)
     vm_fragmented_upload = dev.get("vm_fragmented_upload",None)
+    # maximum number of blocks in flight, None to use what the vm advertises
+    vm_window = dev.get("vm_window",None)
 
-    if not dev.port:
-        fatal("Device has no serial port! Check that drivers are installed correctly...")
-    # open channel to dev TODO: sockets
-    conn = ConnectionInfo()
-    conn.set_serial(dev.port,**dev.connection)
-    ch = Channel(conn)
-    for i in range(3):
-        try:
-            ch.open(timeout=2)
-            break
-        except:
-                info("Probing attempt:", i + 1)
-                sleep(1)
-        else:
-            fatal("Can't open serial:",dev.port)
+    ch = _open_channel(dev)
 
     try:
         version,vmuid,chuid,target = probing(ch,dev, True if not dev.fixed_timeouts else False)
@@ -344,9 +352,11 @@ def _uplink_dev(dev,bytecode,loop,tmpdir=None):
     if not env.check_vm_compat(target,version):
         fatal("Please switch to the correct version of Zerynth or virtualize the device with a compatible VM...")
 
-    vm = fs.get_json(vms)
+    vm = tools.load_vm(vms)
 
-    symbols,_memend_or_start,_romstart,_flashspace = handshake(ch)
+    symbols,_memend_or_start,_romstart,_flashspace,window = handshake(ch)
+    if vm_window is not None:
+        window = min(window,vm_window)
 
     relocator = Relocator(bf,vm,dev)
     thebin = relocator.relocate(_memend_or_start,_romstart,tempdir=tmpdir)
@@ -363,8 +373,36 @@ def _uplink_dev(dev,bytecode,loop,tmpdir=None):
         #logger.info("Erasing flash...")
         #self.log("Erasing flash...")
 
-    # send total size
-    bsz = struct.pack("<I",totsize)
+    elapsed = _send_bytecode(ch,thebin,_flashspace,window,vm_chunk,vm_mini_chunk)
+    ch.close()
+    info("Uplink done")
+    info("Sent",totsize,"bytes in %.2f seconds (%i bytes/s)"%(elapsed,totsize/elapsed if elapsed>0 else totsize))
+
+
+def _open_channel(dev):
+    if not dev.port:
+        fatal("Device has no serial port! Check that drivers are installed correctly...")
+    # open channel to dev, serial or tcp://host:port
+    conn = ConnectionInfo()
+    conn.set_port(dev.port,**dev.connection)
+    ch = Channel(conn)
+    for i in range(3):
+        try:
+            ch.open(timeout=2)
+            break
+        except:
+            info("Probing attempt:", i + 1)
+            sleep(1)
+    else:
+        fatal("Can't open serial:",dev.port)
+    return ch
+
+
+def _send_bytecode(ch,thebin,_flashspace,window,vm_chunk,vm_mini_chunk,progress=None):
+    # sends the relocated bytecode after the handshake, returns the transfer time
+    totsize = len(thebin)
+    # send total size, the high bit selects windowed upload on vms that advertised it
+    bsz = struct.pack("<I",totsize|(UPLINK_WINDOWED if window>1 else 0))
     ch.write(bsz)
     #for b in bsz:
     #    ch.write(bytes([b]))
@@ -379,17 +417,38 @@ def _uplink_dev(dev,bytecode,loop,tmpdir=None):
         #else:
             #logger.info("%s",line)
     else:
+        ch.close()
         fatal("Can't send bytecode")
 
     #logger.info("Sending Bytecode: %i bytes (available %i)",totsize,_flashspace)
     #self.log("Sending Bytecode: "+str(totsize)+" bytes (available "+str(_flashspace)+")")
     info("Sending Bytecode:",totsize,"bytes ( available",_flashspace,")")
 
+    starttime = time.perf_counter()
+    if window>1:
+        _send_windowed(ch,thebin,vm_chunk,vm_mini_chunk,window,progress)
+    else:
+        _send_stop_and_wait(ch,thebin,vm_chunk,vm_mini_chunk,progress)
+    return time.perf_counter()-starttime
+
+
+def _read_ack(ch):
+    jattempt=0
+    line=""
+    while jattempt<200: #avoid debug messages (starting with .)
+        line=ch.readline()
+        debug("read line: %s attempt %s"%(line,str(jattempt)))
+        jattempt+=1
+        if line and not line.startswith("."):
+            break
+    return line
+
+
+def _send_stop_and_wait(ch,thebin,vm_chunk,vm_mini_chunk,progress=None):
     wrt = 0
     ll = len(thebin)
     nblock = 0
     nattempt = 0
-    jattempt = 0
     #ser.settimeout(2)
     while ll>0 and nattempt<3:
         tosend = min(ll,vm_chunk)
@@ -400,19 +459,15 @@ def _uplink_dev(dev,bytecode,loop,tmpdir=None):
             ch.write(buf[x:x+vm_mini_chunk])
         ch.write(struct.pack("<I",adler))
         #ser.flush()
-        jattempt=0
-        while jattempt<200: #avoid debug messages (starting with .)
-            line=ch.readline()
-            debug("read line: %s attempt %s"%(line,str(jattempt)))
-            jattempt+=1
-            if line and not line.startswith("."):
-                break
+        line = _read_ack(ch)
         if line=="OK\n":
             #logger.info("OK")
             nblock+=1
             wrt+=len(buf)
             ll-=tosend
             nattempt=0
+            if progress:
+                progress(wrt)
             continue
         elif line=="RB\n":
             #logger.info("ERR! resending")
@@ -420,14 +475,240 @@ def _uplink_dev(dev,bytecode,loop,tmpdir=None):
             continue
         else:
             #logger.error("Failed")
+            ch.close()
             fatal("Failed while sending bytecode",line)
     if nattempt!=0:
         ch.close()
         fatal("Too many attempts")
+
+
+def _send_windowed(ch,thebin,vm_chunk,vm_mini_chunk,window,progress=None):
+    # blocks carry their sequence number: the vm writes each block at seq*vm_chunk
+    # and acknowledges it with "OK seq" or "RB seq", so only bad blocks are sent again
+    nblocks = (len(thebin)+vm_chunk-1)//vm_chunk
+    inflight = {}
+    nextblock = 0
+    acked = 0
+    while acked<nblocks:
+        while len(inflight)<window and nextblock<nblocks:
+            _send_block(ch,thebin,nextblock,vm_chunk,vm_mini_chunk)
+            inflight[nextblock]=0
+            nextblock+=1
+        line = _read_ack(ch)
+        try:
+            res,seq = line[:2],int(line[3:].strip("\n"),16)
+        except:
+            res,seq = None,None
+        if res=="OK" and line[2]==" ":
+            if seq in inflight:
+                del inflight[seq]
+                acked+=1
+                if progress:
+                    progress(min(acked*vm_chunk,len(thebin)))
+            else:
+                debug("spurious ack for block",seq)
+        elif res=="RB" and line[2]==" ":
+            if seq not in inflight:
+                debug("spurious resend request for block",seq)
+                continue
+            inflight[seq]+=1
+            if inflight[seq]>=3:
+                ch.close()
+                fatal("Too many attempts")
+            _send_block(ch,thebin,seq,vm_chunk,vm_mini_chunk)
+        else:
+            ch.close()
+            fatal("Failed while sending bytecode",line)
+
+
+def _send_block(ch,thebin,seq,vm_chunk,vm_mini_chunk):
+    buf = struct.pack("<I",seq)+thebin[seq*vm_chunk:(seq+1)*vm_chunk]
+    adler = adler32(buf)
+    debug("sending block %i of %i bytes with crc: %x"%(seq,len(buf)-4,adler))
+    for x in range(0,len(buf),vm_mini_chunk):
+        ch.write(buf[x:x+vm_mini_chunk])
+    ch.write(struct.pack("<I",adler))
+
+
+
+@cli.command("uplink-many", help="Uplink bytecode to several devices at once. \n\n Arguments: \n\n BYTECODE: path to a bytecode file. \n\n ALIASES: device aliases, optional if --target is given.")
+@click.argument("bytecode",type=click.Path())
+@click.argument("aliases",nargs=-1)
+@click.option("--target","-t",default=None,help="uplink all attached devices with this target")
+@click.option("--loop",default=5,type=click.IntRange(1,20),help="number of retries during device discovery.")
+@click.option("--jobs","-j",default=0,type=int,help="maximum number of concurrent uplinks (default: all devices)")
+@click.option("--tmpdir","-tmp",default="",help="set temp directory")
+def uplink_many(bytecode,aliases,target,loop,jobs,tmpdir):
+    """
+.. _ztc-cmd-uplink-many:
+
+Uplink (many)
+=============
+
+The command: ::
+
+    ztc uplink-many bytecode alias1 alias2 ...
+
+uplinks the bytecode file :samp:`bytecode` to all the devices with the given aliases. With the option :option:`--target target` every attached device of type :samp:`target` is uplinked instead.
+
+Devices are discovered once at the beginning. The bytecode is relocated once for each distinct VM and memory layout and then all serial channels are driven concurrently (at most :option:`-j/--jobs n` at a time). Devices that need a manual reset are reset together, devices that prefer a jtag uplink are skipped. Resource layouts are not burned.
+
+At the end a summary table is printed with the result of each device; the command fails if at least one uplink failed.
+
+    """
+    _uplink_many(bytecode,aliases,target,loop,jobs,tmpdir)
+
+
+def _uplink_many(bytecode,aliases,target,loop,jobs,tmpdir):
+    try:
+        bf = load_vbo(bytecode)
+    except:
+        fatal("Can't open file",bytecode)
+    bcver = check_bc_incompat(bf)
+    if bcver:
+        warning("This bytecode has been generated by Zerynth version",bcver,"and may be not compatible with the running version!")
+    if not aliases and not target:
+        fatal("Specify some aliases or a target")
+
+    _dsc = Discover()
+    devs = _find_many(_dsc,aliases,target,loop)
+    if not devs:
+        fatal("No devices found")
+
+    # manual resets are asked once for all devices, then ports are discovered again
+    manual = [dev for dev in devs if dev.uplink_reset is True and not dev.preferred_uplink_with_jtag]
+    if manual:
+        info("Please reset the devices!")
+        sleep(max(dev.reset_time for dev in manual)/1000)
+        info("Searching for devices again")
+        found = _dsc.run_one(True)
+        devs = [found.get(dev.hash(),dev) for dev in devs]
+
+    results = _uplink_devices(devs,bf,tmpdir,jobs)
+
+    if env.human:
+        table = []
+        for res in results:
+            table.append([res["alias"],res["uid"],res["port"],res["vm"],res["size"],"%.2f"%res["time"],res["speed"],res["result"]])
+        log_table(table,headers=["Alias","UID","Port","VM","Bytes","Seconds","Bytes/s","Result"])
     else:
+        log_json(results)
+    failed = [res for res in results if res["result"]!="ok"]
+    if failed:
+        fatal("Uplink failed on",len(failed),"devices of",len(results))
+    info("Uplink done")
+
+
+def _find_many(_dsc,aliases,target,loop):
+    # a single discovery round per attempt, retried until all aliases are found
+    for l in range(loop):
+        found = _dsc.run_one(True)
+        if target:
+            devs = [dev for dev in found.values() if dev.target==target]
+            if devs:
+                return devs
+        else:
+            devs = []
+            for alias in aliases:
+                res = [dev for dev in found.values() if dev.alias==alias]
+                if not res:
+                    res = [dev for dev in found.values() if dev.alias and dev.alias.startswith(alias)]
+                if len(res)>1:
+                    fatal("Ambiguous alias",[x.alias for x in res])
+                if res:
+                    devs.append(res[0])
+            if len(devs)==len(aliases):
+                return devs
+        sleep(1)
+        info("attempt",l+1)
+    if target:
+        return []
+    missing = set(aliases)-set(dev.alias for dev in devs)
+    fatal("Can't find devices",list(missing))
+
+
+def _uplink_devices(devs,bf,tmpdir,jobs=0):
+    # relocated binaries are shared among devices with the same vm and memory layout
+    relocated = {}
+    rlock = threading.Lock()
+    sem = threading.Semaphore(jobs if jobs>0 else len(devs))
+    results = [None]*len(devs)
+
+    def worker(i,dev):
+        res = {
+            "alias":dev.alias,
+            "uid":dev.uid,
+            "port":dev.port,
+            "vm":None,
+            "size":0,
+            "time":0,
+            "speed":0,
+            "result":"ok"
+        }
+        with sem:
+            try:
+                if dev.preferred_uplink_with_jtag:
+                    res["result"]="skipped"
+                else:
+                    _uplink_one(dev,bf,tmpdir,relocated,rlock,res)
+            except SystemExit as e:
+                res["result"]="failed"
+            except Exception as e:
+                warning(dev.alias,":",e)
+                res["result"]="failed"
+        results[i]=res
+
+    ths = [threading.Thread(target=worker,args=(i,dev)) for i,dev in enumerate(devs)]
+    for th in ths:
+        th.start()
+    for th in ths:
+        th.join()
+    return results
+
+
+def _uplink_one(dev,bf,tmpdir,relocated,rlock,res):
+    name = dev.alias or dev.uid
+    if dev.uplink_reset=="reset":
+        dev.reset()
+    vm_chunk = dev.get("vm_chunk",4096)
+    vm_mini_chunk = dev.get("vm_mini_chunk",4096)
+    vm_window = dev.get("vm_window",None)
+    ch = _open_channel(dev)
+    try:
+        version,vmuid,chuid,target = probing(ch,dev, True if not dev.fixed_timeouts else False)
+        res["vm"]=vmuid
+        vms = tools.get_vm(vmuid,version,chuid,target)
+        if not vms:
+            fatal("No such vm for",dev.target,"with id",vmuid)
+        if not env.check_vm_compat(target,version):
+            fatal("VM",vmuid,"is not compatible with this version of Zerynth")
+        symbols,_memend_or_start,_romstart,_flashspace,window = handshake(ch)
+        if vm_window is not None:
+            window = min(window,vm_window)
+        key = (vmuid,_memend_or_start,_romstart)
+        with rlock:
+            if key not in relocated:
+                vm = tools.load_vm(vms)
+                relocator = Relocator(bf,vm,dev)
+                relocated[key] = relocator.relocate(_memend_or_start,_romstart,tempdir=tmpdir)
+            thebin = relocated[key]
+        totsize = len(thebin)
+        res["size"]=totsize
+        if totsize>_flashspace:
+            fatal("Not enough space on device")
+        step = [0]
+
+        def progress(sent):
+            pc = sent*100//totsize
+            if pc>=step[0]+25 or sent==totsize:
+                step[0]=pc
+                info(name,"sent",sent,"of",totsize,"bytes (%i%%)"%pc)
+
+        elapsed = _send_bytecode(ch,thebin,_flashspace,window,vm_chunk,vm_mini_chunk,progress)
+        res["time"]=elapsed
+        res["speed"]=int(totsize/elapsed) if elapsed>0 else totsize
+    finally:
         ch.close()
-        info("Uplink done")
-
 
 
 @cli.command(help="Generate bytecode runnable on a specific VM. \n\n Arguments: \n\n VMUID: VM identifier. \n\n BYTECODE: path to a bytecode file.")
@@ -499,6 +780,15 @@ For example, assuming a project has been compiled to the bytecode file :samp:`pr
 
 
     """
+    _link(vmuid,bytecode,include_vm,vm_ota,bc_ota,file,otavm,bin,debug_bytecode,vmfile,tmpdir)
+
+
+def do_link(vmuid,bytecode,include_vm=False,vm_ota=0,bc_ota=0,file="",otavm=False,bin=False,debug_bytecode=False,vmfile="",tmpdir=""):
+    _link(vmuid,bytecode,include_vm,vm_ota,bc_ota,file,otavm,bin,debug_bytecode,vmfile,tmpdir)
+    return file
+
+
+def _link(vmuid,bytecode,include_vm,vm_ota,bc_ota,file,otavm,bin,debug_bytecode,vmfile,tmpdir):
     vms = tools.get_vm_by_uid(vmuid)
     if not vms:
         warning("No such vm with uid",vmuid," ==> searching online...")
@@ -507,10 +797,10 @@ For example, assuming a project has been compiled to the bytecode file :samp:`pr
         if not vms:
             fatal("Unexpected error searching for vm",vmuid)
 
-    vm = fs.get_json(vms)
+    vm = tools.load_vm(vms)
 
     try:
-        bf = fs.get_json(bytecode)
+        bf = load_vbo(bytecode)
     except:
         fatal("Can't open file",bytecode)
 
@@ -529,7 +819,8 @@ For example, assuming a project has been compiled to the bytecode file :samp:`pr
             "gccopts":vm["gccopts"],
             "rodata_in_ram":vm.get("rodata_in_ram",False)
         },recursive=False))
-    dbginfo = []
+    # linker outputs are kept only for debug bytecode, otherwise a cached relocation can be used
+    dbginfo = [] if debug_bytecode else None
     thebin = relocator.relocate(-1,_romstart,dbginfo,tempdir=tmpdir)
     bcbin = thebin
 
@@ -539,7 +830,11 @@ For example, assuming a project has been compiled to the bytecode file :samp:`pr
             bf["dbg"]={}
             bf["dbg"]["address"] = hex(dbginfo[1])
             bf["dbg"]["info"] = base64.b64encode(dbgbin).decode("utf-8")
-            fs.set_json(bf,bytecode)
+            # write back in the format it was read
+            if is_binary_vbo(bytecode):
+                save_vbo(bf,bytecode)
+            else:
+                fs.set_json(vbo_to_json(bf),bytecode)
 
     if include_vm:
         if vm_ota or bc_ota:
@@ -602,14 +897,3 @@ def ota_prepare_vm(vm):
             bin.extend(bb)
         return base64.b64encode(bin).decode("utf-8")
         # multi file vm
-
-
-def adler32(buf):
-    a = 1
-    b = 0
-    for x in buf:
-        a = (a+x)%65521
-        b = (b+a)%65521
-    return (b<<16)|a
-
-
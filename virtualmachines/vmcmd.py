@@ -33,8 +33,19 @@ import re
 import struct
 
 def download_vm(uid,dev_type=None):
-    res = zget(url=env.api.vm+"/"+uid)
-    rj = res.json()
+    # vms can be large: stream them to disk, resuming if the connection drops
+    vmtmp = fs.path(env.tmp,"vm_"+uid+".json")
+    try:
+        download_url(env.api.vm+"/"+uid,vmtmp,auth=True,progress=download_progress("Downloading vm"))
+        rj = fs.get_json(vmtmp)
+    except DownloadError as e:
+        # report the error sent by the server (e.g. unknown vm or expired token)
+        fatal("Can't download virtual machine:",e.message or e)
+    except Exception as e:
+        fatal("Can't download virtual machine:",e)
+    finally:
+        if fs.exists(vmtmp):
+            fs.rm_file(vmtmp)
     if rj["status"]=="success":
         vmd = rj["data"]
         if not dev_type:
@@ -48,6 +59,7 @@ def download_vm(uid,dev_type=None):
         fs.makedirs(vmpath)
         vmname = uid+"_"+vmd["version"]+"_"+vmd["hash_features"]+"_"+vmd["rtos"]+".vm"
         fs.set_json(vmd, fs.path(vmpath,vmname))
+        vmstore.add(fs.path(vmpath,vmname))
         info("Downloaded Virtual Machine in", vmpath,"with uid",uid)
     else:
         fatal("Can't download virtual machine:", rj["message"])
@@ -169,9 +181,9 @@ def _own_vm(vm_uid):
 def _vmuid_dev(dev):
     if not dev.port:
         fatal("Device has no serial port! Check that drivers are installed correctly...")
-    # open channel to dev TODO: sockets
+    # open channel to dev, serial or tcp://host:port
     conn = ConnectionInfo()
-    conn.set_serial(dev.port,**dev.connection)
+    conn.set_port(dev.port,**dev.connection)
     ch = Channel(conn)
     try:
         ch.open(timeout=2)
@@ -417,7 +429,7 @@ Additional options can be provided:
     if not vm_file:
         fatal("VM does not exist, create one first")
     try:
-        vmj = fs.get_json(fs.path(vm_file))
+        vmj = tools.load_vm(vm_file)
         if path:
             vmpath = path
         else:
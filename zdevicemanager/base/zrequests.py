@@ -6,6 +6,10 @@ from .cfg import *
 from .fs import *
 import time
 import os
+import threading
+import urllib.parse
+import requests.adapters
+import urllib3.exceptions
 
 TimeoutException = requests.exceptions.Timeout
 if int(os.environ.get("ZERYNTH_TESTMODE",0))!=0:
@@ -17,6 +21,82 @@ else:
 
 _default_timeout=5
 _default_retries=3
+# seconds before the first retry, doubled at each attempt
+_default_backoff=0.5
+# methods that can be sent again after a response was lost or was a server error
+_idempotent_methods = ("GET","HEAD","OPTIONS","DELETE")
+
+_session = None
+_session_lock = threading.Lock()
+_host_limits = {}
+
+
+def _setting(name,envvar,default):
+    # environment variable first, then configuration (if already loaded)
+    if envvar in os.environ:
+        return int(os.environ[envvar])
+    try:
+        return int(env.var.get(name,default))
+    except AttributeError:
+        return default
+
+def get_session():
+    # process wide session: connections are kept alive and reused by all requests
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                pool_size = _setting("http_pool_size","ZERYNTH_HTTP_POOL_SIZE",10)
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,pool_maxsize=pool_size)
+                session.mount("https://",adapter)
+                session.mount("http://",adapter)
+                _session = session
+    return _session
+
+def _host_limit(url):
+    # bounds the requests in flight towards the same host
+    host = urllib.parse.urlsplit(url).netloc
+    if host not in _host_limits:
+        with _session_lock:
+            if host not in _host_limits:
+                _host_limits[host] = threading.BoundedSemaphore(_setting("http_host_limit","ZERYNTH_HTTP_HOST_LIMIT",8))
+    return _host_limits[host]
+
+def _not_sent(exc):
+    # True if the request failed before reaching the server (connection refused, dns, connect timeout)
+    if isinstance(exc,requests.exceptions.ConnectTimeout):
+        return True
+    reason = exc.args[0] if exc.args else None
+    reason = getattr(reason,"reason",reason)
+    return isinstance(reason,urllib3.exceptions.NewConnectionError)
+
+def zrequest(method,url,timeout=_default_timeout,retries=_default_retries,backoff=_default_backoff,**kwargs):
+    # make at most retries attempts with exponential backoff. Timeouts, dropped connections and
+    # server errors are retried for idempotent methods only: a POST or PUT may have been executed,
+    # so it is sent again only if the connection could not be established.
+    session = get_session()
+    kwargs.setdefault("proxies",env.proxies)
+    idempotent = method.upper() in _idempotent_methods
+    for x in range(retries):
+        if x:
+            sleep(backoff*2**(x-1))
+        try:
+            with _host_limit(url):
+                res = session.request(method,url,timeout=timeout,**kwargs)
+        except (TimeoutException,requests.exceptions.ConnectionError) as e:
+            if x==retries-1 or not (idempotent or _not_sent(e)):
+                raise
+            if isinstance(e,TimeoutException):
+                warning("Timeout! Retrying...")
+                timeout=timeout*2
+            else:
+                warning("Connection error! Retrying...")
+            continue
+        if res.status_code<500 or not idempotent or x==retries-1:
+            return res
+        warning("Server error",res.status_code,"! Retrying...")
+        res.close()
 
 
 ################### json special type encoder
@@ -32,13 +112,7 @@ def zpost(url,data,headers={},auth=True,timeout=_default_timeout):
         token = get_token()
         hh.update({"Authorization": "Bearer "+token})
     hh.update(headers)
-    for x in range(_default_retries):
-        try:
-            return requests.post(url=url, headers=hh, data=json.dumps(data, cls=ZjsonEncoder),timeout=timeout,verify=_ssl_verify,proxies=env.proxies)
-        except TimeoutException:
-            warning("Timeout! Retrying...")
-            timeout=timeout*2
-    raise TimeoutException
+    return zrequest("POST",url, headers=hh, data=json.dumps(data, cls=ZjsonEncoder),timeout=timeout,verify=_ssl_verify)
 
 def zget(url,headers={},params={},auth=True,token=None,stream=False,timeout=_default_timeout):
     hh = {"Content-Type": "application/json","User-agent":env.user_agent}
@@ -50,13 +124,7 @@ def zget(url,headers={},params={},auth=True,token=None,stream=False,timeout=_def
                 token = get_token()
     if token: hh.update({"Authorization": "Bearer "+token})
     hh.update(headers)
-    for x in range(_default_retries):
-        try:
-            return requests.get(url=url, headers=hh,timeout=timeout,params=params,verify=_ssl_verify,stream=stream,proxies=env.proxies)
-        except TimeoutException:
-            warning("Timeout! Retrying...")
-            timeout=timeout*2
-    raise TimeoutException
+    return zrequest("GET",url, headers=hh,timeout=timeout,params=params,stream=stream,verify=_ssl_verify)
 
 def zdelete(url,headers={},auth=True,timeout=_default_timeout):
     hh = {"Content-Type": "application/json","User-agent":env.user_agent}
@@ -64,13 +132,7 @@ def zdelete(url,headers={},auth=True,timeout=_default_timeout):
         token = get_token()
         hh.update({"Authorization": "Bearer "+token})
     hh.update(headers)
-    for x in range(_default_retries):
-        try:
-            return requests.delete(url=url, headers=hh,timeout=timeout,verify=_ssl_verify,proxies=env.proxies)
-        except TimeoutException:
-            warning("Timeout! Retrying...")
-            timeout=timeout*2
-    raise TimeoutException
+    return zrequest("DELETE",url, headers=hh,timeout=timeout,verify=_ssl_verify)
 
 def zput(url, data,headers={},auth=True,timeout=_default_timeout):
     hh = {"Content-Type": "application/json","User-agent":env.user_agent}
@@ -78,16 +140,10 @@ def zput(url, data,headers={},auth=True,timeout=_default_timeout):
         token = get_token()
         hh.update({"Authorization": "Bearer "+token})
     hh.update(headers)
-    for x in range(_default_retries):
-        try:
-            return requests.put(url=url, headers=hh, data=json.dumps(data, cls=ZjsonEncoder),timeout=timeout,verify=_ssl_verify,proxies=env.proxies)
-        except TimeoutException:
-            warning("Timeout! Retrying...")
-            timeout=timeout*2
-    raise TimeoutException
+    return zrequest("PUT",url, headers=hh, data=json.dumps(data, cls=ZjsonEncoder),timeout=timeout,verify=_ssl_verify)
 
 def zgetraw(url):
-    r = requests.get(url,stream=True)
+    r = zrequest("GET",url,stream=True,timeout=None)
     return r.raw
 
 def get_token(continue_if_none=False):
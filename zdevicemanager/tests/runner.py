@@ -15,6 +15,7 @@ from .test_gates import GatesTestSuite
 from .test_job import JobTestSuite
 from .test_export import ExportsTestSuite
 from .test_workspace import WorkspaceTestSuite
+from .test_zrequests import ZrequestsTestSuite
 
 # initialize the test suite
 loader = unittest.TestLoader()
@@ -30,6 +31,7 @@ suite.addTests(loader.loadTestsFromTestCase(FotaTestSuite))
 suite.addTests(loader.loadTestsFromTestCase(GatesTestSuite))
 suite.addTests(loader.loadTestsFromTestCase(JobTestSuite))
 suite.addTests(loader.loadTestsFromTestCase(ExportsTestSuite))
+suite.addTests(loader.loadTestsFromTestCase(ZrequestsTestSuite))
 
 
 # initialize a runner, pass it your suite and run it
@@ -0,0 +1,71 @@
+import http.server
+import socket
+import threading
+import unittest
+from unittest import mock
+
+import requests
+
+from zdevicemanager.base import zrequests
+from zdevicemanager.base.cfg import env
+
+
+class FlakyHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.hits.append(self.command)
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        body = b"{}"
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+class ZrequestsTestSuite(unittest.TestCase):
+    """Retry policy of the zdm http helpers."""
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+        self.server.hits = []
+        self.server.statuses = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:%i/" % self.server.server_address[1]
+        mock.patch.object(env, "proxies", None, create=True).start()
+        mock.patch.object(zrequests, "sleep", lambda n: None).start()
+        mock.patch.object(zrequests, "warning", lambda *args: None).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_keep_alive_and_retry(self):
+        self.server.statuses = [503]
+        res = zrequests.zrequest("GET", self.url)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.server.hits, ["GET", "GET"])
+
+    def test_post_not_repeated(self):
+        self.server.statuses = [503]
+        res = zrequests.zrequest("POST", self.url, data="{}")
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(self.server.hits, ["POST"])
+
+    def test_connect_error(self):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        url = "http://127.0.0.1:%i/" % sock.getsockname()[1]
+        sock.close()
+        with mock.patch.object(zrequests, "sleep") as sleep:
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                zrequests.zrequest("POST", url, data="{}", retries=3)
+        self.assertEqual(sleep.call_count, 2)
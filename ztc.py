@@ -62,6 +62,15 @@ All commands can produce tagged and untagged messages. Tagged messages are prefi
 Untagged messages are not colored and not prefixed. The result of a command  generally consists of one or more untagged messages. If the :option:`-J` option is given without :option:`--pretty`, almost every command output is a single untagged line.
 
 
+Network
+-------
+
+REST calls share a pool of keep-alive connections. GET and DELETE requests failing with a timeout, a connection error or a server error (5xx) are attempted up to three times in total, waiting longer after each failure. POST and PUT requests may have been executed by the server in those cases, so they are attempted again only when the connection to the server could not be established. The pool can be tuned with the following environment variables (or the configuration keys in brackets):
+
+* :envvar:`ZERYNTH_HTTP_POOL_SIZE` (:samp:`http_pool_size`), the number of connections kept open for each host (default 10).
+* :envvar:`ZERYNTH_HTTP_HOST_LIMIT` (:samp:`http_host_limit`), the maximum number of concurrent requests to the same host (default 8).
+
+
 Directories
 -----------
 